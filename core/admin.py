@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import MaintenanceRequest, EmailConfiguration, RequestHistory, UserProfile
+from .models import MaintenanceRequest, EmailConfiguration, RequestHistory, UserProfile, NotificationOutbox
 
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
@@ -25,3 +25,8 @@ admin.site.register(User, CustomUserAdmin)
 admin.site.register(MaintenanceRequest)
 admin.site.register(EmailConfiguration)
 admin.site.register(RequestHistory)
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'subject', 'recipient_email', 'recipient_key', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
@@ -0,0 +1,283 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import Lag
+from django.utils import timezone
+
+from . import archive, changes as request_changes
+from .models import AnalyticsWatermark, ArchivedRequest, MaintenanceRequest, RequestChange, RequestHistory, StageRollup
+from .workflow import TRANSITIONS
+
+# The stage each history action moves a request into. A request waits in OPEN (for
+# production) from created_at; imported histories may also carry an explicit CREATED row.
+STAGE_ENTERED = {'CREATED': 'OPEN', **{t.history_action: t.target for t in TRANSITIONS.values()}}
+STAGES = [value for value, _ in MaintenanceRequest.STATUS_CHOICES if value not in MaintenanceRequest.CLOSED_STATUSES]
+STAGE_LABELS = dict(MaintenanceRequest.STATUS_CHOICES)
+
+DEFAULT_SLA_HOURS = {
+    'OPEN': 24,
+    'WAITING_PROD': 24,
+    'WAITING_MAINT': 48,
+    'WAITING_MANAGER': 72,
+    'IN_EXECUTION': 168,
+}
+SLA_HOURS = getattr(settings, 'STAGE_SLA_HOURS', DEFAULT_SLA_HOURS)
+
+DIMENSIONS = [value for value, _ in StageRollup.DIMENSION_CHOICES]
+
+# Histogram buckets grow by 2**(1/4): a percentile read from them is within ~9% of the
+# exact value, and a year fits in ~100 buckets
+BUCKET_BASE = 2 ** 0.25
+WATERMARK = 'stage_rollups'
+BATCH_SIZE = 500
+
+
+def bucket(seconds):
+    return str(int(math.log(seconds, BUCKET_BASE))) if seconds >= 1 else '0'
+
+
+def bucket_seconds(name):
+    # Geometric middle of the bucket
+    return BUCKET_BASE ** (int(name) + 0.5)
+
+
+def percentile(histogram, fraction):
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for name in sorted(histogram, key=int):
+        seen += histogram[name]
+        if seen >= fraction * total:
+            return bucket_seconds(name)
+
+
+def breached(stage, seconds):
+    return stage in SLA_HOURS and seconds > SLA_HOURS[stage] * 3600
+
+
+# Stage durations: each transition ends the stage the previous one (or the creation)
+# started. Only the requests given are read, through the (request, timestamp) index.
+
+def _lagged(rows):
+    # LAG() for backends without window functions (MySQL < 8): one ordered pass
+    previous = None
+    for request_id, *row in rows:
+        if previous and previous[0] == request_id:
+            yield (*row, previous[2], previous[3])
+        else:
+            yield (*row, None, None)
+        previous = (request_id, *row)
+
+
+def stage_rows(request_ids):
+    # Yields (history id, stage, ended at, seconds, request dimensions)
+    history = RequestHistory.objects.filter(request_id__in=request_ids, action__in=STAGE_ENTERED)
+    fields = ['id', 'action', 'timestamp', 'request__created_at', 'request__equipment', 'request__process',
+              'request__assigned_to']
+    if connection.features.supports_over_clause:
+        order = [F('timestamp').asc(), F('id').asc()]
+        rows = history.annotate(
+            previous_action=Window(Lag('action'), partition_by=F('request_id'), order_by=order),
+            previous_at=Window(Lag('timestamp'), partition_by=F('request_id'), order_by=order),
+        ).values_list(*fields, 'previous_action', 'previous_at')
+    else:
+        rows = _lagged(history.order_by('request_id', 'timestamp', 'id').values_list('request_id', *fields))
+
+    return _stage_rows(rows)
+
+
+def archived_stage_rows(request_ids):
+    # stage_rows() for archived requests, from the history rows they carry
+    def rows():
+        for obj in archive.load(request_ids, with_history=True).values():
+            history = sorted(
+                (entry for entry in obj.archived_history if entry.action in STAGE_ENTERED),
+                key=lambda entry: (entry.timestamp, entry.pk),
+            )
+            previous_action = started = None
+            for entry in history:
+                yield (entry.pk, entry.action, entry.timestamp, obj.created_at, obj.equipment, obj.process,
+                       obj.assigned_to_id, previous_action, started)
+                previous_action, started = entry.action, entry.timestamp
+
+    return _stage_rows(rows())
+
+
+def _stage_rows(rows):
+    for pk, action, ended, created_at, equipment, process, assignee, previous_action, started in rows:
+        if action == 'CREATED':
+            continue
+        stage = STAGE_ENTERED[previous_action] if previous_action else 'OPEN'
+        seconds = max((ended - (started or created_at)).total_seconds(), 0)
+        yield pk, stage, ended, seconds, {
+            'total': '',
+            'equipment': equipment,
+            'process': process,
+            'assigned_to': str(assignee or ''),
+        }
+
+
+def accumulate(rows, totals=None):
+    totals = totals if totals is not None else defaultdict(
+        lambda: {'count': 0, 'total_seconds': 0.0, 'breaches': 0, 'histogram': defaultdict(int)}
+    )
+    for _, stage, ended, seconds, keys in rows:
+        day = timezone.localdate(ended)
+        for dimension, key in keys.items():
+            total = totals[(dimension, day, stage, key)]
+            total['count'] += 1
+            total['total_seconds'] += seconds
+            total['breaches'] += breached(stage, seconds)
+            total['histogram'][bucket(seconds)] += 1
+    return totals
+
+
+def apply_totals(totals):
+    # Adds the totals to the rollup rows, creating the missing ones
+    if not totals:
+        return
+    existing = {
+        (row.dimension, row.day, row.stage, row.key): row
+        for row in StageRollup.objects.filter(
+            dimension__in={key[0] for key in totals},
+            day__in={key[1] for key in totals},
+            stage__in={key[2] for key in totals},
+        )
+        if (row.dimension, row.day, row.stage, row.key) in totals
+    }
+    to_create, to_update = [], []
+    for (dimension, day, stage, key), total in totals.items():
+        row = existing.get((dimension, day, stage, key))
+        if row is None:
+            row = StageRollup(dimension=dimension, day=day, stage=stage, key=key)
+            to_create.append(row)
+        else:
+            to_update.append(row)
+        row.count += total['count']
+        row.total_seconds += total['total_seconds']
+        row.breaches += total['breaches']
+        for name, count in total['histogram'].items():
+            row.histogram[name] = row.histogram.get(name, 0) + count
+    StageRollup.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    StageRollup.objects.bulk_update(to_update, ['count', 'total_seconds', 'breaches', 'histogram'], batch_size=BATCH_SIZE)
+
+
+# Maintenance: refresh() folds in the history written since the watermark, a position in
+# the change log (core.changes), which hands out entries in commit order, so a
+# transition that commits late is never skipped.
+
+def refresh(limit=BATCH_SIZE):
+    # Returns the number of stage durations added
+    added = 0
+    while True:
+        entries = None
+        with transaction.atomic():
+            watermark = AnalyticsWatermark.objects.select_for_update().filter(name=WATERMARK).first()
+            if watermark is not None:
+                try:
+                    entries, cursor, has_more = request_changes.read(watermark.value, limit)
+                except request_changes.CursorExpired:
+                    pass
+            if entries is not None:
+                new_ids = {entry.object_id for entry in entries if entry.model == 'history' and not entry.deleted}
+                if new_ids:
+                    request_ids = set(RequestHistory.objects.filter(pk__in=new_ids).values_list('request_id', flat=True))
+                    rows = [row for row in stage_rows(request_ids) if row[0] in new_ids]
+                    apply_totals(accumulate(rows))
+                    added += len(rows)
+                watermark.value = cursor
+                watermark.save(update_fields=['value'])
+        if entries is None:
+            # First run, or the log was pruned past the watermark: history older than the
+            # change log is only reachable by a full pass, run outside this transaction
+            return rebuild()
+        if not has_more:
+            return added
+
+
+def rebuild():
+    # Recomputes every rollup from the whole history, archived requests included, in
+    # batches of requests. Each batch is a short read; the totals stay in memory (a few
+    # per day and key), so the write lock is only taken to swap them in at the end.
+    cursor = request_changes.current_cursor()
+    totals, added, last = None, 0, 0
+    while True:
+        with transaction.atomic():
+            # One id range from both tables in one transaction: archiving and restoring move
+            # a request in a single transaction, so each one is read exactly once
+            live = list(MaintenanceRequest.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+            archived = list(ArchivedRequest.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+            if not live and not archived:
+                break
+            full = [ids[-1] for ids in (live, archived) if len(ids) == BATCH_SIZE]
+            last = min(full) if full else max(live[-1:] + archived[-1:])
+            rows = list(stage_rows([pk for pk in live if pk <= last]))
+            # History committed while we read is past the cursor: the next refresh() counts it
+            late = set(RequestChange.objects.filter(
+                seq__gt=cursor, model='history', object_id__in=[row[0] for row in rows],
+            ).values_list('object_id', flat=True))
+            rows = [row for row in rows if row[0] not in late]
+            # Archived history no longer changes
+            rows += archived_stage_rows([pk for pk in archived if pk <= last])
+        totals = accumulate(rows, totals)
+        added += len(rows)
+    with transaction.atomic():
+        # Waits for a refresh() in progress; the next one continues from cursor
+        AnalyticsWatermark.objects.select_for_update().filter(name=WATERMARK).first()
+        StageRollup.objects.all().delete()
+        apply_totals(totals)
+        AnalyticsWatermark.objects.update_or_create(name=WATERMARK, defaults={'value': cursor})
+    return added
+
+
+# Reads: a few rows per day and key, merged in Python
+
+def summarize(dimension='total', since=None, until=None, stage=None):
+    rollups = StageRollup.objects.filter(dimension=dimension)
+    if since:
+        rollups = rollups.filter(day__gte=since)
+    if until:
+        rollups = rollups.filter(day__lte=until)
+    if stage:
+        rollups = rollups.filter(stage=stage)
+
+    merged = defaultdict(lambda: {'count': 0, 'total_seconds': 0.0, 'breaches': 0, 'histogram': defaultdict(int)})
+    for stage_value, key, count, total_seconds, breaches, histogram in rollups.values_list(
+        'stage', 'key', 'count', 'total_seconds', 'breaches', 'histogram',
+    ):
+        total = merged[(stage_value, key)]
+        total['count'] += count
+        total['total_seconds'] += total_seconds
+        total['breaches'] += breaches
+        for name, value in histogram.items():
+            total['histogram'][name] += value
+
+    labels = {}
+    if dimension == 'assigned_to':
+        ids = [int(key) for _, key in merged if key]
+        labels = {str(pk): username for pk, username in User.objects.filter(pk__in=ids).values_list('pk', 'username')}
+
+    results = []
+    for (stage_value, key), total in merged.items():
+        p50, p90 = percentile(total['histogram'], 0.5), percentile(total['histogram'], 0.9)
+        results.append({
+            'stage': stage_value,
+            'stage_display': STAGE_LABELS.get(stage_value, stage_value),
+            'key': key,
+            'label': labels.get(key, key),
+            'count': total['count'],
+            'avg_seconds': round(total['total_seconds'] / total['count']) if total['count'] else None,
+            'p50_seconds': round(p50) if p50 is not None else None,
+            'p90_seconds': round(p90) if p90 is not None else None,
+            'sla_seconds': SLA_HOURS[stage_value] * 3600 if stage_value in SLA_HOURS else None,
+            'breaches': total['breaches'],
+            'breach_rate': round(total['breaches'] / total['count'], 4) if total['count'] else 0,
+        })
+    order = {value: i for i, value in enumerate(STAGES)}
+    results.sort(key=lambda row: (order.get(row['stage'], len(order)), row['key']))
+    return results
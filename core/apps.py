@@ -1,6 +1,37 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+
+
+def restore_search_index(using, **kwargs):
+    # SQLite migrations that rebuild core_maintenancerequest drop the FTS triggers
+    from django.db import connections
+    from .search import SQLITE_FTS_TABLE, install_index
+
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and SQLITE_FTS_TABLE in connection.introspection.table_names():
+        install_index(connection)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from rest_framework.authtoken.models import Token
+        from . import authentication, changes, directory, metrics
+        from .models import MaintenanceRequest, RequestHistory, UserProfile
+
+        post_migrate.connect(restore_search_index, sender=self)
+        connection_created.connect(metrics.install, dispatch_uid='metrics-install')
+        for model in (User, UserProfile):
+            post_save.connect(directory.invalidate, sender=model, dispatch_uid=f'directory-save-{model.__name__}')
+            post_delete.connect(directory.invalidate, sender=model, dispatch_uid=f'directory-delete-{model.__name__}')
+            post_save.connect(authentication.on_user_change, sender=model, dispatch_uid=f'token-save-{model.__name__}')
+            post_delete.connect(authentication.on_user_change, sender=model, dispatch_uid=f'token-delete-{model.__name__}')
+        post_save.connect(authentication.on_token_change, sender=Token, dispatch_uid='token-save-Token')
+        post_delete.connect(authentication.on_token_change, sender=Token, dispatch_uid='token-delete-Token')
+        for model in (MaintenanceRequest, RequestHistory):
+            post_save.connect(changes.on_save, sender=model, dispatch_uid=f'changes-save-{model.__name__}')
+            post_delete.connect(changes.on_delete, sender=model, dispatch_uid=f'changes-delete-{model.__name__}')
@@ -0,0 +1,167 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import serializers
+from django.db import transaction
+from django.utils import timezone
+
+from . import changes as request_changes, stats as request_stats
+from .importer import keep_timestamps
+from .models import ArchivedRequest, MaintenanceRequest, RequestHistory
+from .search import TOKEN_RE, words_condition
+
+# Closed requests untouched for this long are moved out of the hot tables
+ARCHIVE_AFTER_DAYS = getattr(settings, 'ARCHIVE_AFTER_DAYS', 365)
+# Requests per transaction: each batch locks only its own rows, briefly
+BATCH_SIZE = 200
+
+REQUEST_MODEL = MaintenanceRequest._meta.label_lower
+HISTORY_MODEL = RequestHistory._meta.label_lower
+
+
+def _dump(obj):
+    fields = serializers.serialize('python', [obj])[0]['fields']
+    # Full precision: DjangoJSONEncoder would cut datetimes to milliseconds
+    return {name: value.isoformat() if isinstance(value, datetime) else value for name, value in fields.items()}
+
+
+def _load(model, pk, fields):
+    return next(serializers.deserialize('python', [{'model': model, 'pk': pk, 'fields': fields}])).object
+
+
+# Moving out
+
+def archive_batch(cutoff, batch_size=BATCH_SIZE):
+    # Archives up to batch_size closed requests last changed before cutoff; returns how many
+    with transaction.atomic():
+        ids = list(
+            MaintenanceRequest.objects.filter(status__in=MaintenanceRequest.CLOSED_STATUSES, updated_at__lt=cutoff)
+            .order_by('updated_at').values_list('pk', flat=True)[:batch_size]
+        )
+        # Re-read under lock: a request reopened or edited meanwhile is left alone
+        objs = list(
+            MaintenanceRequest.objects.select_for_update()
+            .filter(pk__in=ids, status__in=MaintenanceRequest.CLOSED_STATUSES, updated_at__lt=cutoff)
+        )
+        if not objs:
+            return 0
+        ids = [obj.pk for obj in objs]
+        history = {}
+        for entry in RequestHistory.objects.filter(request_id__in=ids).order_by('timestamp', 'id'):
+            history.setdefault(entry.request_id, []).append({'pk': entry.pk, 'fields': _dump(entry)})
+
+        ArchivedRequest.objects.bulk_create([
+            ArchivedRequest(
+                id=obj.pk, status=obj.status, title=obj.title, problem_description=obj.problem_description,
+                equipment=obj.equipment, process=obj.process, requester_id=obj.requester_id, created_at=obj.created_at,
+                data=_dump(obj), history=history.get(obj.pk, []),
+            )
+            for obj in objs
+        ])
+        deltas = Counter()
+        for obj in objs:
+            deltas.subtract(request_stats.snapshot(obj))
+        request_stats.apply_deltas(deltas)
+        request_changes.record('history', [entry['pk'] for entries in history.values() for entry in entries], deleted=True)
+        request_changes.record('request', ids, deleted=True)
+        with request_changes.muted():
+            MaintenanceRequest.objects.filter(pk__in=ids).delete()
+    return len(objs)
+
+
+def archive_closed(days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, limit=None):
+    cutoff = timezone.now() - timedelta(days=days)
+    total = 0
+    while limit is None or total < limit:
+        moved = archive_batch(cutoff, batch_size if limit is None else min(batch_size, limit - total))
+        total += moved
+        if moved < batch_size:
+            break
+    return total
+
+
+# Back into the live tables. Uses keep_timestamps(): run it from a management command,
+# not from a process serving requests.
+
+@transaction.atomic
+def restore(ids):
+    archived = list(ArchivedRequest.objects.select_for_update().filter(pk__in=ids))
+    if not archived:
+        return []
+    users = set(User.objects.filter(
+        pk__in={value for item in archived for value in _user_ids(item)}
+    ).values_list('pk', flat=True))
+
+    objs, history = [], []
+    for item in archived:
+        obj = _load(REQUEST_MODEL, item.pk, item.data)
+        if obj.assigned_to_id not in users:
+            obj.assigned_to_id = None
+        objs.append(obj)
+        for entry in item.history:
+            entry = _load(HISTORY_MODEL, entry['pk'], entry['fields'])
+            if entry.actor_id not in users:
+                entry.actor_id = None
+            history.append(entry)
+
+    with keep_timestamps(MaintenanceRequest, 'created_at', 'updated_at'), keep_timestamps(RequestHistory, 'timestamp'):
+        MaintenanceRequest.objects.bulk_create(objs)
+        RequestHistory.objects.bulk_create(history)
+    deltas = Counter()
+    for obj in objs:
+        deltas.update(request_stats.snapshot(obj))
+    request_stats.apply_deltas(deltas)
+    request_changes.record('request', [obj.pk for obj in objs])
+    request_changes.record('history', [entry.pk for entry in history])
+    ArchivedRequest.objects.filter(pk__in=[item.pk for item in archived]).delete()
+    return [obj.pk for obj in objs]
+
+
+def _user_ids(item):
+    # Users may have been deleted while the request sat in the archive
+    yield item.data.get('assigned_to')
+    for entry in item.history:
+        yield entry['fields'].get('actor')
+
+
+# Reading: archived rows become unsaved MaintenanceRequest instances, so the API
+# serializes them like live ones
+
+def filter_archived(queryset, status=None, search=None):
+    if status:
+        queryset = queryset.filter(status=status)
+    if search:
+        if search.isdigit():
+            queryset = queryset.filter(id=search)
+        else:
+            # No full-text index on the archive: the same columns and words as the live
+            # search, matched with icontains, is enough for occasional lookups
+            tokens = TOKEN_RE.findall(search)
+            queryset = queryset.filter(words_condition(tokens)) if tokens else queryset.none()
+    return queryset
+
+
+def load(ids, with_history=False):
+    # {id: MaintenanceRequest} for the archived ids, with users attached (two queries)
+    archived = list(ArchivedRequest.objects.filter(pk__in=ids).defer(*([] if with_history else ['history'])))
+    objs = {}
+    for item in archived:
+        obj = _load(REQUEST_MODEL, item.pk, item.data)
+        obj.archived = True
+        obj.archived_at = item.archived_at
+        if with_history:
+            obj.archived_history = [_load(HISTORY_MODEL, entry['pk'], entry['fields']) for entry in item.history]
+        objs[obj.pk] = obj
+
+    user_ids = {obj.requester_id for obj in objs.values()} | {obj.assigned_to_id for obj in objs.values()}
+    for obj in objs.values():
+        user_ids.update(entry.actor_id for entry in getattr(obj, 'archived_history', []))
+    users = User.objects.in_bulk(user_ids - {None})
+    for obj in objs.values():
+        obj.requester = users.get(obj.requester_id)
+        obj.assigned_to = users.get(obj.assigned_to_id)
+        for entry in getattr(obj, 'archived_history', []):
+            entry.actor = users.get(entry.actor_id)
+    return objs
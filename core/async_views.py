@@ -0,0 +1,176 @@
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.urls import URLPattern
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from . import directory
+from .authentication import CachedTokenAuthentication
+from .models import MaintenanceRequest
+from .pagination import RequestCursorPagination
+from .views import MaintenanceRequestViewSet, UserViewSet
+
+# GETs of the read-heavy routes on the async ORM, for the ASGI app (maintenance_system.asgi):
+# a worker keeps taking requests while others wait on the database. The handlers reuse the
+# viewsets' filters, validators and serializers. Whatever they do not cover (writes,
+# session auth, the browsable API, cursor pages, archive listings, errors) returns None
+# and is served by the sync view, in a thread.
+
+
+def _token_key(request):
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != CachedTokenAuthentication.keyword.lower().encode():
+        return None
+    try:
+        return auth[1].decode()
+    except UnicodeError:
+        return None
+
+
+def _wants_json(request):
+    return 'format' not in request.GET and 'text/html' not in request.headers.get('Accept', '')
+
+
+def async_reads(sync_view, handler):
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET' and 'format' not in kwargs and _wants_json(request):
+            key = _token_key(request)
+            auth = key and await CachedTokenAuthentication().aauthenticate_credentials(key)
+            if auth:
+                drf_request = Request(request)
+                drf_request.user, drf_request.auth = auth
+                try:
+                    response = await handler(drf_request, *args, **kwargs)
+                except APIException:
+                    response = None
+                if response is not None:
+                    return response
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    return view
+
+
+def _viewset(cls, request, action, **kwargs):
+    return cls(request=request, action=action, args=(), kwargs=kwargs, format_kwarg=None)
+
+
+def _render(response, request):
+    # What APIView.finalize_response() does for a JSON client
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = JSONRenderer.media_type
+    response.renderer_context = {'request': request, 'response': response}
+    patch_vary_headers(response, ['Accept'])
+    return response.render()
+
+
+async def _conditional(view, request, etag, last_modified, render):
+    response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = await render()
+        if response is None:
+            return None
+        response = _render(response, request)
+    return view.add_validators(response, etag, last_modified)
+
+
+async def _paginate(pagination, queryset, request):
+    # PageNumberPagination.paginate_queryset() with the COUNT and the page read asynchronously
+    pagination.request = request
+    paginator = pagination.django_paginator_class(queryset, pagination.get_page_size(request))
+    paginator.count = await queryset.acount()
+    try:
+        pagination.page = paginator.page(pagination.get_page_number(request, paginator))
+    except InvalidPage:
+        return None
+    pagination.page.object_list = [obj async for obj in pagination.page.object_list]
+    return list(pagination.page)
+
+
+# Requests
+
+async def request_list(request):
+    view = _viewset(MaintenanceRequestViewSet, request, 'list')
+    if view.includes_archive() or RequestCursorPagination.is_requested(request):
+        return None
+    validators = await view.filter_requests(MaintenanceRequest.objects.order_by()).aaggregate(**view.LIST_VALIDATORS)
+
+    async def render():
+        # Built in a thread: a ranked search counts its matches first (core.search)
+        queryset = await sync_to_async(view.get_queryset)()
+        page = await _paginate(view.paginator, queryset, request)
+        if page is None:
+            return None
+        return view.paginator.get_paginated_response(view.get_serializer(page, many=True).data)
+
+    return await _conditional(view, request, view.list_etag(validators), None, render)
+
+
+async def request_detail(request, pk):
+    if not str(pk).isdigit():
+        return None
+    view = _viewset(MaintenanceRequestViewSet, request, 'retrieve', pk=pk)
+    row = await view.detail_validators(pk).afirst()
+    if row is None:
+        # Archived or missing
+        return None
+    etag, last_modified = view.detail_etag(pk, *row)
+
+    async def render():
+        obj = await view.get_queryset().filter(pk=pk).afirst()
+        return Response(view.get_serializer(obj).data) if obj is not None else None
+
+    return await _conditional(view, request, etag, last_modified, render)
+
+
+async def request_board(request):
+    view = _viewset(MaintenanceRequestViewSet, request, 'board')
+    paginator = RequestCursorPagination()
+    limit = paginator.get_page_size(request)
+    counts, ranked = view.board_queries(limit)
+    counts = {status: total async for status, total in counts}
+    ranked = [obj async for obj in ranked]
+    return _render(Response(view.board_payload(paginator, limit, counts, ranked)), request)
+
+
+# Users
+
+async def user_list(request):
+    view = _viewset(UserViewSet, request, 'list')
+    return _render(Response(await directory.aget_users(view.get_roles())), request)
+
+
+async def user_detail(request, pk):
+    if not str(pk).isdigit():
+        return None
+    view = _viewset(UserViewSet, request, 'retrieve', pk=pk)
+    user = await view.get_queryset().filter(pk=pk).afirst()
+    return _render(Response(view.get_serializer(user).data), request) if user is not None else None
+
+
+async def user_me(request):
+    view = _viewset(UserViewSet, request, 'me')
+    return _render(Response(view.get_serializer(request.user).data), request)
+
+
+HANDLERS = {
+    'maintenancerequest-list': request_list,
+    'maintenancerequest-detail': request_detail,
+    'maintenancerequest-board': request_board,
+    'user-list': user_list,
+    'user-detail': user_detail,
+    'user-me': user_me,
+}
+
+
+def with_async_reads(patterns):
+    # The router's patterns, the routes in HANDLERS wrapped by async_reads()
+    return [
+        URLPattern(pattern.pattern, async_reads(pattern.callback, HANDLERS[pattern.name]), pattern.default_args, pattern.name)
+        if isinstance(pattern, URLPattern) and pattern.name in HANDLERS else pattern
+        for pattern in patterns
+    ]
@@ -0,0 +1,221 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import UserProfile
+
+# Token -> user and profile, from a per-process LRU and, with TOKEN_CACHE_SHARED, the
+# default cache. Token, User and UserProfile signals drop the entry here and bump the shared
+# cache's version; other processes' LRU copies live at most TOKEN_CACHE_SECONDS.
+CACHE_SIZE = getattr(settings, 'TOKEN_CACHE_SIZE', 1024)
+CACHE_SECONDS = getattr(settings, 'TOKEN_CACHE_SECONDS', 60)
+SHARED = getattr(settings, 'TOKEN_CACHE_SHARED', False)
+SHARED_SECONDS = CACHE_SECONDS
+# Shared entries carry the version current before their row was read; any invalidation,
+# in any process, bumps it, so a lookup that raced with one is never served
+VERSION_KEY = 'core:token:version'
+
+TOKEN_FIELDS = [field.attname for field in Token._meta.concrete_fields]
+# The password hash stays out of the caches (a deferred field if ever read)
+USER_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname != 'password']
+PROFILE_FIELDS = [field.attname for field in UserProfile._meta.concrete_fields]
+USER_ID = USER_FIELDS.index('id')
+
+
+def _shared_key(key):
+    return f'core:token:{key}'
+
+
+class LRU:
+    def __init__(self, size, seconds):
+        self.size = size
+        self.seconds = seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Bumped by every invalidation: a lookup that raced with one is not stored
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, (_, value) in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+tokens = LRU(CACHE_SIZE, CACHE_SECONDS)
+
+
+# Entries are plain field values: every request gets its own model instances
+
+def _entry(token):
+    profile = getattr(token.user, 'profile', None)
+    return (
+        tuple(getattr(token, name) for name in TOKEN_FIELDS),
+        tuple(getattr(token.user, name) for name in USER_FIELDS),
+        tuple(getattr(profile, name) for name in PROFILE_FIELDS) if profile else None,
+    )
+
+
+def _load(entry):
+    db = Token.objects.db
+    token_values, user_values, profile_values = entry
+    token = Token.from_db(db, TOKEN_FIELDS, token_values)
+    token.user = User.from_db(db, USER_FIELDS, user_values)
+    if profile_values is not None:
+        token.user.profile = UserProfile.from_db(db, PROFILE_FIELDS, profile_values)
+    else:
+        # Known to have none, as after select_related(): no query, and none in an async view
+        User.profile.related.set_cached_value(token.user, None)
+    return token
+
+
+def _user_id(entry):
+    return entry[1][USER_ID]
+
+
+def _shared_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def _ashared_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, time.time_ns(), None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def _shared_entry(found, key):
+    # found: get_many() of the version and the entry
+    stored = found.get(_shared_key(key))
+    if stored is None or stored[0] != found.get(VERSION_KEY):
+        return None
+    return stored[1]
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # TokenAuthentication without the Token + User (+ UserProfile) queries once the token is cached
+
+    def authenticate_credentials(self, key):
+        entry = tokens.get(key)
+        generation = tokens.generation
+        if entry is None and SHARED:
+            entry = _shared_entry(cache.get_many([VERSION_KEY, _shared_key(key)]), key)
+            if entry is not None:
+                tokens.set(key, entry, generation)
+        if entry is None:
+            version = _shared_version() if SHARED else None
+            try:
+                token = self.get_model().objects.select_related('user__profile').get(key=key)
+            except self.get_model().DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            entry = _entry(token)
+            tokens.set(key, entry, generation)
+            if SHARED:
+                cache.set(_shared_key(key), (version, entry), SHARED_SECONDS)
+            return token.user, token
+
+        token = _load(entry)
+        return token.user, token
+
+    async def aauthenticate_credentials(self, key):
+        # For async views (core.async_views). None when the token is unknown or its user
+        # inactive: the caller hands the request to the sync view, which answers 401.
+        entry = tokens.get(key)
+        generation = tokens.generation
+        if entry is None and SHARED:
+            entry = _shared_entry(await cache.aget_many([VERSION_KEY, _shared_key(key)]), key)
+            if entry is not None:
+                tokens.set(key, entry, generation)
+        if entry is None:
+            version = await _ashared_version() if SHARED else None
+            token = await self.get_model().objects.select_related('user__profile').filter(key=key).afirst()
+            if token is None or not token.user.is_active:
+                return None
+            entry = _entry(token)
+            tokens.set(key, entry, generation)
+            if SHARED:
+                await cache.aset(_shared_key(key), (version, entry), SHARED_SECONDS)
+            return token.user, token
+
+        token = _load(entry)
+        return token.user, token
+
+
+# Invalidation
+
+def invalidate(key):
+    _invalidate(lambda: tokens.delete(key))
+
+
+def invalidate_users(user_ids):
+    user_ids = set(user_ids)
+    _invalidate(lambda: tokens.delete_where(lambda entry: _user_id(entry) in user_ids))
+
+
+def _invalidate(drop):
+    # Now, and again once the change commits: a lookup in between still read the old row
+    def run():
+        drop()
+        if SHARED:
+            cache.set(VERSION_KEY, time.time_ns(), None)
+
+    run()
+    transaction.on_commit(run)
+
+
+def on_token_change(sender, instance, **kwargs):
+    # Revocation and rotation delete the token; a re-keyed token leaves the old key behind
+    invalidate(instance.key)
+    invalidate_users([instance.user_id])
+
+
+def on_user_change(sender, instance, **kwargs):
+    # Deactivation and any other edit of the user or its profile (role, hmc)
+    invalidate_users([instance.user_id if isinstance(instance, UserProfile) else instance.pk])
@@ -0,0 +1,387 @@
+import asyncio
+import io
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.db.models import Max
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+
+from . import metrics
+from .models import MaintenanceRequest, UserProfile
+from .synthetic import EQUIPMENT, WORDS
+
+# Requests run through the same WSGI handler Gunicorn uses (every middleware, token
+# auth, connection handling), without sockets; each worker thread has its own connection.
+# With server='asgi', through ASGI_APPLICATION instead, as Uvicorn would run it.
+# Queries per call are read from the Server-Timing header (core.metrics).
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+# A run fails when a scenario's p95 grows by more than the tolerance and this many ms
+# (tiny endpoints jitter by more than any percentage), or it makes more queries per call
+MIN_DELTA_MS = 2.0
+QUERY_SLACK = 0.5
+# Requests read by the detail scenario
+SAMPLE_SIZE = 1000
+
+API = '/api'
+ROLES = [value for value, _ in UserProfile.ROLE_CHOICES]
+OPEN_STATUSES = [value for value, _ in MaintenanceRequest.STATUS_CHOICES if value not in MaintenanceRequest.CLOSED_STATUSES]
+
+
+class Call:
+    def __init__(self, method, path, data=None):
+        self.method = method
+        self.path = path
+        self.data = data
+
+
+class Scenario:
+    # role: who makes the calls. Workflow scenarios take each call's request from the
+    # ones in ``source`` status, so every call performs a real transition.
+    def __init__(self, name, role, make_call, source=None):
+        self.name = name
+        self.role = role
+        self.make_call = make_call
+        self.source = source
+
+    @property
+    def writes(self):
+        return self.source is not None
+
+
+def _transition(action, data=None):
+    def make_call(context, i, pk):
+        return Call('post', f'{API}/requests/{pk}/{action}/', data(context) if data else {})
+    return make_call
+
+
+def _read(path, params=None):
+    def make_call(context, i, pk=None):
+        query = params(context, i) if params else {}
+        return Call('get', f'{API}/{path}' + (f'?{urlencode(query)}' if query else ''))
+    return make_call
+
+
+SCENARIOS = [
+    Scenario('list', 'REQUESTER', _read('requests/', lambda c, i: {'page': c.rng.randint(1, 5)})),
+    Scenario('list_cursor', 'REQUESTER', _read('requests/', lambda c, i: {'pagination': 'cursor'})),
+    Scenario('list_status', 'APPROVER_MAINT', _read('requests/', lambda c, i: {'status': OPEN_STATUSES[i % len(OPEN_STATUSES)]})),
+    Scenario('search', 'REQUESTER', _read('requests/', lambda c, i: {'search': c.rng.choice(WORDS + EQUIPMENT)})),
+    Scenario('detail', 'REQUESTER', lambda c, i, pk=None: Call('get', f'{API}/requests/{c.pick_id(i)}/')),
+    Scenario('board', 'APPROVER_MAINT', _read('requests/board/')),
+    Scenario('queue', 'APPROVER_MAINT', _read('requests/queue/')),
+    Scenario('users_by_role', 'APPROVER_MAINT', _read('users/', lambda c, i: {'role': ROLES[i % len(ROLES)]})),
+    Scenario('approve_production', 'APPROVER_PROD', _transition('approve_production'), source='OPEN'),
+    Scenario('reject_production', 'APPROVER_PROD', _transition(
+        'reject_production', lambda c: {'comment': 'Benchmark'}), source='OPEN'),
+    Scenario('approve_maintenance_technical', 'APPROVER_MAINT', _transition(
+        'approve_maintenance', lambda c: {'type': 'TECHNICAL', 'executor_id': c.users['EXECUTOR'].pk}), source='WAITING_MAINT'),
+    Scenario('approve_maintenance_engineering', 'APPROVER_MAINT', _transition(
+        'approve_maintenance', lambda c: {'type': 'ENGINEERING'}), source='WAITING_MAINT'),
+    Scenario('reject_maintenance', 'APPROVER_MAINT', _transition(
+        'reject_maintenance', lambda c: {'comment': 'Benchmark'}), source='WAITING_MAINT'),
+    Scenario('approve_manager', 'MANAGER_MAINT', _transition(
+        'approve_manager', lambda c: {'engineer_id': (c.users.get('ENGINEER_MECH') or c.users['ENGINEER_ELEC']).pk}), source='WAITING_MANAGER'),
+    Scenario('finish_execution', 'EXECUTOR', _transition(
+        'finish_execution', lambda c: {'execution_description': 'Benchmark', 'pm04_order': '12345678'}), source='IN_EXECUTION'),
+]
+SCENARIO_NAMES = [scenario.name for scenario in SCENARIOS]
+
+
+class Context:
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.users = {}
+        self.tokens = {}
+        self.taken = set()
+        self.sample = None
+        for role in ROLES:
+            profile = UserProfile.objects.filter(role=role, user__is_active=True).select_related('user').order_by('user_id').first()
+            if profile:
+                self.users[role] = profile.user
+                self.tokens[role] = Token.objects.get_or_create(user=profile.user)[0].key
+
+    def pick_id(self, i):
+        if self.sample is None:
+            # Random existing ids, without ORDER BY RANDOM() over the whole table
+            top = MaintenanceRequest.objects.aggregate(value=Max('id'))['value'] or 0
+            candidates = {self.rng.randint(1, top) for _ in range(SAMPLE_SIZE)} if top else set()
+            self.sample = sorted(MaintenanceRequest.objects.filter(pk__in=candidates).values_list('pk', flat=True))
+            self.rng.shuffle(self.sample)
+        if not self.sample:
+            raise ValueError('Não há demandas: gere dados com generate_data antes do benchmark.')
+        return self.sample[i % len(self.sample)]
+
+    def calls(self, scenario, count):
+        if scenario.role not in self.tokens:
+            raise ValueError(f'Nenhum usuário ativo com a função {scenario.role} para o cenário {scenario.name}')
+        if not scenario.writes:
+            return [scenario.make_call(self, i) for i in range(count)]
+        # Each transition consumes a request; scenarios sharing a source status get different ones
+        ids = list(
+            MaintenanceRequest.objects.filter(status=scenario.source).exclude(pk__in=self.taken)
+            .order_by('-created_at').values_list('pk', flat=True)[:count]
+        )
+        self.taken.update(ids)
+        return [scenario.make_call(self, i, pk) for i, pk in enumerate(ids)]
+
+
+def _host():
+    hosts = [host for host in settings.ALLOWED_HOSTS if host not in ('*',) and not host.startswith('.')]
+    return hosts[0] if hosts else 'localhost'
+
+
+def _queries(server_timing):
+    match = QUERIES_RE.search(server_timing)
+    return int(match.group(1)) if match else None
+
+
+class Client:
+    # WSGI: one per worker thread
+    def __init__(self, token):
+        self.handler = get_wsgi_application()
+        self.token = token
+        self.host = _host()
+
+    def request(self, call):
+        path, _, query = call.path.partition('?')
+        body = json.dumps(call.data).encode() if call.data is not None else b''
+        environ = {
+            'REQUEST_METHOD': call.method.upper(),
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': self.host,
+            'HTTP_AUTHORIZATION': f'Token {self.token}',
+            'HTTP_ACCEPT': 'application/json',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(headers)
+
+        started = time.perf_counter()
+        result = self.handler(environ, start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            # Fires request_finished, as the server would
+            if hasattr(result, 'close'):
+                result.close()
+        elapsed = time.perf_counter() - started
+        return response['status'], elapsed, _queries(response['headers'].get('Server-Timing', ''))
+
+
+class AsgiClient:
+    # ASGI_APPLICATION, as Uvicorn calls it: concurrent calls are tasks on one event loop
+    def __init__(self, token):
+        self.application = import_string(settings.ASGI_APPLICATION)
+        self.token = token
+        self.host = _host()
+
+    async def request(self, call):
+        path, _, query = call.path.partition('?')
+        body = json.dumps(call.data).encode() if call.data is not None else b''
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': call.method.upper(),
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [
+                (b'host', self.host.encode()),
+                (b'authorization', f'Token {self.token}'.encode()),
+                (b'accept', b'application/json'),
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+            'client': ('127.0.0.1', 0),
+            'server': (self.host, 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        finished = asyncio.Event()
+        response = {}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # Django waits for a disconnect while the view runs
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = {name.decode().lower(): value.decode() for name, value in message['headers']}
+            elif not message.get('more_body'):
+                finished.set()
+
+        started = time.perf_counter()
+        try:
+            await self.application(scope, receive, send)
+        finally:
+            finished.set()
+        elapsed = time.perf_counter() - started
+        return response['status'], elapsed, _queries(response['headers'].get('server-timing', ''))
+
+
+def percentile(samples, fraction):
+    # Nearest rank over sorted samples
+    return samples[max(math.ceil(fraction * len(samples)) - 1, 0)] if samples else None
+
+
+def run_scenario(scenario, calls, token, concurrency=1, warmup=0, server='wsgi'):
+    # Returns {calls, errors, p50_ms, p95_ms, p99_ms, queries, rps}
+    samples, queries, errors = [], [], []
+    lock = threading.Lock()
+
+    def record(status, elapsed, count):
+        with lock:
+            if status >= 400:
+                errors.append(status)
+            samples.append(elapsed * 1000)
+            if count is not None:
+                queries.append(count)
+
+    if server == 'asgi':
+        seconds = asyncio.run(_run_asgi(calls, token, concurrency, warmup, record))
+    else:
+        seconds = _run_wsgi(calls, token, concurrency, warmup, record)
+
+    samples.sort()
+    return {
+        'calls': len(samples),
+        'errors': len(errors),
+        'p50_ms': _round(percentile(samples, 0.5)),
+        'p95_ms': _round(percentile(samples, 0.95)),
+        'p99_ms': _round(percentile(samples, 0.99)),
+        'queries': round(sum(queries) / len(queries), 2) if queries else None,
+        'rps': round(len(samples) / seconds, 1) if samples and seconds else None,
+    }
+
+
+def _run_wsgi(calls, token, concurrency, warmup, record):
+    # concurrency worker threads, as Gunicorn's gthread workers; returns the timed seconds
+    if warmup:
+        # Warm caches and connections: these calls are not timed
+        client = Client(token)
+        for call in calls[:warmup]:
+            client.request(call)
+    position = iter(calls[warmup:])
+
+    def worker():
+        client = Client(token)
+        try:
+            for call in position:
+                record(*client.request(call))
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+    else:
+        worker()
+    return time.perf_counter() - started
+
+
+async def _run_asgi(calls, token, concurrency, warmup, record):
+    # concurrency calls in flight on one event loop; the sync parts of each request run in
+    # its own thread, with its own connection, as in production
+    client = AsgiClient(token)
+    for call in calls[:warmup]:
+        await client.request(call)
+    position = iter(calls[warmup:])
+
+    async def worker():
+        for call in position:
+            record(*await client.request(call))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def run(names=None, iterations=200, concurrency=1, warmup=10, seed=42, writes=True, server='wsgi', progress=None):
+    # Runs the scenarios in order; progress(name, result) after each one
+    context = Context(seed)
+    results = {}
+    # Query counts come from Server-Timing, whatever PERF_SERVER_TIMING says
+    previous, metrics.SERVER_TIMING = metrics.SERVER_TIMING, True
+    try:
+        for scenario in SCENARIOS:
+            if (names and scenario.name not in names) or (scenario.writes and not writes):
+                continue
+            # Transitions cannot be replayed: they are not warmed up
+            skip = 0 if scenario.writes else warmup
+            calls = context.calls(scenario, iterations + skip)
+            result = results[scenario.name] = run_scenario(
+                scenario, calls, context.tokens[scenario.role], concurrency=concurrency, warmup=skip, server=server,
+            )
+            if progress:
+                progress(scenario.name, result)
+    finally:
+        metrics.SERVER_TIMING = previous
+    return {
+        'meta': {
+            'backend': connection.vendor, 'server': server, 'iterations': iterations,
+            'concurrency': concurrency, 'seed': seed,
+        },
+        'scenarios': results,
+    }
+
+
+def compare(report, baseline, tolerance=0.25):
+    # Returns the regressions against a stored report, as messages
+    regressions = []
+    for name, result in report['scenarios'].items():
+        if result['errors']:
+            regressions.append(f'{name}: {result["errors"]} resposta(s) com erro')
+        base = baseline.get('scenarios', {}).get(name)
+        if not base or not result['calls']:
+            continue
+        if base.get('p95_ms') is not None and result['p95_ms'] is not None:
+            limit = max(base['p95_ms'] * (1 + tolerance), base['p95_ms'] + MIN_DELTA_MS)
+            if result['p95_ms'] > limit:
+                regressions.append(f'{name}: p95 {result["p95_ms"]:.1f} ms (referência {base["p95_ms"]:.1f} ms)')
+        if base.get('queries') is not None and result['queries'] is not None:
+            if result['queries'] > base['queries'] + QUERY_SLACK:
+                regressions.append(f'{name}: {result["queries"]:g} consultas por chamada (referência {base["queries"]:g})')
+    return regressions
@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import ChangeSequence, RequestChange, RequestHistory
+
+
+def _allocate(count):
+    # Returns the last of ``count`` new change numbers; the row stays locked until commit
+    updated = ChangeSequence.objects.filter(pk=1).update(value=F('value') + count)
+    if not updated:
+        try:
+            with transaction.atomic():
+                ChangeSequence.objects.create(pk=1, value=0)
+        except IntegrityError:
+            pass
+        ChangeSequence.objects.filter(pk=1).update(value=F('value') + count)
+    return ChangeSequence.objects.values_list('value', flat=True).get(pk=1)
+
+
+def record(model, ids, deleted=False):
+    ids = list(ids)
+    if not ids:
+        return
+    with transaction.atomic():
+        first = _allocate(len(ids)) - len(ids) + 1
+        RequestChange.objects.bulk_create([
+            RequestChange(seq=first + i, model=model, object_id=pk, deleted=deleted)
+            for i, pk in enumerate(ids)
+        ])
+
+
+def record_history(objs):
+    # bulk_create does not return ids on every backend (MySQL); look the rows up then
+    if any(obj.pk is None for obj in objs):
+        keys = {(obj.request_id, obj.action, obj.timestamp) for obj in objs}
+        ids = [
+            pk for pk, request_id, action, timestamp in RequestHistory.objects.filter(
+                request_id__in={key[0] for key in keys}, timestamp__in={key[2] for key in keys},
+            ).values_list('pk', 'request_id', 'action', 'timestamp')
+            if (request_id, action, timestamp) in keys
+        ]
+    else:
+        ids = [obj.pk for obj in objs]
+    record('history', sorted(ids))
+
+
+def current_cursor():
+    return ChangeSequence.objects.filter(pk=1).values_list('value', flat=True).first() or 0
+
+
+# Single saves and deletes (API, admin, cascades) arrive through signals; bulk writes and
+# queryset.update() call record() themselves. Batched deletes (core.archive) do the same
+# inside muted(), so a cascade of thousands of rows is not logged one row at a time.
+
+_muted = threading.local()
+
+
+@contextmanager
+def muted():
+    # A depth, so a nested muted() does not turn logging back on for the outer block
+    _muted.depth = getattr(_muted, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _muted.depth -= 1
+
+
+def on_save(sender, instance, **kwargs):
+    if getattr(_muted, 'depth', 0):
+        return
+    record('request' if sender._meta.model_name == 'maintenancerequest' else 'history', [instance.pk])
+
+
+def on_delete(sender, instance, **kwargs):
+    if getattr(_muted, 'depth', 0):
+        return
+    record('request' if sender._meta.model_name == 'maintenancerequest' else 'history', [instance.pk], deleted=True)
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def read(since, limit):
+    # Changes after ``since`` in order, one entry per object (its latest change in the page).
+    # Returns (entries, cursor, has_more); raises CursorExpired when pruned changes are missing.
+    entries = list(RequestChange.objects.filter(seq__gt=since).order_by('seq')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    # Numbers are never skipped (a rollback also undoes the allocation), so a gap means pruning
+    if entries and entries[0].seq != since + 1:
+        raise CursorExpired
+    if not entries and since < current_cursor():
+        raise CursorExpired
+
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.model, entry.object_id), None)
+        latest[(entry.model, entry.object_id)] = entry
+    cursor = entries[-1].seq if entries else since
+    return list(latest.values()), cursor, has_more
@@ -0,0 +1,72 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .serializers import UserSerializer
+
+# Entries are keyed by a version that every User/UserProfile save bumps. The TTL bounds
+# staleness for processes that do not share the cache (the default LocMemCache).
+CACHE_SECONDS = getattr(settings, 'USER_DIRECTORY_CACHE_SECONDS', 300)
+VERSION_KEY = 'core:user-directory:version'
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def _aversion():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, time.time_ns(), None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def _key(version, roles):
+    return f"core:user-directory:{version}:{','.join(roles) or '*'}"
+
+
+# Saved on every login and password change; not part of the serialized users
+UNLISTED_FIELDS = {'last_login', 'password'}
+
+
+def invalidate(update_fields=None, **kwargs):
+    # A fresh, never reused version: old entries simply stop being read and expire
+    if update_fields and set(update_fields) <= UNLISTED_FIELDS:
+        return
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def query(roles=None):
+    queryset = User.objects.select_related('profile').order_by('id')
+    if roles:
+        queryset = queryset.filter(profile__role__in=roles)
+    return queryset
+
+
+def get_users(roles=None):
+    # Serialized users with any of ``roles`` (all users when empty), from the cache when possible
+    roles = sorted(set(roles or []))
+    key = _key(_version(), roles)
+    users = cache.get(key)
+    if users is None:
+        users = [dict(row) for row in UserSerializer(query(roles), many=True).data]
+        cache.set(key, users, CACHE_SECONDS)
+    return users
+
+
+async def aget_users(roles=None):
+    # get_users() for async views
+    roles = sorted(set(roles or []))
+    key = _key(await _aversion(), roles)
+    users = await cache.aget(key)
+    if users is None:
+        users = [dict(row) for row in UserSerializer([user async for user in query(roles)], many=True).data]
+        await cache.aset(key, users, CACHE_SECONDS)
+    return users
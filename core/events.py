@@ -0,0 +1,180 @@
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# With EVENTS_REDIS_URL set (any Redis-compatible server), events go through its pub/sub
+# so every worker process sees them; otherwise they stay inside the publishing process.
+REDIS_URL = getattr(settings, 'EVENTS_REDIS_URL', None)
+REDIS_CHANNEL = getattr(settings, 'EVENTS_REDIS_CHANNEL', 'core:request-events')
+# Events a slow client may have pending before it is told to resync and dropped
+QUEUE_SIZE = getattr(settings, 'EVENTS_QUEUE_SIZE', 100)
+KEEPALIVE_SECONDS = getattr(settings, 'EVENTS_KEEPALIVE_SECONDS', 25)
+TICKET_MAX_AGE = getattr(settings, 'EVENTS_TICKET_MAX_AGE', 60)
+
+_signer = TimestampSigner(salt='core.events')
+
+
+def issue_ticket(user):
+    # EventSource cannot send the Authorization header, so the stream takes a short-lived ticket
+    return _signer.sign(str(user.pk))
+
+
+def check_ticket(ticket):
+    try:
+        return int(_signer.unsign(ticket, max_age=TICKET_MAX_AGE))
+    except (BadSignature, SignatureExpired, ValueError):
+        return None
+
+
+class Subscription:
+    def __init__(self, loop, request_id=None):
+        self.loop = loop
+        self.request_id = request_id
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event):
+        return self.request_id is None or event['id'] == self.request_id
+
+    def deliver(self, event):
+        # Runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class Broker:
+    # Fan-out to the connections of this process. Each connection is an asyncio queue on
+    # the server's event loop; publishing from a request thread only schedules put_nowait.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, request_id=None):
+        subscription = Subscription(asyncio.get_running_loop(), request_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def dispatch(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # Its loop is gone
+                self.unsubscribe(subscription)
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+
+broker = Broker()
+
+_redis = None
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _redis_client():
+    global _redis
+    if _redis is None:
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('EVENTS_REDIS_URL requires the "redis" package.')
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
+
+def _listen():
+    # One thread per process relays the shared channel into the local broker
+    while True:
+        try:
+            pubsub = _redis_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(REDIS_CHANNEL)
+            for message in pubsub.listen():
+                broker.dispatch(json.loads(message['data']))
+        except Exception:
+            logger.exception("Conexão com o canal de eventos perdida; reconectando")
+            threading.Event().wait(1)
+
+
+def start_listener():
+    global _listener
+    if not REDIS_URL or _listener is not None:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name='events-redis', daemon=True)
+            _listener.start()
+
+
+def publish(event):
+    if REDIS_URL:
+        try:
+            _redis_client().publish(REDIS_CHANNEL, json.dumps(event))
+        except Exception:
+            logger.exception("Falha ao publicar evento da demanda #%s", event['id'])
+    else:
+        broker.dispatch(event)
+
+
+def change_event(kind, obj):
+    return {
+        'event': kind,
+        'id': obj.pk,
+        'status': obj.status,
+        'status_display': obj.get_status_display(),
+        'assigned_to': obj.assigned_to_id,
+        'updated_at': obj.updated_at.isoformat() if obj.updated_at else None,
+    }
+
+
+def publish_on_commit(kind, objs):
+    # Built now (the instances may change later), sent only if the transaction commits
+    events = [change_event(kind, obj) for obj in objs]
+    transaction.on_commit(lambda: [publish(event) for event in events])
+
+
+def format_sse(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream(subscription):
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line: keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                continue
+            if event is None:
+                # Fell too far behind: the client reloads its data and reconnects
+                yield 'event: resync\ndata: {}\n\n'
+                return
+            yield format_sse(event)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,237 @@
+import csv
+import heapq
+import io
+import re
+import zipfile
+from itertools import islice
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import archive
+from .models import RequestHistory
+
+# Rows fetched per round trip. Requests and history are read by two ordered cursors and
+# merged, so memory depends on this and not on how many rows are exported. (mysqlclient
+# buffers whole result sets client side; there the bound is the driver's, not ours.)
+CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+# Bytes gathered before a chunk is handed to the server
+FLUSH_SIZE = 64 * 1024
+
+MILESTONES = [
+    ('Aprovada Produção em', {'APPROVED_PROD'}),
+    ('Aprovada Manutenção em', {'APPROVED_MAINT_TECH', 'APPROVED_MAINT_ENG'}),
+    ('Aprovada Gerência em', {'APPROVED_MANAGER'}),
+]
+
+HEADERS = [
+    'ID', 'Título', 'Status', 'Tipo', 'Processo', 'Equipamento', 'Gravidade', 'Urgência', 'Tendência', 'GUT',
+    'Solicitante', 'Responsável', 'Técnico Executante', 'Ordem PM04', 'Criada em', 'Encerrada em',
+    *[label for label, _ in MILESTONES], 'Histórico',
+]
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def _datetime(value):
+    return timezone.localtime(value).strftime('%Y-%m-%d %H:%M') if value else ''
+
+
+def _username(user):
+    return user.username if user else ''
+
+
+# Text starting with these runs as a formula when the file is opened in Excel or
+# LibreOffice (CSV injection): such cells get a leading apostrophe
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _cell(value):
+    return f"'{value}" if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) else value
+
+
+def _row(obj, events):
+    milestones = []
+    for _, actions in MILESTONES:
+        # The latest approval counts if a request went through the same step twice
+        times = [event.timestamp for event in events if event.action in actions]
+        milestones.append(_datetime(times[-1]) if times else '')
+    timeline = ' | '.join(
+        f'{_datetime(event.timestamp)} {event.action} ({_username(event.actor)})'
+        + (f': {event.comment}' if event.comment else '')
+        for event in events
+    )
+    return [_cell(value) for value in [
+        obj.id, obj.title, obj.get_status_display(), obj.get_type_display() or '', obj.process, obj.equipment,
+        obj.gut_gravity, obj.gut_urgency, obj.gut_tendency, obj.priority,
+        _username(obj.requester), _username(obj.assigned_to), obj.technician_name or '', obj.pm04_order or '',
+        _datetime(obj.created_at), _datetime(obj.finished_at), *milestones, timeline,
+    ]]
+
+
+def export_rows(queryset, chunk_size=None, archived=None):
+    # archived: an ArchivedRequest queryset merged in by id, for exports that ask for closed requests
+    chunk_size = chunk_size or CHUNK_SIZE
+    requests = _live(queryset, chunk_size)
+    if archived is not None:
+        requests = heapq.merge(requests, _archived(archived, chunk_size), key=lambda item: item[0].id)
+    previous = None
+    for obj, events in requests:
+        # A request archived while we read can come from both sides: once is enough
+        if obj.id != previous:
+            yield _row(obj, events)
+        previous = obj.id
+
+
+def _live(queryset, chunk_size):
+    # Merge join on request id: both sides are streamed in id order, one query each
+    requests = queryset.order_by('id').iterator(chunk_size=chunk_size)
+    history = iter(
+        RequestHistory.objects.filter(request__in=queryset.order_by().values('pk'))
+        .select_related('actor')
+        .order_by('request_id', 'timestamp', 'id')
+        .iterator(chunk_size=chunk_size)
+    )
+    event = next(history, None)
+    for obj in requests:
+        while event is not None and event.request_id < obj.id:
+            event = next(history, None)
+        events = []
+        while event is not None and event.request_id == obj.id:
+            events.append(event)
+            event = next(history, None)
+        yield obj, events
+
+
+def _archived(queryset, chunk_size):
+    # Archived rows carry their history: ids in order, then chunk_size rows loaded at a time
+    ids = queryset.order_by('id').values_list('pk', flat=True).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(ids, chunk_size)):
+        objs = archive.load(chunk, with_history=True)
+        for pk in chunk:
+            if pk in objs:  # unless restored meanwhile
+                yield objs[pk], objs[pk].archived_history
+
+
+def stream_csv(rows):
+    # Semicolon-separated with a BOM, which is what Excel in pt-BR opens correctly
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('﻿')
+    writer.writerow(HEADERS)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _Sink:
+    # Write-only, unseekable file: zipfile then emits data descriptors and never seeks back
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        self.size = 0
+        return data
+
+
+ILLEGAL_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Demandas" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if isinstance(value, int):
+            cells.append(f'<c><v>{value}</v></c>')
+        else:
+            text = escape(ILLEGAL_XML_RE.sub('', str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f'<row>{"".join(cells)}</row>'
+
+
+def stream_xlsx(rows):
+    # A minimal workbook written straight into a zip stream: the sheet is compressed as it
+    # is produced and handed out every FLUSH_SIZE bytes, so no row is kept after it is sent.
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(HEADERS).encode('utf-8'))
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode('utf-8'))
+                if sink.size >= FLUSH_SIZE:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+STREAMS = {'csv': stream_csv, 'xlsx': stream_xlsx}
+
+
+def streaming_response(queryset, file_format, archived=None):
+    rows = export_rows(queryset, archived=archived)
+    response = StreamingHttpResponse(STREAMS[file_format](rows), content_type=CONTENT_TYPES[file_format])
+    filename = f"demandas-{timezone.localdate():%Y%m%d}.{file_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
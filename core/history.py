@@ -0,0 +1,45 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from . import changes as request_changes
+from .models import RequestHistory
+
+# History is append-only: rows are inserted with bulk_create() (no post_save, so the change
+# log is written here, once per batch) and never updated. Inside batch(), writes are held
+# and go out as one INSERT and one change-log write when the block ends, in its transaction.
+
+_state = threading.local()
+
+
+def write(entries):
+    # Inserts the RequestHistory instances; returns them
+    entries = list(entries)
+    if not entries:
+        return entries
+    batches = getattr(_state, 'batches', None)
+    if batches:
+        batches[-1].extend(entries)
+        return entries
+    with transaction.atomic():
+        RequestHistory.objects.bulk_create(entries)
+        request_changes.record_history(entries)
+    return entries
+
+
+def append(request, action, actor, comment=''):
+    return write([RequestHistory(request=request, action=action, actor=actor, comment=comment)])[0]
+
+
+@contextmanager
+def batch():
+    # Nested batches flush into the outer one. Entries get their ids when the outermost ends.
+    batches = _state.__dict__.setdefault('batches', [])
+    with transaction.atomic():
+        batches.append([])
+        try:
+            yield
+        finally:
+            entries = batches.pop()
+        write(entries)
@@ -0,0 +1,131 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import changes as request_changes
+from .models import MaintenanceRequest
+
+logger = logging.getLogger(__name__)
+
+MAX_SIZE = getattr(settings, 'IMAGE_MAX_SIZE', (1920, 1920))
+THUMBNAIL_SIZE = getattr(settings, 'IMAGE_THUMBNAIL_SIZE', (320, 320))
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+# original field -> (thumbnail field, webp field)
+IMAGE_FIELDS = {
+    'photo': ('photo_thumbnail', 'photo_webp'),
+    'execution_photo': ('execution_photo_thumbnail', 'execution_photo_webp'),
+}
+
+_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMAGE_PIPELINE_WORKERS', 2), thread_name_prefix='images')
+
+
+def _encode(image, fmt, **params):
+    buffer = BytesIO()
+    image.save(buffer, fmt, **params)
+    return ContentFile(buffer.getvalue())
+
+
+def _filename(instance, field, filename):
+    return MaintenanceRequest._meta.get_field(field).generate_filename(instance, filename)
+
+
+def render_variants(fieldfile):
+    # Returns (original, thumbnail, webp) as ContentFiles. The original is re-encoded
+    # upright, capped at MAX_SIZE and without EXIF (which carries GPS and device data).
+    with fieldfile.open('rb'), Image.open(fieldfile) as source:
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail(MAX_SIZE)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        original = _encode(image, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+        webp = _encode(image, 'WEBP', quality=WEBP_QUALITY)
+        thumb = image.copy()
+        thumb.thumbnail(THUMBNAIL_SIZE)
+        thumbnail = _encode(thumb, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    return original, thumbnail, webp
+
+
+def process_request_images(request_id):
+    try:
+        instance = MaintenanceRequest.objects.get(pk=request_id)
+    except MaintenanceRequest.DoesNotExist:
+        return
+
+    for field, (thumbnail_field, webp_field) in IMAGE_FIELDS.items():
+        fieldfile = getattr(instance, field)
+        if not fieldfile or getattr(instance, thumbnail_field):
+            continue
+        try:
+            original, thumbnail, webp = render_variants(fieldfile)
+        except Exception:
+            logger.exception("Falha ao processar %s da demanda #%s", field, request_id)
+            continue
+
+        storage = fieldfile.storage
+        base = os.path.splitext(os.path.basename(fieldfile.name))[0]
+        names = {
+            field: _filename(instance, field, f'{base}.jpg'),
+            thumbnail_field: _filename(instance, thumbnail_field, f'{base}.jpg'),
+            webp_field: _filename(instance, webp_field, f'{base}.webp'),
+        }
+        saved = {
+            field: storage.save(names[field], original),
+            thumbnail_field: storage.save(names[thumbnail_field], thumbnail),
+            webp_field: storage.save(names[webp_field], webp),
+        }
+        # Only swap in the new files if nobody replaced the upload meanwhile
+        with transaction.atomic():
+            updated = MaintenanceRequest.objects.filter(pk=request_id, **{field: fieldfile.name}).update(
+                updated_at=timezone.now(), **saved
+            )
+            if updated:
+                request_changes.record('request', [request_id])
+        if updated:
+            storage.delete(fieldfile.name)
+        else:
+            for name in saved.values():
+                storage.delete(name)
+
+
+def _run(request_id):
+    close_old_connections()
+    try:
+        process_request_images(request_id)
+    except Exception:
+        logger.exception("Falha no processamento de imagens da demanda #%s", request_id)
+    finally:
+        close_old_connections()
+
+
+def schedule(instance):
+    # Queue processing once the upload is committed; with IMAGE_PIPELINE_ASYNC = False it runs inline
+    if not any(getattr(instance, field) for field in IMAGE_FIELDS):
+        return
+    if getattr(settings, 'IMAGE_PIPELINE_ASYNC', True):
+        transaction.on_commit(lambda: _executor.submit(_run, instance.pk))
+    else:
+        transaction.on_commit(lambda: process_request_images(instance.pk))
+
+
+def reset_variants(instance, changed_fields):
+    # A replaced original invalidates its derived files. The fields are cleared for the
+    # caller's save; the files go only once that commits, so a rollback leaves them in place.
+    stale = []
+    for field in changed_fields:
+        thumbnail_field, webp_field = IMAGE_FIELDS[field]
+        for derived in (thumbnail_field, webp_field):
+            fieldfile = getattr(instance, derived)
+            if fieldfile:
+                stale.append((fieldfile.storage, fieldfile.name))
+            setattr(instance, derived, None)
+    if stale:
+        transaction.on_commit(lambda: [storage.delete(name) for storage, name in stale])
@@ -0,0 +1,350 @@
+import csv
+import json
+import re
+from contextlib import contextmanager
+from datetime import datetime, time
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import authentication, directory, changes as request_changes, history as request_history, stats as request_stats
+from .models import MaintenanceRequest, RequestHistory, UserProfile
+
+BATCH_SIZE = 1000
+
+WHITESPACE_RE = re.compile(r'\s*')
+
+USER_FIELDS = ['username', 'email', 'first_name', 'last_name']
+REQUEST_FIELDS = [
+    'title', 'problem_description', 'process', 'equipment', 'gut_gravity', 'gut_urgency', 'gut_tendency',
+    'status', 'type', 'pm04_order', 'technician_name', 'execution_description', 'observation',
+]
+REQUEST_DATETIME_FIELDS = ['created_at', 'updated_at', 'finished_at']
+
+
+class RowError(Exception):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        # (line, reason, row)
+        self.rejected = []
+
+    def reject(self, line, row, reason):
+        self.rejected.append((line, reason, row))
+
+
+# Readers: yield (line or record number, dict) without loading the whole file
+
+def read_csv(stream):
+    sample = stream.readline()
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    header = next(csv.reader([sample], dialect))
+    reader = csv.DictReader(stream, fieldnames=[name.strip() for name in header], dialect=dialect)
+    for row in reader:
+        yield reader.line_num + 1, row
+
+
+def read_json_lines(stream):
+    for line, text in enumerate(stream, 1):
+        if text.strip():
+            yield line, json.loads(text)
+
+
+def read_json_array(stream, chunk_size=64 * 1024):
+    # Decodes one element of a top-level [...] at a time from a rolling buffer
+    decoder = json.JSONDecoder()
+    buffer, position, record, eof = '', 0, 0, False
+    started = False
+    while True:
+        if not eof and len(buffer) - position < chunk_size:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+        position = WHITESPACE_RE.match(buffer, position).end()
+        if not started:
+            if not buffer.startswith('[', position):
+                raise ValueError('Esperado um array JSON')
+            position, started = position + 1, True
+            continue
+        if buffer.startswith(']', position):
+            return
+        if buffer.startswith(',', position):
+            position += 1
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Element longer than what is buffered: read on
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        position = end
+        record += 1
+        if not isinstance(value, dict):
+            raise ValueError(f'Registro {record}: esperado um objeto JSON')
+        yield record, value
+
+
+READERS = {'csv': read_csv, 'jsonl': read_json_lines, 'json': read_json_array}
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+@contextmanager
+def keep_timestamps(model, *names):
+    # bulk_create would overwrite auto_now/auto_now_add fields with the current time; legacy
+    # rows keep theirs. Only safe in a process that is not serving requests (the command).
+    fields = [model._meta.get_field(name) for name in names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _text(row, name):
+    value = row.get(name)
+    return '' if value is None else str(value).strip()
+
+
+def _clean(obj, exclude):
+    try:
+        obj.clean_fields(exclude=exclude)
+    except ValidationError as exc:
+        raise RowError('; '.join(f"{field}: {' '.join(messages)}" for field, messages in exc.message_dict.items()))
+
+
+def _datetime(value, field):
+    if value in ('', None):
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise RowError(f'{field}: data inválida ({value})')
+        parsed = datetime.combine(date, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _profiles_by_hmc(hmcs):
+    return dict(UserProfile.objects.filter(hmc__in=hmcs).values_list('hmc', 'user_id'))
+
+
+# Users and profiles: upsert on hmc
+
+def import_users(rows, result, password_hash=None):
+    rows = list(rows)
+    valid = {}
+    for line, row in rows:
+        try:
+            hmc = _text(row, 'hmc')
+            user = User(**{name: _text(row, name) for name in USER_FIELDS})
+            profile = UserProfile(hmc=hmc, role=_text(row, 'role') or 'REQUESTER')
+            _clean(user, exclude=['password'])
+            _clean(profile, exclude=['user'])
+        except RowError as exc:
+            result.reject(line, row, str(exc))
+            continue
+        # The last row for an hmc wins, as it would across batches
+        valid[hmc] = (line, row, user, profile)
+
+    existing = {
+        profile.hmc: profile
+        for profile in UserProfile.objects.filter(hmc__in=valid).select_related('user')
+    }
+    taken = {
+        username: (user_id, hmc)
+        for username, user_id, hmc in User.objects.filter(
+            username__in=[user.username for _, _, user, _ in valid.values()]
+        ).values_list('username', 'id', 'profile__hmc')
+    }
+
+    to_create, to_update, profiles_to_create, profiles_to_update = [], [], [], []
+    usernames = set()
+    for hmc, (line, row, user, profile) in valid.items():
+        current = existing.get(hmc)
+        owner = taken.get(user.username)
+        if user.username in usernames or (owner and owner[1] not in (None, hmc)):
+            result.reject(line, row, f'username: {user.username} já pertence a outro HMC')
+            continue
+        usernames.add(user.username)
+        if current:
+            for name in USER_FIELDS:
+                setattr(current.user, name, getattr(user, name))
+            current.role = profile.role
+            to_update.append(current.user)
+            profiles_to_update.append(current)
+        elif owner:
+            # A user without a profile (e.g. created by hand in the admin) is adopted
+            user.pk = owner[0]
+            to_update.append(user)
+            profile.user_id = user.pk
+            profiles_to_create.append(profile)
+        else:
+            password = _text(row, 'password')
+            user.password = make_password(password) if password else (password_hash or make_password(None))
+            to_create.append((user, profile))
+
+    with transaction.atomic():
+        User.objects.bulk_create([user for user, _ in to_create])
+        if to_create and to_create[0][0].pk is None:
+            # Backends that do not return ids from bulk INSERT (MySQL)
+            ids = dict(User.objects.filter(username__in=[u.username for u, _ in to_create]).values_list('username', 'id'))
+            for user, _ in to_create:
+                user.pk = ids[user.username]
+        for user, profile in to_create:
+            profile.user_id = user.pk
+            profiles_to_create.append(profile)
+        UserProfile.objects.bulk_create(profiles_to_create)
+        if to_update:
+            User.objects.bulk_update(to_update, USER_FIELDS)
+        if profiles_to_update:
+            UserProfile.objects.bulk_update(profiles_to_update, ['role'])
+    # bulk writes send no post_save
+    directory.invalidate()
+    authentication.invalidate_users([user.pk for user in to_update])
+    result.created += len(to_create)
+    result.updated += len(to_update)
+
+
+# Requests: users are referenced by hmc; an explicit id lets history rows point at them
+
+def import_requests(rows, result):
+    rows = list(rows)
+    hmcs = {_text(row, key) for _, row in rows for key in ('requester_hmc', 'assigned_to_hmc')} - {''}
+    users = _profiles_by_hmc(hmcs)
+    ids = [_text(row, 'id') for _, row in rows if _text(row, 'id').isdigit()]
+    existing_ids = set(MaintenanceRequest.objects.filter(pk__in=ids).values_list('pk', flat=True))
+
+    objs, seen = [], set()
+    now = timezone.now()
+    for line, row in rows:
+        try:
+            values = {name: _text(row, name) or None for name in REQUEST_FIELDS}
+            values['status'] = values['status'] or 'OPEN'
+            for name in REQUEST_DATETIME_FIELDS:
+                values[name] = _datetime(_text(row, name), name)
+            values['created_at'] = values['created_at'] or now
+            values['updated_at'] = values['updated_at'] or values['created_at']
+            obj = MaintenanceRequest(**values)
+
+            pk = _text(row, 'id')
+            if pk:
+                if not pk.isdigit():
+                    raise RowError(f'id: valor inválido ({pk})')
+                if int(pk) in existing_ids or int(pk) in seen:
+                    raise RowError(f'id: demanda #{pk} já existe')
+                obj.pk = int(pk)
+                seen.add(obj.pk)
+
+            requester = _text(row, 'requester_hmc')
+            if requester not in users:
+                raise RowError(f'requester_hmc: HMC {requester or "(vazio)"} não encontrado')
+            obj.requester_id = users[requester]
+            assignee = _text(row, 'assigned_to_hmc')
+            if assignee:
+                if assignee not in users:
+                    raise RowError(f'assigned_to_hmc: HMC {assignee} não encontrado')
+                obj.assigned_to_id = users[assignee]
+
+            _clean(obj, exclude=['requester', 'assigned_to'])
+        except RowError as exc:
+            result.reject(line, row, str(exc))
+            continue
+        objs.append(obj)
+
+    with transaction.atomic(), keep_timestamps(MaintenanceRequest, 'created_at', 'updated_at'):
+        last_id = MaintenanceRequest.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        MaintenanceRequest.objects.bulk_create(objs)
+        ids = [obj.pk for obj in objs]
+        if None in ids:
+            # No ids back from the INSERT (MySQL): log everything above the previous maximum;
+            # a concurrent insert logged twice is harmless
+            ids = sorted({pk for pk in ids if pk} | set(
+                MaintenanceRequest.objects.filter(pk__gt=last_id).values_list('pk', flat=True)
+            ))
+        request_changes.record('request', ids)
+    result.created += len(objs)
+
+
+# History is append-only: rows are always inserted
+
+def import_history(rows, result):
+    rows = list(rows)
+    users = _profiles_by_hmc({_text(row, 'actor_hmc') for _, row in rows} - {''})
+    request_ids = [_text(row, 'request_id') for _, row in rows if _text(row, 'request_id').isdigit()]
+    known = set(MaintenanceRequest.objects.filter(pk__in=request_ids).values_list('pk', flat=True))
+
+    objs = []
+    now = timezone.now()
+    for line, row in rows:
+        try:
+            request_id = _text(row, 'request_id')
+            if not request_id.isdigit() or int(request_id) not in known:
+                raise RowError(f'request_id: demanda {request_id or "(vazio)"} não encontrada')
+            actor = _text(row, 'actor_hmc')
+            if actor and actor not in users:
+                raise RowError(f'actor_hmc: HMC {actor} não encontrado')
+            obj = RequestHistory(
+                request_id=int(request_id),
+                actor_id=users.get(actor),
+                action=_text(row, 'action'),
+                comment=_text(row, 'comment'),
+                timestamp=_datetime(_text(row, 'timestamp'), 'timestamp') or now,
+            )
+            _clean(obj, exclude=['request', 'actor'])
+        except RowError as exc:
+            result.reject(line, row, str(exc))
+            continue
+        objs.append(obj)
+
+    with transaction.atomic(), keep_timestamps(RequestHistory, 'timestamp'):
+        request_history.write(objs)
+    result.created += len(objs)
+
+
+IMPORTERS = {'users': import_users, 'requests': import_requests, 'history': import_history}
+
+
+def run_import(kind, rows, batch_size=BATCH_SIZE, password=None):
+    result = ImportResult()
+    # One hash for every new account without its own password (hashing each row would
+    # dominate the import); users are expected to change it on first login.
+    options = {'password_hash': make_password(password) if password else None} if kind == 'users' else {}
+    for batch in batched(rows, batch_size):
+        IMPORTERS[kind](batch, result, **options)
+
+    if kind == 'requests' and result.created:
+        # Explicit ids do not advance PostgreSQL sequences (no-op on SQLite/MySQL)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [MaintenanceRequest]):
+                cursor.execute(sql)
+        # bulk_create skips record_created: recount once at the end
+        request_stats.rebuild_counters()
+    return result
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from core import archive
+
+
+class Command(BaseCommand):
+    help = 'Move demandas concluídas/rejeitadas antigas para o arquivo (ou restaura com --restore).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=archive.ARCHIVE_AFTER_DAYS,
+                            help='Archive closed requests not changed for this many days.')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+        parser.add_argument('--limit', type=int, help='Stop after archiving this many requests.')
+        parser.add_argument('--restore', type=int, nargs='+', metavar='ID', help='Move these requests back to the live tables.')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            restored = archive.restore(options['restore'])
+            missing = sorted(set(options['restore']) - set(restored))
+            self.stdout.write(self.style.SUCCESS(f'{len(restored)} demanda(s) restaurada(s).'))
+            if missing:
+                self.stderr.write(f"Não encontradas no arquivo: {', '.join(map(str, missing))}")
+            return
+        moved = archive.archive_closed(options['days'], options['batch_size'], options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'{moved} demanda(s) arquivada(s).'))
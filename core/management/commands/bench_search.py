@@ -0,0 +1,77 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import MaintenanceRequest
+from core.search import search_requests
+from core.synthetic import EQUIPMENT, PROCESSES, WORDS
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Mede a latência da busca textual conforme a tabela de demandas cresce (dados descartados ao final).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Final table size.')
+        parser.add_argument('--steps', type=int, default=4, help='Checkpoints between 0 and --rows (log scale).')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query and checkpoint.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows instead of rolling back.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        rows = options['rows']
+        steps = options['steps']
+        checkpoints = sorted({max(1, int(rows ** ((i + 1) / steps))) for i in range(steps)})
+        # Rare equipment tag, a common word, and a two-word prefix query
+        queries = ['Injetora 0007', 'rolamento', 'lubrif desgas']
+
+        self.stdout.write(f"backend={connection.vendor} checkpoints={checkpoints}")
+        self.stdout.write(f"{'rows':>10}  " + '  '.join(f'{q[:18]:>18}' for q in queries) + '   (median ms, first page of 20)')
+        try:
+            with transaction.atomic():
+                requester = User.objects.create(username='bench_search_requester')
+                inserted = 0
+                for checkpoint in checkpoints:
+                    while inserted < checkpoint:
+                        size = min(options['batch_size'], checkpoint - inserted)
+                        MaintenanceRequest.objects.bulk_create(
+                            [self.fake_request(rng, requester, inserted + i) for i in range(size)],
+                            batch_size=options['batch_size'],
+                        )
+                        inserted += size
+                    timings = [self.time_query(query, options['repeat']) for query in queries]
+                    self.stdout.write(f'{inserted:>10}  ' + '  '.join(f'{t:>18.2f}' for t in timings))
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            pass
+
+    def fake_request(self, rng, requester, n):
+        equipment = f'{rng.choice(EQUIPMENT)} {n % 10000:04d}'
+        return MaintenanceRequest(
+            title=' '.join(rng.sample(WORDS, 3)).capitalize(),
+            problem_description=' '.join(rng.choices(WORDS, k=12)),
+            process=rng.choice(PROCESSES),
+            equipment=equipment,
+            gut_gravity=rng.randint(1, 5),
+            gut_urgency=rng.randint(1, 5),
+            gut_tendency=rng.randint(1, 5),
+            requester=requester,
+        )
+
+    def time_query(self, query, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(search_requests(MaintenanceRequest.objects.all(), query)[:20])
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
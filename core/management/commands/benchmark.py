@@ -0,0 +1,83 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede latência (p50/p95/p99), vazão e consultas por chamada dos principais endpoints, em processo, '
+        'com concorrência e sob WSGI ou ASGI, e compara com uma referência salva. As ações do fluxo alteram '
+        'demandas reais: rode sobre uma base gerada com generate_data, nunca em produção.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', help=f"Comma-separated subset of: {', '.join(benchmark.SCENARIO_NAMES)}.")
+        parser.add_argument('--iterations', type=int, default=200, help='Timed calls per scenario.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Calls in flight per scenario.')
+        parser.add_argument(
+            '--server', choices=['wsgi', 'asgi'], default='wsgi',
+            help='wsgi: WSGI_APPLICATION on a thread pool (Gunicorn). asgi: ASGI_APPLICATION on one event loop (Uvicorn).',
+        )
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed calls before each read scenario.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--no-writes', action='store_true', help='Skip the workflow actions (read-only run).')
+        parser.add_argument('--baseline', help='Fail if this run regressed against the report in this JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 growth over the baseline (0.25 = 25%%).')
+        parser.add_argument('--save', help='Write this run to a JSON file (e.g. as the new baseline).')
+
+    def handle(self, *args, **options):
+        names = None
+        if options['scenarios']:
+            names = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+            unknown = sorted(set(names) - set(benchmark.SCENARIO_NAMES))
+            if unknown:
+                raise CommandError(f"Cenário(s) desconhecido(s): {', '.join(unknown)}")
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as stream:
+                    baseline = json.load(stream)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Referência inválida: {exc}')
+
+        self.stdout.write(f"{'scenario':<32} {'calls':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'req/s':>8}")
+
+        def progress(name, result):
+            self.stdout.write(
+                f"{name:<32} {result['calls']:>6} {result['errors']:>6} {_ms(result['p50_ms'])} "
+                f"{_ms(result['p95_ms'])} {_ms(result['p99_ms'])} {_number(result['queries'], 8)} "
+                f"{_number(result['rps'], 8, '.1f')}"
+            )
+
+        try:
+            report = benchmark.run(
+                names, iterations=options['iterations'], concurrency=options['concurrency'],
+                warmup=options['warmup'], seed=options['seed'], writes=not options['no_writes'],
+                server=options['server'], progress=progress,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as stream:
+                json.dump(report, stream, indent=2)
+                stream.write('\n')
+
+        if baseline is not None:
+            if baseline.get('meta', {}) != report['meta']:
+                self.stderr.write(f"Aviso: referência medida com {baseline.get('meta')}, esta execução com {report['meta']}.")
+            regressions = benchmark.compare(report, baseline, tolerance=options['tolerance'])
+            if regressions:
+                raise CommandError('Regressões:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Sem regressões em relação à referência.'))
+
+
+def _ms(value):
+    return _number(value, 9, '.1f')
+
+
+def _number(value, width, spec='g'):
+    return f'{value:>{width}{spec}}' if value is not None else f"{'-':>{width}}"
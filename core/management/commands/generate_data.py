@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera dados sintéticos de uma planta (usuários por função, demandas com histórico coerente com o fluxo) '
+        'para testes de carga e benchmarks. Não use em produção.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='Users to create (at least one per role).')
+        parser.add_argument('--requests', type=int, default=1_000_000, help='Requests to create, with their history.')
+        parser.add_argument('--days', type=int, default=3 * 365, help='Requests are spread over this many past days.')
+        parser.add_argument('--prefix', default='syn', help='Username / HMC prefix of the generated users.')
+        parser.add_argument('--password', default='senha123', help='Password of every generated user.')
+        parser.add_argument('--batch-size', type=int, default=synthetic.BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['users']:
+            created = synthetic.create_users(
+                options['users'], prefix=options['prefix'], password=options['password'], seed=options['seed'],
+            )
+            self.stdout.write(f'{created} usuário(s) criado(s).')
+
+        total = options['requests']
+
+        def progress(done):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{done}/{total} demandas ({done / elapsed:.0f}/s)')
+
+        try:
+            created = synthetic.create_requests(
+                total, days=options['days'], seed=options['seed'], batch_size=options['batch_size'], progress=progress,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f'{created} demanda(s) criada(s) em {time.perf_counter() - start:.1f}s. '
+            'Rode rollup_stages para atualizar os tempos por etapa.'
+        ))
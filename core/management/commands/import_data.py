@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import BATCH_SIZE, IMPORTERS, READERS, run_import
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa usuários (upsert por HMC), demandas ou histórico de um arquivo CSV, JSON ou JSON Lines, '
+        'em lotes, listando as linhas rejeitadas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help="Input file, or '-' for stdin.")
+        parser.add_argument('--format', choices=sorted(READERS), help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--rejects', help='Write rejected rows (line, reason, row) to this CSV file.')
+        parser.add_argument(
+            '--default-password',
+            help='Password for new users without a password column (hashed once). Otherwise they get an unusable password.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Formato desconhecido: use --format ({", ".join(sorted(READERS))}).')
+
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='') if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        start = time.perf_counter()
+        try:
+            with stream:
+                result = run_import(
+                    options['kind'], READERS[file_format](stream),
+                    batch_size=options['batch_size'], password=options['default_password'],
+                )
+        except (ValueError, csv.Error) as exc:
+            raise CommandError(f'Arquivo inválido: {exc}')
+        elapsed = time.perf_counter() - start
+
+        for line, reason, _ in result.rejected:
+            self.stderr.write(f'linha {line}: {reason}')
+        if options['rejects']:
+            with open(options['rejects'], 'w', encoding='utf-8', newline='') as out:
+                writer = csv.writer(out)
+                writer.writerow(['line', 'reason', 'row'])
+                for line, reason, row in result.rejected:
+                    writer.writerow([line, reason, json.dumps(row, ensure_ascii=False)])
+
+        total = result.created + result.updated + len(result.rejected)
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.created} criado(s), {result.updated} atualizado(s), {len(result.rejected)} rejeitado(s) '
+            f'em {elapsed:.1f}s ({total / elapsed if elapsed else total:.0f} linhas/s).'
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.images import IMAGE_FIELDS, process_request_images
+from core.models import MaintenanceRequest
+
+
+class Command(BaseCommand):
+    help = 'Gera miniaturas e variantes WebP para fotos ainda não processadas (ex.: uploads antigos).'
+
+    def handle(self, *args, **options):
+        pending = Q()
+        for field, (thumbnail_field, _) in IMAGE_FIELDS.items():
+            pending |= ~Q(**{field: ''}) & Q(**{f'{field}__isnull': False}) & (Q(**{thumbnail_field: ''}) | Q(**{f'{thumbnail_field}__isnull': True}))
+
+        ids = MaintenanceRequest.objects.filter(pending).values_list('id', flat=True).order_by('id')
+        total = 0
+        for request_id in ids.iterator():
+            process_request_images(request_id)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'{total} demanda(s) processada(s).'))
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from core.models import RequestChange
+
+
+class Command(BaseCommand):
+    help = 'Remove entradas antigas do log de alterações; clientes com cursor anterior recebem 410 e recarregam a lista.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Keep this many days of changes.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Cut at a sequence number so the remaining log has no holes
+        last = RequestChange.objects.filter(changed_at__lt=cutoff).aggregate(last=Max('seq'))['last']
+        deleted = RequestChange.objects.filter(seq__lte=last).delete()[0] if last else 0
+        self.stdout.write(self.style.SUCCESS(f'{deleted} alteração(ões) removida(s).'))
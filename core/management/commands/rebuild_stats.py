@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.stats import find_drift, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Recalcula os contadores do dashboard (RequestCounter) a partir das demandas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drift between stored and recomputed counters; exit 1 if any.',
+        )
+
+    def handle(self, *args, **options):
+        drift = find_drift()
+        for (dimension, key), (stored, expected) in drift.items():
+            self.stdout.write(f"{dimension}:{key or '-'} stored={stored} expected={expected}")
+
+        if options['check']:
+            if drift:
+                raise CommandError(f'{len(drift)} counter(s) drifted; run rebuild_stats to fix.')
+            self.stdout.write(self.style.SUCCESS('Counters are consistent.'))
+            return
+
+        counts = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(counts)} counters ({len(drift)} drifted)."))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import analytics
+
+
+class Command(BaseCommand):
+    help = 'Atualiza os totais diários de tempo por etapa (lead time e SLA) com o histórico novo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute every rollup from the whole history.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, refreshing every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write(f"stages={analytics.rebuild()}")
+        try:
+            while True:
+                added = analytics.refresh()
+                if added:
+                    self.stdout.write(f"stages={added}")
+                if not options['loop']:
+                    break
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
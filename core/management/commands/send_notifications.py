@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.notifications import MAX_ATTEMPTS, send_pending
+
+
+class Command(BaseCommand):
+    help = 'Envia os emails pendentes da fila de notificações (NotificationOutbox).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help='Attempts before a message is dead-lettered.')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling the outbox every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                sent, failed = send_pending(options['batch_size'], options['max_attempts'])
+                if sent or failed:
+                    self.stdout.write(f"sent={sent} failed={failed}")
+                    continue  # more may already be due
+                if not options['loop']:
+                    break
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,143 @@
+import mimetypes
+import os
+import re
+import time
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.core.signing import BadSignature, Signer
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# 'django' streams the file from Python; 'x-accel-redirect' (nginx) and 'x-sendfile'
+# (Apache/lighttpd) only authorise and let the web server send the bytes
+DELIVERY = getattr(settings, 'MEDIA_DELIVERY', 'django')
+ACCEL_REDIRECT_PREFIX = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+# Signed URLs stay identical for a whole window, so browsers can keep caching them
+URL_WINDOW_SECONDS = getattr(settings, 'MEDIA_URL_WINDOW_SECONDS', 24 * 3600)
+CACHE_SECONDS = getattr(settings, 'MEDIA_CACHE_SECONDS', 24 * 3600)
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+_signer = Signer(salt='core.media')
+
+
+def _sign(name, expires):
+    return _signer.signature(f'{name}:{expires}')
+
+
+def url_window():
+    # Signed URLs change when this does; cached API responses that embed them must too
+    return int(time.time()) // URL_WINDOW_SECONDS
+
+
+def signed_query(name):
+    # Valid until the end of the next window
+    expires = (url_window() + 2) * URL_WINDOW_SECONDS
+    return urlencode({'expires': expires, 'sig': _sign(name, expires)})
+
+
+def has_valid_signature(request, name):
+    try:
+        expires = int(request.GET.get('expires', ''))
+    except ValueError:
+        return False
+    if expires < time.time():
+        return False
+    try:
+        _signer.unsign(f"{name}:{expires}{_signer.sep}{request.GET.get('sig', '')}")
+    except BadSignature:
+        return False
+    return True
+
+
+def _ranged_content(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header, size):
+    # Single byte ranges only; anything else is answered with the whole file (RFC 9110 allows it)
+    match = RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return 'unsatisfiable'
+    return start, end
+
+
+@require_safe
+def serve_media(request, path):
+    # Signed URLs are handed out by the API serializers to users who may see the request;
+    # staff can also open files straight from the admin with their session.
+    if not (has_valid_signature(request, path) or request.user.is_staff):
+        return HttpResponseForbidden()
+
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        patch_cache_control(not_modified, private=True, max_age=CACHE_SECONDS)
+        return not_modified
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if DELIVERY == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX + quote(path)
+    elif DELIVERY == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    else:
+        response = _django_response(request, full_path, stat.st_size, content_type, etag, last_modified)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, private=True, max_age=CACHE_SECONDS)
+    return response
+
+
+def _django_response(request, full_path, size, content_type, etag, last_modified):
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified):
+        byte_range = _parse_range(range_header, size)
+
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        return FileResponse(open(full_path, 'rb'), content_type=content_type)
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(_ranged_content(full_path, start, length), status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(length)
+    return response
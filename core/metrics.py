@@ -0,0 +1,237 @@
+import hmac
+import logging
+import threading
+import time
+import traceback
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger('core.metrics.queries')
+
+# Opt-in query log: statements slower than SLOW_QUERY_MS, and statements run
+# REPEATED_QUERY_LIMIT times in one request (an N+1), with the project code that ran them
+SLOW_QUERY_MS = getattr(settings, 'PERF_SLOW_QUERY_MS', None)
+REPEATED_QUERY_LIMIT = getattr(settings, 'PERF_REPEATED_QUERY_LIMIT', None)
+# metrics/ wants this bearer token; unset, it is open only with DEBUG. Not checked by
+# address: behind a proxy on the same host every client arrives as 127.0.0.1.
+TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+# Server-Timing goes to every client: on with DEBUG unless set either way
+SERVER_TIMING = getattr(settings, 'PERF_SERVER_TIMING', None)
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200]
+SIZE_BUCKETS = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+
+PROJECT_DIR = str(settings.BASE_DIR)
+# Label values must come from a fixed set: each new one is a series kept for the life of the process
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, series in sorted(self.series.items()):
+            text = _labels(labels)
+            for upper, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{text},le="{upper}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{text},le="+Inf"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{text}}} {series[-2]}')
+            lines.append(f'{self.name}_sum{{{text}}} {series[-1]:g}')
+        return lines
+
+
+class Registry:
+    # Per process: with several workers each one is scraped (or summed) on its own
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.duration = Histogram('http_request_duration_seconds', 'Wall time of the request.', DURATION_BUCKETS)
+        self.db_time = Histogram('http_request_db_seconds', 'Time spent in database queries.', DURATION_BUCKETS)
+        self.queries = Histogram('http_request_queries', 'Database queries per request.', QUERY_BUCKETS)
+        self.size = Histogram('http_response_size_bytes', 'Size of the response body.', SIZE_BUCKETS)
+        self.responses = Counter()
+
+    def record(self, route, method, status, measure, size):
+        labels = (('route', route), ('method', method))
+        with self._lock:
+            self.duration.observe(labels, measure.wall_time)
+            self.db_time.observe(labels, measure.db_time)
+            self.queries.observe(labels, measure.queries)
+            if size is not None:
+                self.size.observe(labels, size)
+            self.responses[(*labels, ('status', str(status)))] += 1
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for histogram in (self.duration, self.db_time, self.queries, self.size):
+                lines.extend(histogram.render())
+            lines += ['# HELP http_responses_total Responses by status.', '# TYPE http_responses_total counter']
+            for labels, count in sorted(self.responses.items()):
+                lines.append(f'http_responses_total{{{_labels(labels)}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+
+registry = Registry()
+
+
+class Measure:
+    def __init__(self, request):
+        self.request = request
+        self.started = time.perf_counter()
+        self.wall_time = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.statements = Counter()
+
+    def stop(self):
+        self.wall_time = time.perf_counter() - self.started
+
+
+# The measure of the request being served. A context variable follows the request into
+# the threads sync_to_async() runs ORM calls on, where the connection is a different one.
+current = ContextVar('core.metrics.current', default=None)
+
+
+def project_stack():
+    # The frames of our own code that led to the query, innermost last
+    return [
+        f'{frame.filename[len(PROJECT_DIR) + 1:]}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(PROJECT_DIR) and '/site-packages/' not in frame.filename
+    ]
+
+
+def timed_query(execute, sql, params, many, context):
+    measure = current.get()
+    if measure is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        measure.db_time += elapsed
+        measure.queries += 1
+        if SLOW_QUERY_MS is not None and elapsed * 1000 >= SLOW_QUERY_MS:
+            logger.warning(
+                'Consulta lenta (%.1f ms) em %s: %s\n  %s',
+                elapsed * 1000, route_name(measure.request), sql[:1000], '\n  '.join(project_stack()),
+            )
+        if REPEATED_QUERY_LIMIT is not None:
+            measure.statements[sql] += 1
+            if measure.statements[sql] == REPEATED_QUERY_LIMIT:
+                logger.warning(
+                    'Consulta repetida %s vezes em %s (N+1?): %s\n  %s',
+                    REPEATED_QUERY_LIMIT, route_name(measure.request), sql[:1000], '\n  '.join(project_stack()),
+                )
+
+
+def install(connection, **kwargs):
+    # Connected to connection_created; also called for connections opened before that
+    if timed_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(timed_query)
+
+
+def route_name(request):
+    # The URL name, e.g. maintenancerequest-approve-production for a DRF action, or the
+    # pattern; never the requested path, which the client chooses
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unmatched'
+
+
+def server_timing(measure):
+    app_time = max(measure.wall_time - measure.db_time, 0)
+    return (
+        f'app;dur={app_time * 1000:.1f}, '
+        f'db;dur={measure.db_time * 1000:.1f};desc="{measure.queries} queries", '
+        f'total;dur={measure.wall_time * 1000:.1f}'
+    )
+
+
+class PerformanceMiddleware:
+    # Wall time, DB time, query count and body size of every request, keyed by route:
+    # accumulated for metrics/ and, when enabled, returned in Server-Timing
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all(initialized_only=True):
+            install(connection)
+        measure = Measure(request)
+        token = current.set(measure)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, measure)
+
+    async def __acall__(self, request):
+        measure = Measure(request)
+        token = current.set(measure)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, measure)
+
+    def finish(self, request, response, measure):
+        measure.stop()
+        # Streams (exports, events) are timed up to their first byte; their size is unknown
+        size = None if response.streaming else len(response.content)
+        if SERVER_TIMING or (SERVER_TIMING is None and settings.DEBUG):
+            response['Server-Timing'] = server_timing(measure)
+        method = request.method if request.method in METHODS else 'other'
+        registry.record(route_name(request), method, response.status_code, measure, size)
+        return response
+
+
+def metrics_view(request):
+    if TOKEN:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.encode(), TOKEN.encode()):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
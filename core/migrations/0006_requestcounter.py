@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_maintenancerequest_technician_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('total', 'Total'), ('status', 'Status'), ('type', 'Tipo'), ('gut_band', 'Faixa GUT'), ('assigned_to', 'Responsável')], max_length=20)),
+                ('key', models.CharField(blank=True, max_length=50)),
+                ('value', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key'), name='unique_request_counter')],
+            },
+        ),
+    ]
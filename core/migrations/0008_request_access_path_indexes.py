@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_maintenancerequest_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='maintenancerequest',
+            index=models.Index(fields=['-created_at', 'id'], name='request_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancerequest',
+            index=models.Index(fields=['status', '-created_at'], name='request_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancerequest',
+            index=models.Index(fields=['requester', '-created_at'], name='request_requester_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancerequest',
+            index=models.Index(fields=['assigned_to', 'status'], name='request_assignee_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requesthistory',
+            index=models.Index(fields=['request', 'timestamp'], name='history_request_time_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maintenancerequest',
+            name='execution_photo_thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='executions/thumbs/'),
+        ),
+        migrations.AddField(
+            model_name='maintenancerequest',
+            name='execution_photo_webp',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='executions/webp/'),
+        ),
+        migrations.AddField(
+            model_name='maintenancerequest',
+            name='photo_thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='requests/thumbs/'),
+        ),
+        migrations.AddField(
+            model_name='maintenancerequest',
+            name='photo_webp',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='requests/webp/'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:15
+
+import django.db.models.expressions
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_request_change_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Adding the stored generated column computes it for every existing row (SQLite
+    # rebuilds the table; the FTS triggers are restored by the post_migrate hook)
+    operations = [
+        migrations.RemoveIndex(
+            model_name='maintenancerequest',
+            name='request_assignee_status_idx',
+        ),
+        migrations.AddField(
+            model_name='maintenancerequest',
+            name='priority',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('gut_gravity'), '*', models.F('gut_urgency')), '*', models.F('gut_tendency')), output_field=models.IntegerField(), verbose_name='Prioridade (GUT)'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancerequest',
+            index=models.Index(fields=['status', '-priority', 'created_at'], name='request_status_priority_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancerequest',
+            index=models.Index(fields=['assigned_to', 'status', '-priority', 'created_at'], name='request_assignee_priority_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_request_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('stage', models.CharField(choices=[('OPEN', 'Emitido'), ('WAITING_PROD', 'Aguardando Aprovação (Produção)'), ('WAITING_MAINT', 'Aguardando Aprovação (Manutenção)'), ('WAITING_MANAGER', 'Aguardando Gerente (Engenharia)'), ('IN_EXECUTION', 'Em Execução'), ('DONE', 'Concluído'), ('REJECTED', 'Rejeitado')], max_length=20)),
+                ('dimension', models.CharField(choices=[('total', 'Total'), ('equipment', 'Equipamento'), ('process', 'Processo'), ('assigned_to', 'Responsável')], max_length=20)),
+                ('key', models.CharField(blank=True, max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+                ('breaches', models.IntegerField(default=0)),
+                ('histogram', models.JSONField(default=dict)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'day', 'stage', 'key'), name='unique_stage_rollup')],
+            },
+        ),
+    ]
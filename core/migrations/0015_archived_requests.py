@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:35
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_stage_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRequest',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('OPEN', 'Emitido'), ('WAITING_PROD', 'Aguardando Aprovação (Produção)'), ('WAITING_MAINT', 'Aguardando Aprovação (Manutenção)'), ('WAITING_MANAGER', 'Aguardando Gerente (Engenharia)'), ('IN_EXECUTION', 'Em Execução'), ('DONE', 'Concluído'), ('REJECTED', 'Rejeitado')], max_length=20)),
+                ('title', models.CharField(max_length=200)),
+                ('equipment', models.CharField(max_length=100)),
+                ('process', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('history', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('requester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_requests', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-created_at', 'id'], name='archived_created_idx'), models.Index(fields=['status', '-created_at'], name='archived_status_created_idx')],
+            },
+        ),
+    ]
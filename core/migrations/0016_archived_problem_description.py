@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+def copy_problem_description(apps, schema_editor):
+    # Rows archived before the column existed have it only in their data
+    ArchivedRequest = apps.get_model('core', 'ArchivedRequest')
+    rows = ArchivedRequest.objects.only('data').iterator(chunk_size=500)
+    batch = []
+    for row in rows:
+        row.problem_description = row.data.get('problem_description') or ''
+        batch.append(row)
+        if len(batch) == 500:
+            ArchivedRequest.objects.bulk_update(batch, ['problem_description'])
+            batch = []
+    ArchivedRequest.objects.bulk_update(batch, ['problem_description'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_archived_requests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedrequest',
+            name='problem_description',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(copy_problem_description, migrations.RunPython.noop),
+    ]
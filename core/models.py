@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
 class EmailConfiguration(models.Model):
     KEY_CHOICES = [
@@ -41,6 +43,7 @@ class MaintenanceRequest(models.Model):
         ('DONE', 'Concluído'),
         ('REJECTED', 'Rejeitado'),
     ]
+    CLOSED_STATUSES = ['DONE', 'REJECTED']
 
     title = models.CharField(max_length=200)
     problem_description = models.TextField(verbose_name="Problema")
@@ -51,8 +54,19 @@ class MaintenanceRequest(models.Model):
     gut_gravity = models.IntegerField(choices=[(i, str(i)) for i in range(1, 6)])
     gut_urgency = models.IntegerField(choices=[(i, str(i)) for i in range(1, 6)])
     gut_tendency = models.IntegerField(choices=[(i, str(i)) for i in range(1, 6)])
+    # G x U x T (1..125), computed and stored by the database on every INSERT/UPDATE,
+    # bulk_create() and queryset.update() included
+    priority = models.GeneratedField(
+        expression=models.F('gut_gravity') * models.F('gut_urgency') * models.F('gut_tendency'),
+        output_field=models.IntegerField(),
+        db_persist=True,
+        verbose_name="Prioridade (GUT)",
+    )
     
     photo = models.ImageField(upload_to='requests/', blank=True, null=True)
+    # Derived by core.images after upload
+    photo_thumbnail = models.ImageField(upload_to='requests/thumbs/', blank=True, null=True, editable=False)
+    photo_webp = models.ImageField(upload_to='requests/webp/', blank=True, null=True, editable=False)
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='OPEN')
     
@@ -71,6 +85,8 @@ class MaintenanceRequest(models.Model):
     # Execution fields
     execution_description = models.TextField(blank=True, null=True, verbose_name="Descrição da Atividade")
     execution_photo = models.ImageField(upload_to='executions/', blank=True, null=True, verbose_name="Foto da Execução")
+    execution_photo_thumbnail = models.ImageField(upload_to='executions/thumbs/', blank=True, null=True, editable=False)
+    execution_photo_webp = models.ImageField(upload_to='executions/webp/', blank=True, null=True, editable=False)
     pm04_order = models.CharField(max_length=50, blank=True, null=True, verbose_name="Nº Ordem PM04")
     technician_name = models.CharField(max_length=100, blank=True, null=True, verbose_name="Nome do Técnico Executante")
     
@@ -78,6 +94,19 @@ class MaintenanceRequest(models.Model):
     observation = models.TextField(blank=True, null=True, verbose_name="Observação")
     finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Data de Encerramento")
 
+    class Meta:
+        # Access paths of the API: list/cursor pages by recency, board and status filter,
+        # "my requests", and the priority queue per status and per assignee
+        indexes = [
+            models.Index(fields=['-created_at', 'id'], name='request_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='request_status_created_idx'),
+            models.Index(fields=['requester', '-created_at'], name='request_requester_idx'),
+            models.Index(fields=['status', '-priority', 'created_at'], name='request_status_priority_idx'),
+            models.Index(fields=['assigned_to', 'status', '-priority', 'created_at'], name='request_assignee_priority_idx'),
+            # Covers COUNT/MAX(updated_at) for the list's conditional GET validators
+            models.Index(fields=['status', 'updated_at'], name='request_status_updated_idx'),
+        ]
+
     def __str__(self):
         return f"#{self.id} - {self.title}"
 
@@ -88,5 +117,148 @@ class RequestHistory(models.Model):
     comment = models.TextField(blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['request', 'timestamp'], name='history_request_time_idx'),
+        ]
+
     def __str__(self):
         return f"{self.action} on #{self.request.id} by {self.actor}"
+
+class RequestCounter(models.Model):
+    # Pre-aggregated dashboard counts, maintained by core.stats alongside every write
+    DIMENSION_CHOICES = [
+        ('total', 'Total'),
+        ('status', 'Status'),
+        ('type', 'Tipo'),
+        ('gut_band', 'Faixa GUT'),
+        ('assigned_to', 'Responsável'),
+    ]
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    key = models.CharField(max_length=50, blank=True)
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'key'], name='unique_request_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}:{self.key} = {self.value}"
+
+class NotificationOutbox(models.Model):
+    # E-mails are queued here in the same transaction as the change that triggers them
+    # and delivered by the send_notifications worker (core.notifications)
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendente'),
+        ('SENT', 'Enviado'),
+        ('DEAD', 'Descartado'),
+    ]
+    recipient_key = models.CharField(max_length=50, blank=True, verbose_name="Chave de Configuração de Email")
+    recipient_email = models.EmailField(blank=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    request = models.ForeignKey(MaintenanceRequest, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipient_email or self.recipient_key} ({self.status})"
+
+class ChangeSequence(models.Model):
+    # Single row holding the last change number handed out. Taking numbers with
+    # UPDATE ... SET value = value + n locks the row until commit, so changes become
+    # visible in number order and a client never skips one that commits late.
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.value)
+
+class RequestChange(models.Model):
+    # Append-only log of writes to requests and their history, read by requests/changes/
+    MODEL_CHOICES = [
+        ('request', 'Demanda'),
+        ('history', 'Histórico'),
+    ]
+    seq = models.BigIntegerField(primary_key=True)
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['changed_at'], name='change_changed_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.seq}: {self.model} #{self.object_id}{' (removido)' if self.deleted else ''}"
+
+class StageRollup(models.Model):
+    # Daily totals of the time requests spent in each workflow stage, per dimension value.
+    # Maintained incrementally by core.analytics; a row covers the stages that ended that day.
+    DIMENSION_CHOICES = [
+        ('total', 'Total'),
+        ('equipment', 'Equipamento'),
+        ('process', 'Processo'),
+        ('assigned_to', 'Responsável'),
+    ]
+    day = models.DateField()
+    stage = models.CharField(max_length=20, choices=MaintenanceRequest.STATUS_CHOICES)
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    key = models.CharField(max_length=100, blank=True)
+    count = models.IntegerField(default=0)
+    total_seconds = models.FloatField(default=0)
+    breaches = models.IntegerField(default=0)
+    # {bucket: count} on a logarithmic scale, merged across days for percentiles
+    histogram = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'day', 'stage', 'key'], name='unique_stage_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.stage} {self.dimension}:{self.key} ({self.count})"
+
+class AnalyticsWatermark(models.Model):
+    # How far into the change log (RequestChange.seq) the rollups have been brought
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+class ArchivedRequest(models.Model):
+    # Closed requests moved out of the hot tables by core.archive, with their history.
+    # ``data`` and ``history`` hold the original rows (Django's python serialization),
+    # the columns beside them are what the API filters and orders on.
+    id = models.BigIntegerField(primary_key=True)
+    status = models.CharField(max_length=20, choices=MaintenanceRequest.STATUS_CHOICES)
+    title = models.CharField(max_length=200)
+    problem_description = models.TextField(default='')
+    equipment = models.CharField(max_length=100)
+    process = models.CharField(max_length=100)
+    requester = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_requests')
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    history = models.JSONField(encoder=DjangoJSONEncoder, default=list)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', 'id'], name='archived_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='archived_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} - {self.title} (arquivada)"
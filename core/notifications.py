@@ -0,0 +1,156 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EmailConfiguration, NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+FROM_EMAIL = getattr(settings, 'NOTIFICATION_FROM_EMAIL', 'system@maintenance.com')
+MAX_ATTEMPTS = getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 5)
+RETRY_BASE_SECONDS = getattr(settings, 'NOTIFICATION_RETRY_BASE_SECONDS', 60)
+# A claimed message is invisible to other workers for this long
+LEASE_SECONDS = getattr(settings, 'NOTIFICATION_LEASE_SECONDS', 300)
+
+
+def notify_role(role_key, request_obj, subject):
+    # The address is resolved by the worker, so the request thread does not read EmailConfiguration
+    return NotificationOutbox.objects.create(
+        recipient_key=role_key,
+        subject=subject,
+        body=f"Demanda #{request_obj.id} - {request_obj.title}\nStatus: {request_obj.get_status_display()}",
+        request=request_obj,
+    )
+
+
+def notify_user(user, request_obj, subject):
+    if not user.email:
+        logger.warning("Usuário %s não possui email cadastrado.", user.username)
+        return None
+    return NotificationOutbox.objects.create(
+        recipient_email=user.email,
+        subject=subject,
+        body=(
+            f"Olá {user.first_name},\n\nA demanda #{request_obj.id} - '{request_obj.title}' foi atribuída a você."
+            f"\n\nStatus: {request_obj.get_status_display()}\n\nAcesse o sistema para mais detalhes."
+        ),
+        request=request_obj,
+    )
+
+
+def notify_transition(transition, request_objs):
+    # One message per recipient, however many requests the transition moved
+    if not request_objs:
+        return
+    if transition.notify_role:
+        notify_role_many(transition.notify_role, request_objs, transition.notify_subject)
+    if transition.notify_assignee:
+        by_assignee = {}
+        for request_obj in request_objs:
+            if request_obj.assigned_to_id:
+                by_assignee.setdefault(request_obj.assigned_to_id, []).append(request_obj)
+        for objs in by_assignee.values():
+            notify_user_many(objs[0].assigned_to, objs, transition.notify_subject)
+
+
+def notify_role_many(role_key, request_objs, subject):
+    if len(request_objs) == 1:
+        return notify_role(role_key, request_objs[0], subject)
+    lines = [f"#{obj.id} - {obj.title} ({obj.get_status_display()})" for obj in request_objs]
+    return NotificationOutbox.objects.create(
+        recipient_key=role_key,
+        subject=f"{subject} ({len(request_objs)} demandas)",
+        body="\n".join(lines),
+    )
+
+
+def notify_user_many(user, request_objs, subject):
+    if len(request_objs) == 1:
+        return notify_user(user, request_objs[0], subject)
+    if not user.email:
+        logger.warning("Usuário %s não possui email cadastrado.", user.username)
+        return None
+    lines = [f"#{obj.id} - '{obj.title}' ({obj.get_status_display()})" for obj in request_objs]
+    return NotificationOutbox.objects.create(
+        recipient_email=user.email,
+        subject=f"{subject} ({len(request_objs)} demandas)",
+        body=(
+            f"Olá {user.first_name},\n\nAs seguintes demandas foram atribuídas a você:\n\n"
+            + "\n".join(lines)
+            + "\n\nAcesse o sistema para mais detalhes."
+        ),
+    )
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def claim_batch(batch_size):
+    # Lease a batch: bump attempts and push next_attempt_at past the lease, so concurrent
+    # workers skip these rows while we talk to the SMTP server outside the transaction.
+    now = timezone.now()
+    with transaction.atomic():
+        pending = NotificationOutbox.objects.filter(status='PENDING', next_attempt_at__lte=now).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        ids = list(pending.values_list('id', flat=True)[:batch_size])
+        NotificationOutbox.objects.filter(id__in=ids).update(
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + timedelta(seconds=LEASE_SECONDS),
+        )
+    return list(NotificationOutbox.objects.filter(id__in=ids).order_by('id'))
+
+
+def send_pending(batch_size=100, max_attempts=MAX_ATTEMPTS):
+    # Deliver one batch over a single SMTP connection. Returns (sent, failed).
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    keys = {item.recipient_key for item in batch if item.recipient_key}
+    addresses = dict(EmailConfiguration.objects.filter(key__in=keys).values_list('key', 'email'))
+
+    sent, failed = [], []
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+        for item in batch:
+            recipient = item.recipient_email or addresses.get(item.recipient_key)
+            if not recipient:
+                item.last_error = f"Configuração de email não encontrada para {item.recipient_key}"
+                failed.append(item)
+                continue
+            try:
+                EmailMessage(item.subject, item.body, FROM_EMAIL, [recipient], connection=mail_connection).send()
+            except Exception as exc:
+                item.last_error = repr(exc)
+                failed.append(item)
+            else:
+                sent.append(item)
+    except Exception as exc:
+        # Could not even open the connection: everything left in the batch is retried
+        done = {item.id for item in sent + failed}
+        for item in batch:
+            if item.id not in done:
+                item.last_error = repr(exc)
+                failed.append(item)
+    finally:
+        mail_connection.close()
+
+    now = timezone.now()
+    for item in sent:
+        item.status, item.sent_at, item.last_error = 'SENT', now, ''
+    for item in failed:
+        if item.attempts >= max_attempts:
+            item.status = 'DEAD'
+            logger.error("Notificação #%s descartada após %s tentativas: %s", item.id, item.attempts, item.last_error)
+        else:
+            item.next_attempt_at = now + retry_delay(item.attempts)
+    NotificationOutbox.objects.bulk_update(sent + failed, ['status', 'sent_at', 'last_error', 'next_attempt_at'])
+    return len(sent), len(failed)
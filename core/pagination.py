@@ -0,0 +1,41 @@
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+
+
+class RequestPageNumberPagination(PageNumberPagination):
+    # Classic ?page=N pagination, now honouring ?page_size= (the Kanban asks for 100)
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class RequestCursorPagination(CursorPagination):
+    # Keyset pagination: no COUNT(*) and no OFFSET scan, so page 1000 costs the same as page 1
+    ordering = ('-created_at', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    @classmethod
+    def is_requested(cls, request):
+        params = request.query_params
+        return params.get('pagination') == 'cursor' or cls.cursor_query_param in params
+
+    def get_next_link_for(self, base_url, page, following):
+        # Next-page link for a first page fetched outside paginate_queryset() (e.g. a board
+        # column). ``following`` is the row after the page, or None when the page is the last.
+        self.base_url = base_url
+        self.page = page
+        self.page_size = len(page)
+        self.cursor = None
+        self.has_previous = False
+        self.has_next = following is not None
+        if not self.has_next:
+            return None
+        self.next_position = self._get_position_from_instance(following, self.ordering)
+        return self.get_next_link()
+
+
+class HistoryCursorPagination(CursorPagination):
+    # requests/{id}/history/: newest first, keyset over the (request, timestamp) index
+    ordering = ('-timestamp', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
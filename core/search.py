@@ -0,0 +1,155 @@
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import MaintenanceRequest
+
+# Columns covered by the full-text index, in index order
+SEARCH_FIELDS = ['title', 'problem_description', 'equipment', 'process']
+
+REQUEST_TABLE = MaintenanceRequest._meta.db_table
+SQLITE_FTS_TABLE = 'core_maintenancerequest_fts'
+MYSQL_FULLTEXT_INDEX = 'core_maintenancerequest_fulltext'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# bm25 scores every match before the first page can be cut, so a common word costs time in
+# proportion to the table. Past this many matches SQLite returns them newest first instead,
+# read off the index in rowid order and stopped at the page.
+SQLITE_RANK_LIMIT = getattr(settings, 'SEARCH_SQLITE_RANK_LIMIT', 1000)
+
+# InnoDB does not index words shorter than innodb_ft_min_token_size or in its stopword
+# list; required in BOOLEAN MODE, such a word matches nothing. Keep these in step with
+# the server (innodb_ft_server_stopword_table replaces the default list below).
+MYSQL_MIN_TOKEN_SIZE = getattr(settings, 'SEARCH_MYSQL_MIN_TOKEN_SIZE', 3)
+MYSQL_STOPWORDS = getattr(settings, 'SEARCH_MYSQL_STOPWORDS', {
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from', 'how', 'i',
+    'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'what', 'when',
+    'where', 'who', 'will', 'with', 'und', 'www',
+})
+
+
+def _columns(prefix=''):
+    return ', '.join(f'{prefix}{field}' for field in SEARCH_FIELDS)
+
+
+def sqlite_index_statements():
+    # External-content FTS5 table: the text lives only in core_maintenancerequest, the
+    # index is kept in sync by triggers, so queryset.update() and bulk_create() are covered too.
+    # The UPDATE trigger only fires for the indexed columns, status changes cost nothing.
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+            {_columns()},
+            content='{REQUEST_TABLE}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ai AFTER INSERT ON {REQUEST_TABLE} BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, {_columns()}) VALUES (new.id, {_columns('new.')});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ad AFTER DELETE ON {REQUEST_TABLE} BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, {_columns()})
+            VALUES ('delete', old.id, {_columns('old.')});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_au AFTER UPDATE OF {_columns()} ON {REQUEST_TABLE} BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, {_columns()})
+            VALUES ('delete', old.id, {_columns('old.')});
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, {_columns()}) VALUES (new.id, {_columns('new.')});
+        END""",
+    ]
+
+
+def install_index(connection, rebuild=False):
+    # Idempotent. Also run after every migrate: SQLite migrations that rebuild
+    # core_maintenancerequest drop its triggers along with the old table.
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for statement in sqlite_index_statements():
+                cursor.execute(statement)
+            if rebuild:
+                cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT COUNT(*) FROM information_schema.statistics '
+                'WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s',
+                [REQUEST_TABLE, MYSQL_FULLTEXT_INDEX],
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute(f'ALTER TABLE {REQUEST_TABLE} ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} ({_columns()})')
+
+
+def uninstall_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+        elif connection.vendor == 'mysql':
+            cursor.execute(f'ALTER TABLE {REQUEST_TABLE} DROP INDEX {MYSQL_FULLTEXT_INDEX}')
+
+
+def search_requests(queryset, term, ranked=True):
+    # Full-text search with prefix matching on every word ("prens vaz" finds
+    # "Prensa com vazamento"). With ranked=True the best matches come first; callers that
+    # impose their own ordering (cursor pages, board columns) should pass ranked=False.
+    # Backends without a native index fall back to icontains.
+    tokens = TOKEN_RE.findall(term)
+    if not tokens:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        if not ranked:
+            return queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s', [match]))
+        joined = dict(
+            tables=[SQLITE_FTS_TABLE],
+            where=[f'{SQLITE_FTS_TABLE}.rowid = {REQUEST_TABLE}.id', f'{SQLITE_FTS_TABLE} MATCH %s'],
+            params=[match],
+        )
+        if sqlite_match_count(queryset.db, match, SQLITE_RANK_LIMIT + 1) > SQLITE_RANK_LIMIT:
+            return queryset.extra(**joined, order_by=[f'-{SQLITE_FTS_TABLE}.rowid'])
+        return queryset.extra(
+            **joined,
+            select={'search_rank': f'bm25({SQLITE_FTS_TABLE})'},  # lower is better
+        ).order_by('search_rank', '-created_at')
+
+    if vendor == 'mysql':
+        match, unindexed = mysql_match(tokens)
+        if not match:
+            return queryset.filter(words_condition(tokens))
+        relevance = RawSQL(f'MATCH ({_columns()}) AGAINST (%s IN BOOLEAN MODE)', [match])
+        # Words the index skips are still required, by a plain match over the indexed hits
+        queryset = queryset.annotate(search_rank=relevance).filter(search_rank__gt=0).filter(words_condition(unindexed))
+        return queryset.order_by('-search_rank', '-created_at') if ranked else queryset
+
+    return queryset.filter(words_condition(tokens))
+
+
+def sqlite_match_count(using, match, limit):
+    # Matches counted up to limit: the cost is bounded however common the words are
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT COUNT(*) FROM (SELECT 1 FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s LIMIT %s)',
+            [match, limit],
+        )
+        return cursor.fetchone()[0]
+
+
+def mysql_match(tokens):
+    # (BOOLEAN MODE query over the indexable tokens, the tokens left out)
+    indexed = [token for token in tokens if len(token) >= MYSQL_MIN_TOKEN_SIZE and token.lower() not in MYSQL_STOPWORDS]
+    return ' '.join(f'+{token}*' for token in indexed), [token for token in tokens if token not in indexed]
+
+
+def words_condition(tokens):
+    # Every token in some SEARCH_FIELDS column: the match without an index (also the archive's)
+    condition = Q()
+    for token in tokens:
+        token_q = Q()
+        for field in SEARCH_FIELDS:
+            token_q |= Q(**{f'{field}__icontains': token})
+        condition &= token_q
+    return condition
@@ -1,5 +1,8 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import models
+from . import media
 from .models import MaintenanceRequest, EmailConfiguration, RequestHistory
 
 class UserSerializer(serializers.ModelSerializer):
@@ -23,12 +26,23 @@ class RequestHistorySerializer(serializers.ModelSerializer):
         model = RequestHistory
         fields = ['id', 'action', 'actor', 'actor_name', 'comment', 'timestamp']
 
-class MaintenanceRequestSerializer(serializers.ModelSerializer):
+class SignedImageField(serializers.ImageField):
+    # <img> tags cannot send the API token, so file URLs carry a signature checked by core.media
+    def to_representation(self, value):
+        url = super().to_representation(value)
+        if url:
+            url = f'{url}?{media.signed_query(value.name)}'
+        return url
+
+class MaintenanceRequestListSerializer(serializers.ModelSerializer):
+    # Used by list(): no nested history, names come from select_related joins
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping, models.ImageField: SignedImageField}
     requester_name = serializers.ReadOnlyField(source='requester.username')
     assigned_to_name = serializers.ReadOnlyField(source='assigned_to.username')
-    history = RequestHistorySerializer(many=True, read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     type_display = serializers.CharField(source='get_type_display', read_only=True)
+    # Set on instances loaded from the archive (core.archive)
+    archived = serializers.BooleanField(read_only=True, default=False)
 
     class Meta:
         model = MaintenanceRequest
@@ -41,3 +55,39 @@ class MaintenanceRequestSerializer(serializers.ModelSerializer):
         if request and hasattr(request, 'user'):
             validated_data['requester'] = request.user
         return super().create(validated_data)
+
+HISTORY_EMBED_LIMIT = getattr(settings, 'HISTORY_EMBED_LIMIT', 20)
+
+class MaintenanceRequestSerializer(MaintenanceRequestListSerializer):
+    # Embeds the latest HISTORY_EMBED_LIMIT history entries, oldest first; the rest are
+    # paged at requests/{id}/history/
+    history = serializers.SerializerMethodField()
+    history_truncated = serializers.SerializerMethodField()
+
+    class Meta(MaintenanceRequestListSerializer.Meta):
+        pass
+
+    def latest_history(self, obj):
+        # Newest first, one entry past the limit. The detail view prefetches it
+        # (MaintenanceRequestViewSet.get_queryset); other callers pay one query.
+        if not hasattr(obj, 'latest_history'):
+            obj.latest_history = list(
+                obj.history.select_related('actor').order_by('-timestamp', '-id')[:HISTORY_EMBED_LIMIT + 1]
+            )
+        return obj.latest_history
+
+    def get_history(self, obj):
+        entries = self.latest_history(obj)[:HISTORY_EMBED_LIMIT]
+        return RequestHistorySerializer(entries[::-1], many=True, context=self.context).data
+
+    def get_history_truncated(self, obj):
+        return len(self.latest_history(obj)) > HISTORY_EMBED_LIMIT
+
+class ArchivedRequestSerializer(MaintenanceRequestSerializer):
+    # Detail of an archived request: same payload, history read from the archive row
+
+    class Meta(MaintenanceRequestSerializer.Meta):
+        pass
+
+    def latest_history(self, obj):
+        return obj.archived_history[::-1][:HISTORY_EMBED_LIMIT + 1]
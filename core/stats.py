@@ -0,0 +1,124 @@
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Value, When
+
+from .models import MaintenanceRequest, RequestCounter
+
+# Upper bound (inclusive) of each band of the G x U x T product (1..125)
+GUT_BANDS = [
+    (27, 'LOW'),
+    (64, 'MEDIUM'),
+    (125, 'HIGH'),
+]
+
+
+def gut_band(score):
+    for upper, band in GUT_BANDS:
+        if score <= upper:
+            return band
+    return GUT_BANDS[-1][1]
+
+
+def snapshot(request_obj):
+    # The counter keys a request currently contributes to. Take it before mutating the
+    # instance and hand it to record_change() afterwards.
+    score = request_obj.gut_gravity * request_obj.gut_urgency * request_obj.gut_tendency
+    return [
+        ('total', ''),
+        ('status', request_obj.status),
+        ('type', request_obj.type or ''),
+        ('gut_band', gut_band(score)),
+        ('assigned_to', str(request_obj.assigned_to_id or '')),
+    ]
+
+
+def record_created(request_obj):
+    apply_deltas(Counter(snapshot(request_obj)))
+
+
+def record_deleted(request_obj):
+    deltas = Counter()
+    deltas.subtract(snapshot(request_obj))
+    apply_deltas(deltas)
+
+
+def record_change(before, request_obj):
+    deltas = Counter(snapshot(request_obj))
+    deltas.subtract(before)
+    apply_deltas(deltas)
+
+
+def apply_deltas(deltas):
+    # Must run inside the transaction of the write it accounts for
+    for (dimension, key), delta in deltas.items():
+        if not delta:
+            continue
+        counters = RequestCounter.objects.filter(dimension=dimension, key=key)
+        if counters.update(value=F('value') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                RequestCounter.objects.create(dimension=dimension, key=key, value=delta)
+        except IntegrityError:
+            # Created concurrently between our UPDATE and INSERT
+            counters.update(value=F('value') + delta)
+
+
+def read_stats():
+    # Single scan of the (small) counters table
+    stats = {dimension: {} for dimension, _ in RequestCounter.DIMENSION_CHOICES}
+    for dimension, key, value in RequestCounter.objects.filter(value__gt=0).values_list('dimension', 'key', 'value'):
+        stats[dimension][key] = value
+    stats['total'] = stats['total'].get('', 0)
+
+    unassigned = stats['assigned_to'].pop('', 0)
+    names = dict(User.objects.filter(id__in=[int(key) for key in stats['assigned_to']]).values_list('id', 'username'))
+    stats['assigned_to'] = [
+        {'id': int(key), 'username': names.get(int(key)), 'count': value}
+        for key, value in sorted(stats['assigned_to'].items(), key=lambda item: -item[1])
+    ]
+    stats['unassigned'] = unassigned
+    return stats
+
+
+def compute_counters():
+    # Full-table recount, used by the rebuild_stats command
+    queryset = MaintenanceRequest.objects.order_by()
+    band = Case(
+        *[When(priority__lte=upper, then=Value(name)) for upper, name in GUT_BANDS[:-1]],
+        default=Value(GUT_BANDS[-1][1]),
+    )
+    counts = Counter({('total', ''): queryset.count()})
+    for value, total in queryset.values_list('status').annotate(total=Count('id')):
+        counts[('status', value)] = total
+    for value, total in queryset.values_list('type').annotate(total=Count('id')):
+        counts[('type', value or '')] += total
+    for value, total in queryset.annotate(band=band).values_list('band').annotate(total=Count('id')):
+        counts[('gut_band', value)] = total
+    for value, total in queryset.values_list('assigned_to').annotate(total=Count('id')):
+        counts[('assigned_to', str(value or ''))] = total
+    return counts
+
+
+def find_drift():
+    expected = compute_counters()
+    stored = Counter({
+        (dimension, key): value
+        for dimension, key, value in RequestCounter.objects.values_list('dimension', 'key', 'value')
+    })
+    keys = set(expected) | set(stored)
+    return {key: (stored[key], expected[key]) for key in sorted(keys) if stored[key] != expected[key]}
+
+
+@transaction.atomic
+def rebuild_counters():
+    counts = compute_counters()
+    RequestCounter.objects.all().delete()
+    RequestCounter.objects.bulk_create([
+        RequestCounter(dimension=dimension, key=key, value=value)
+        for (dimension, key), value in counts.items() if value
+    ])
+    return counts
+
@@ -0,0 +1,222 @@
+import itertools
+import math
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import directory, changes as request_changes, history as request_history, stats as request_stats
+from .analytics import STAGE_ENTERED
+from .importer import keep_timestamps
+from .models import ArchivedRequest, MaintenanceRequest, RequestHistory, UserProfile
+
+BATCH_SIZE = 5000
+
+WORDS = [
+    'vazamento', 'ruído', 'vibração', 'aquecimento', 'rolamento', 'correia', 'motor', 'sensor',
+    'válvula', 'cilindro', 'mangueira', 'painel', 'disjuntor', 'inversor', 'engrenagem', 'lubrificação',
+    'desalinhamento', 'travamento', 'desgaste', 'trinca', 'fusível', 'contator', 'bomba', 'filtro',
+]
+EQUIPMENT = ['Prensa', 'Torno', 'Fresadora', 'Esteira', 'Compressor', 'Robô', 'Forno', 'Injetora']
+PROCESSES = ['Estamparia', 'Usinagem', 'Montagem', 'Pintura', 'Soldagem', 'Expedição']
+
+# Headcount of a plant: mostly operators opening requests, few approvers
+ROLE_WEIGHTS = {
+    'REQUESTER': 70,
+    'APPROVER_PROD': 8,
+    'APPROVER_MAINT': 4,
+    'MANAGER_MAINT': 1,
+    'EXECUTOR': 12,
+    'ENGINEER_MECH': 2.5,
+    'ENGINEER_ELEC': 2.5,
+}
+ENGINEER_ROLES = ['ENGINEER_MECH', 'ENGINEER_ELEC']
+
+TECHNICAL = ['APPROVED_PROD', 'APPROVED_MAINT_TECH']
+ENGINEERING = ['APPROVED_PROD', 'APPROVED_MAINT_ENG', 'APPROVED_MANAGER']
+
+# Every path a request can take through core.workflow, by history action, and how often
+# it ends there: a few years of a plant where most requests are long done
+PATHS = [
+    ([], 9),
+    (['APPROVED_PROD'], 7),
+    (['APPROVED_PROD', 'APPROVED_MAINT_ENG'], 3),
+    (TECHNICAL, 8),
+    (ENGINEERING, 2),
+    (TECHNICAL + ['FINISHED'], 50),
+    (ENGINEERING + ['FINISHED'], 12),
+    (['REJECTED_PROD'], 5),
+    (['APPROVED_PROD', 'REJECTED_MAINT'], 3),
+    (['APPROVED_PROD', 'APPROVED_MAINT_ENG', 'REJECTED_MAINT'], 1),
+]
+PATH_ACTIONS = [path for path, _ in PATHS]
+PATH_WEIGHTS = list(itertools.accumulate(weight for _, weight in PATHS))
+
+# Median hours spent in each stage; durations are log-normal, so some blow their SLA
+STAGE_HOURS = {'OPEN': 16, 'WAITING_MAINT': 30, 'WAITING_MANAGER': 60, 'IN_EXECUTION': 96}
+STAGE_SPREAD = 1.0
+
+ACTORS = {
+    'APPROVED_PROD': 'APPROVER_PROD',
+    'REJECTED_PROD': 'APPROVER_PROD',
+    'APPROVED_MAINT_TECH': 'APPROVER_MAINT',
+    'APPROVED_MAINT_ENG': 'APPROVER_MAINT',
+    'APPROVED_MANAGER': 'MANAGER_MAINT',
+    'REJECTED_MAINT': 'APPROVER_MAINT',
+}
+REJECTION_REASONS = ['Duplicada', 'Fora do escopo da manutenção', 'Equipamento em garantia', 'Sem informações suficientes']
+
+
+# Users
+
+@transaction.atomic
+def create_users(count, prefix='syn', password='senha123', seed=42):
+    # count users <prefix>000001..., at least one per role; returns how many were created
+    rng = random.Random(seed)
+    roles = list(ROLE_WEIGHTS)
+    start = User.objects.filter(username__startswith=prefix).count()
+    password_hash = make_password(password)
+    created = 0
+    while created < count:
+        size = min(BATCH_SIZE, count - created)
+        users, profiles = [], []
+        for i in range(created, created + size):
+            n = start + i + 1
+            role = roles[i] if i < len(roles) else rng.choices(roles, weights=list(ROLE_WEIGHTS.values()))[0]
+            users.append(User(
+                username=f'{prefix}{n:06d}', first_name=prefix.capitalize(), last_name=f'{n:06d}',
+                email=f'{prefix}{n:06d}@example.com', password=password_hash,
+            ))
+            profiles.append(UserProfile(hmc=f'{prefix.upper()}{n:06d}', role=role))
+        User.objects.bulk_create(users)
+        if users[0].pk is None:
+            # Backends that do not return ids from bulk INSERT (MySQL)
+            ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'id'))
+            for user in users:
+                user.pk = ids[user.username]
+        for user, profile in zip(users, profiles):
+            profile.user_id = user.pk
+        UserProfile.objects.bulk_create(profiles)
+        created += size
+    # bulk writes send no post_save
+    directory.invalidate()
+    return created
+
+
+def users_by_role():
+    users = {}
+    for pk, role, username in UserProfile.objects.filter(user__is_active=True).values_list(
+        'user_id', 'role', 'user__username',
+    ).order_by('user_id'):
+        users.setdefault(role, []).append((pk, username))
+    # Either engineering role can be given an engineering request
+    users['ENGINEERS'] = [user for role in ENGINEER_ROLES for user in users.get(role, [])]
+    missing = [role for role in ROLE_WEIGHTS if role not in users and role not in ENGINEER_ROLES]
+    if missing or not users['ENGINEERS']:
+        raise ValueError(f"Faltam usuários ativos com as funções: {', '.join(missing or ENGINEER_ROLES)}")
+    return users
+
+
+# Requests: each one walks a workflow path backwards from its last event, so closed
+# requests end in the past and open ones are still waiting in their stage now
+
+def stage_seconds(rng, stage):
+    return rng.lognormvariate(math.log(STAGE_HOURS.get(stage, 24) * 3600), STAGE_SPREAD)
+
+
+def fake_request(rng, users, pk, now, days):
+    actions = rng.choices(PATH_ACTIONS, cum_weights=PATH_WEIGHTS)[0]
+    stages = ['OPEN'] + [STAGE_ENTERED[action] for action in actions]
+    durations = [stage_seconds(rng, stage) for stage in stages[:-1]]
+    if stages[-1] in MaintenanceRequest.CLOSED_STATUSES:
+        span = days * 86400 - sum(durations)
+        last = now - timedelta(seconds=rng.uniform(0, max(span, 0)))
+    else:
+        last = now - timedelta(seconds=min(stage_seconds(rng, stages[-1]), days * 86400))
+
+    times = [last]
+    for seconds in reversed(durations):
+        times.append(times[-1] - timedelta(seconds=seconds))
+    times.reverse()
+
+    equipment = rng.choice(EQUIPMENT)
+    obj = MaintenanceRequest(
+        id=pk,
+        title=' '.join(rng.sample(WORDS, 3)).capitalize(),
+        problem_description=' '.join(rng.choices(WORDS, k=12)),
+        process=rng.choice(PROCESSES),
+        equipment=f'{equipment} {rng.randint(1, 400):04d}',
+        gut_gravity=rng.randint(1, 5),
+        gut_urgency=rng.randint(1, 5),
+        gut_tendency=rng.randint(1, 5),
+        status=stages[-1],
+        requester_id=rng.choice(users['REQUESTER'])[0],
+        created_at=times[0],
+        updated_at=times[-1],
+    )
+
+    history = []
+    assignee = ''
+    for action, timestamp in zip(actions, times[1:]):
+        comment = ''
+        if action == 'APPROVED_MAINT_TECH':
+            obj.type = 'TECHNICAL'
+            obj.assigned_to_id, assignee = rng.choice(users['EXECUTOR'])
+            comment = f'Atribuído a {assignee}'
+        elif action == 'APPROVED_MAINT_ENG':
+            obj.type = 'ENGINEERING'
+            comment = 'Encaminhado para Gerência'
+        elif action == 'APPROVED_MANAGER':
+            obj.assigned_to_id, assignee = rng.choice(users['ENGINEERS'])
+            comment = f'Atribuído a {assignee}'
+        elif action.startswith('REJECTED'):
+            comment = rng.choice(REJECTION_REASONS)
+        elif action == 'FINISHED':
+            obj.finished_at = timestamp
+            obj.execution_description = ' '.join(rng.choices(WORDS, k=8)).capitalize()
+            obj.pm04_order = f'{rng.randint(10_000_000, 99_999_999)}'
+            obj.technician_name = assignee
+        actor = obj.assigned_to_id if action == 'FINISHED' else rng.choice(users[ACTORS[action]])[0]
+        history.append(RequestHistory(request_id=pk, actor_id=actor, action=action, comment=comment, timestamp=timestamp))
+    return obj, history
+
+
+def create_requests(count, days=3 * 365, seed=42, batch_size=BATCH_SIZE, progress=None):
+    # Returns how many requests were created; progress(done) is called after each batch
+    rng = random.Random(seed)
+    users = users_by_role()
+    now = timezone.now()
+    # Explicit ids, past the archived ones too (restored requests keep theirs)
+    next_id = max(
+        MaintenanceRequest.objects.aggregate(value=Max('id'))['value'] or 0,
+        ArchivedRequest.objects.aggregate(value=Max('id'))['value'] or 0,
+    ) + 1
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        objs, history = [], []
+        for pk in range(next_id + created, next_id + created + size):
+            obj, entries = fake_request(rng, users, pk, now, days)
+            objs.append(obj)
+            history.extend(entries)
+        with transaction.atomic(), keep_timestamps(MaintenanceRequest, 'created_at', 'updated_at'), \
+                keep_timestamps(RequestHistory, 'timestamp'):
+            MaintenanceRequest.objects.bulk_create(objs)
+            request_changes.record('request', [obj.pk for obj in objs])
+            request_history.write(history)
+        created += size
+        if progress:
+            progress(created)
+
+    # Explicit ids do not advance PostgreSQL sequences (no-op on SQLite/MySQL)
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [MaintenanceRequest]):
+            cursor.execute(sql)
+    # bulk_create skips record_created: recount once at the end
+    request_stats.rebuild_counters()
+    return created
@@ -1,3 +1,1588 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gc
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+import tracemalloc
+import zipfile
+from io import BytesIO, StringIO
+from urllib.parse import urlsplit
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import close_old_connections, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.contrib.auth.models import User
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .models import ArchivedRequest, MaintenanceRequest, RequestChange, RequestHistory, StageRollup, UserProfile, EmailConfiguration, NotificationOutbox
+from . import analytics, archive, authentication, benchmark, events, images, metrics, search, synthetic, workflow, changes as request_changes, history as request_history, stats as request_stats
+from .notifications import send_pending
+
+
+def make_request(requester, **kwargs):
+    data = {
+        'title': 'Vazamento na prensa',
+        'problem_description': 'Vazamento de óleo no cilindro principal',
+        'process': 'Estamparia',
+        'equipment': 'Prensa 01',
+        'gut_gravity': 3,
+        'gut_urgency': 3,
+        'gut_tendency': 3,
+    }
+    data.update(kwargs)
+    return MaintenanceRequest.objects.create(requester=requester, **data)
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('solicitante', 'solicitante@example.com', '123')
+        UserProfile.objects.create(user=self.user, role='REQUESTER', hmc='1001')
+        self.executor = User.objects.create_user('tecnico', 'tecnico@example.com', '123')
+        UserProfile.objects.create(user=self.executor, role='EXECUTOR', hmc='5001')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_requests(self, count, history=0):
+        requests = []
+        for i in range(count):
+            obj = make_request(self.user, title=f'Demanda {i}', assigned_to=self.executor)
+            for j in range(history):
+                RequestHistory.objects.create(request=obj, action='COMMENT', actor=self.executor, comment=str(j))
+            requests.append(obj)
+        return requests
+
+
+class RequestQueryCountTests(ApiTestCase):
+    def test_list_query_count_is_constant(self):
+        self.make_requests(2, history=1)
+        with self.assertNumQueries(3):  # validators + count + page
+            small = self.client.get('/api/requests/')
+        self.make_requests(8, history=5)
+        with self.assertNumQueries(3):
+            large = self.client.get('/api/requests/')
+        self.assertEqual(small.status_code, 200)
+        self.assertEqual(large.data['count'], 10)
+
+    def test_list_does_not_embed_history(self):
+        self.make_requests(1, history=3)
+        response = self.client.get('/api/requests/')
+        row = response.data['results'][0]
+        self.assertNotIn('history', row)
+        self.assertEqual(row['requester_name'], 'solicitante')
+        self.assertEqual(row['assigned_to_name'], 'tecnico')
+
+    def test_retrieve_query_count_is_constant(self):
+        few, many = self.make_requests(1, history=1) + self.make_requests(1, history=20)
+        with self.assertNumQueries(3):  # validators, request + joins, history + actors
+            self.client.get(f'/api/requests/{few.id}/')
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/requests/{many.id}/')
+        self.assertEqual(len(response.data['history']), 20)
+        self.assertEqual(response.data['history'][0]['actor_name'], 'tecnico')
+
+
+class ConditionalGetTests(ApiTestCase):
+    def test_detail_revalidates_from_updated_at(self):
+        obj = self.make_requests(1, history=2)[0]
+        url = f'/api/requests/{obj.id}/'
+        response = self.client.get(url)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with self.assertNumQueries(1):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        workflow.apply_transition(obj, 'approve_production', self.user)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_detail_sees_history_appended_without_touching_the_request(self):
+        obj = self.make_requests(1)[0]
+        url = f'/api/requests/{obj.id}/'
+        etag = self.client.get(url)['ETag']
+        RequestHistory.objects.create(request=obj, action='COMMENT', actor=self.executor)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_validators_follow_the_filtered_set(self):
+        first, second = self.make_requests(2)
+        etag = self.client.get('/api/requests/')['ETag']
+        with self.assertNumQueries(1):
+            cached = self.client.get('/api/requests/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+
+        # Deleting changes the count even though MAX(updated_at) may not move
+        MaintenanceRequest.objects.filter(pk=first.pk).delete()
+        self.assertEqual(self.client.get('/api/requests/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get('/api/requests/?status=OPEN')['ETag']
+        make_request(self.user, status='DONE')
+        self.assertEqual(self.client.get('/api/requests/?status=OPEN', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        workflow.apply_transition(second, 'approve_production', self.user)
+        self.assertEqual(self.client.get('/api/requests/?status=OPEN', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class RequestPaginationTests(ApiTestCase):
+    def test_page_number_honours_capped_page_size(self):
+        self.make_requests(12)
+        response = self.client.get('/api/requests/?page_size=11')
+        self.assertEqual(len(response.data['results']), 11)
+        self.assertEqual(response.data['count'], 12)
+        response = self.client.get('/api/requests/?page_size=1000')
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_cursor_mode_walks_every_row_without_count(self):
+        created = self.make_requests(5)
+        seen = []
+        url = '/api/requests/?pagination=cursor&page_size=2'
+        while url:
+            with self.assertNumQueries(2):  # validators + page
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [obj.id for obj in reversed(created)])
+
+
+class RequestBoardTests(ApiTestCase):
+    def test_board_groups_every_status_in_two_queries(self):
+        open_requests = self.make_requests(5)
+        for obj in self.make_requests(2):
+            MaintenanceRequest.objects.filter(pk=obj.pk).update(status='DONE')
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/requests/board/?page_size=3')
+        columns = {col['status']: col for col in response.data['columns']}
+        self.assertEqual(list(columns), [value for value, _ in MaintenanceRequest.STATUS_CHOICES])
+        self.assertEqual(columns['OPEN']['count'], 5)
+        self.assertEqual(len(columns['OPEN']['results']), 3)
+        self.assertEqual(columns['DONE']['count'], 2)
+        self.assertIsNone(columns['DONE']['next'])
+        self.assertEqual(columns['IN_EXECUTION']['results'], [])
+
+        # Following the column cursor yields the rest of the column
+        response = self.client.get(columns['OPEN']['next'])
+        rest = [row['id'] for row in response.data['results']]
+        self.assertEqual(rest, [obj.id for obj in reversed(open_requests)][3:])
+
+
+class RequestStatsTests(ApiTestCase):
+    def test_stats_follow_create_and_transitions(self):
+        self.client.post('/api/requests/', {
+            'title': 'Motor superaquecendo', 'problem_description': 'Temperatura alta',
+            'process': 'Usinagem', 'equipment': 'Torno 02',
+            'gut_gravity': 5, 'gut_urgency': 5, 'gut_tendency': 5,
+        })
+        obj = MaintenanceRequest.objects.get()
+        self.client.post(f'/api/requests/{obj.id}/approve_production/')
+        self.client.post(f'/api/requests/{obj.id}/approve_maintenance/', {'type': 'TECHNICAL', 'executor_id': self.executor.id})
+
+        with self.assertNumQueries(2):  # counters + assignee names
+            response = self.client.get('/api/requests/stats/')
+        self.assertEqual(response.data['total'], 1)
+        self.assertEqual(response.data['status'], {'IN_EXECUTION': 1})
+        self.assertEqual(response.data['type'], {'TECHNICAL': 1})
+        self.assertEqual(response.data['gut_band'], {'HIGH': 1})
+        self.assertEqual(response.data['assigned_to'], [{'id': self.executor.id, 'username': 'tecnico', 'count': 1}])
+
+    def test_rebuild_command_fixes_drift(self):
+        from django.core.management.base import CommandError
+
+        self.make_requests(3)  # created outside the API, so counters are missing
+        with self.assertRaises(CommandError):
+            call_command('rebuild_stats', '--check', stdout=StringIO())
+        call_command('rebuild_stats', stdout=StringIO())
+        call_command('rebuild_stats', '--check', stdout=StringIO())
+        self.assertEqual(self.client.get('/api/requests/stats/').data['status'], {'OPEN': 3})
+
+
+class RequestSearchTests(ApiTestCase):
+    def test_search_matches_prefixes_across_fields(self):
+        press = make_request(self.user, title='Vazamento', equipment='Prensa hidráulica 01')
+        lathe = make_request(self.user, title='Ruído', problem_description='Rolamento do torno com ruído', equipment='Torno 02')
+        make_request(self.user, title='Outro', problem_description='Sem relação', equipment='Esteira')
+
+        ids = lambda response: [row['id'] for row in response.data['results']]
+        self.assertEqual(ids(self.client.get('/api/requests/?search=prens')), [press.id])
+        self.assertEqual(ids(self.client.get('/api/requests/?search=ruido torn')), [lathe.id])
+        self.assertEqual(ids(self.client.get('/api/requests/?search=hidraulica')), [press.id])
+
+        MaintenanceRequest.objects.filter(pk=press.pk).update(equipment='Compressor')
+        self.assertEqual(ids(self.client.get('/api/requests/?search=prens')), [])
+        MaintenanceRequest.objects.filter(pk=lathe.pk).delete()
+        self.assertEqual(ids(self.client.get('/api/requests/?search=torno')), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 rank limit')
+    def test_common_words_skip_ranking_and_come_newest_first(self):
+        rare = make_request(self.user, title='Bomba de vácuo', problem_description='Bomba parada')
+        common = self.make_requests(3)
+        # The oldest is the best bm25 match
+        MaintenanceRequest.objects.filter(pk=common[0].pk).update(problem_description='demanda demanda demanda')
+        ids = lambda response: [row['id'] for row in response.data['results']]
+        self.assertEqual(ids(self.client.get('/api/requests/?search=demanda'))[0], common[0].id)
+        with patch('core.search.SQLITE_RANK_LIMIT', 2):
+            self.assertEqual(ids(self.client.get('/api/requests/?search=demanda')), [obj.id for obj in reversed(common)])
+            self.assertEqual(ids(self.client.get('/api/requests/?search=bomba')), [rare.id])
+            self.assertEqual(self.client.get('/api/requests/?search=demanda&page_size=2').data['count'], 3)
+
+    def test_mysql_query_leaves_out_words_the_index_skips(self):
+        match, unindexed = search.mysql_match(['Bomba', 'de', 'óleo', 'ab', 'The'])
+        self.assertEqual((match, unindexed), ('+Bomba* +óleo*', ['de', 'ab', 'The']))
+        self.assertEqual(search.mysql_match(['de', 'a']), ('', ['de', 'a']))
+
+    def test_search_works_with_board_and_cursor(self):
+        self.make_requests(3)
+        board = self.client.get('/api/requests/board/?search=demanda')
+        self.assertEqual(board.data['count'], 3)
+        page = self.client.get('/api/requests/?search=demanda&pagination=cursor')
+        self.assertEqual(len(page.data['results']), 3)
+
+
+class QueryPlanTests(ApiTestCase):
+    # Runs EXPLAIN on every query the hot endpoints issue and fails on a full scan of a
+    # request or history table. Index scans (e.g. ORDER BY created_at LIMIT n) are fine.
+    HOT_TABLES = ('core_maintenancerequest', 'core_requesthistory')
+
+    def setUp(self):
+        super().setUp()
+        for obj in self.make_requests(30, history=2):
+            MaintenanceRequest.objects.filter(pk=obj.pk, id__gt=20).update(status='IN_EXECUTION')
+        self.request_id = obj.id
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                details = [row[-1] for row in cursor.fetchall()]
+                return [
+                    detail for detail in details
+                    if re.match(rf'SCAN ({"|".join(self.HOT_TABLES)})\b(?!_fts)(?!.* USING (COVERING )?INDEX)', detail)
+                ]
+            cursor.execute(f'EXPLAIN {sql}')
+            columns = [col[0] for col in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [row for row in rows if row['type'] == 'ALL' and row['table'] in self.HOT_TABLES]
+
+    def assertNoFullScans(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        for query in queries.captured_queries:
+            self.assertEqual(self.full_scans(query['sql']), [], f"{url}\n{query['sql']}")
+
+    def test_list_and_filters(self):
+        self.assertNoFullScans('/api/requests/')
+        self.assertNoFullScans('/api/requests/?status=IN_EXECUTION')
+        self.assertNoFullScans('/api/requests/?pagination=cursor&status=OPEN')
+        self.assertNoFullScans(self.client.get('/api/requests/?pagination=cursor&page_size=5').data['next'])
+
+    def test_board(self):
+        self.assertNoFullScans('/api/requests/board/')
+
+    def test_detail_and_history(self):
+        self.assertNoFullScans(f'/api/requests/{self.request_id}/')
+
+    def test_priority_queue(self):
+        self.assertNoFullScans('/api/requests/queue/')
+        self.assertNoFullScans(f'/api/requests/queue/?assigned_to={self.executor.id}')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite plan wording')
+    def test_priority_queue_reads_the_index_in_order(self):
+        # Each group is a range of the index, already sorted: no temporary sort of the matches
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/requests/queue/?assigned_to={self.executor.id}')
+            self.client.get('/api/requests/queue/')
+        for query in queries.captured_queries:
+            if 'priority' not in query['sql']:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+            self.assertIn('_priority_idx', plan, query['sql'])
+            self.assertNotIn('TEMP B-TREE', plan, query['sql'])
+
+    @skipUnless(connection.vendor in ('sqlite', 'mysql'), 'EXPLAIN parsing only for SQLite and MySQL')
+    def test_workflow_lookups(self):
+        queries = [
+            MaintenanceRequest.objects.filter(assigned_to=self.executor, status='IN_EXECUTION'),
+            MaintenanceRequest.objects.filter(requester=self.user).order_by('-created_at')[:10],
+            RequestHistory.objects.filter(request_id=self.request_id).order_by('timestamp'),
+        ]
+        for queryset in queries:
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                sql = connection.ops.last_executed_query(cursor, sql, params)
+            self.assertEqual(self.full_scans(sql), [], sql)
+
+
+class NotificationOutboxTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        EmailConfiguration.objects.create(key='APPROVER_MAINT', email='maint@example.com')
+
+    def test_transition_queues_instead_of_sending(self):
+        obj = make_request(self.user)
+        self.client.post(f'/api/requests/{obj.id}/approve_production/')
+        self.assertEqual(len(mail.outbox), 0)
+        queued = NotificationOutbox.objects.get()
+        self.assertEqual((queued.recipient_key, queued.status), ('APPROVER_MAINT', 'PENDING'))
+
+        call_command('send_notifications', stdout=StringIO())
+        self.assertEqual(mail.outbox[0].to, ['maint@example.com'])
+        self.assertEqual(NotificationOutbox.objects.get().status, 'SENT')
+
+    def test_failures_back_off_then_dead_letter(self):
+        obj = make_request(self.user)
+        NotificationOutbox.objects.create(recipient_key='MANAGER_MAINT', subject='x', body='x', request=obj)
+        self.assertEqual(send_pending(max_attempts=2), (0, 1))
+        queued = NotificationOutbox.objects.get()
+        self.assertEqual(queued.status, 'PENDING')
+        self.assertGreater(queued.next_attempt_at, timezone.now())
+
+        NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(send_pending(max_attempts=2), (0, 1))
+        self.assertEqual(NotificationOutbox.objects.get().status, 'DEAD')
+
+
+class WorkflowConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.requester = User.objects.create(username='solicitante')
+        self.supervisors = [User.objects.create(username=f'sup_prod_{i}') for i in range(8)]
+        self.obj = make_request(self.requester)
+
+    def test_only_one_of_many_stale_approvals_wins(self):
+        # Every supervisor loaded the request while it was still OPEN
+        stale = [MaintenanceRequest.objects.get(pk=self.obj.pk) for _ in self.supervisors]
+        outcomes = []
+        for instance, supervisor in zip(stale, self.supervisors):
+            try:
+                workflow.apply_transition(instance, 'approve_production', supervisor)
+                outcomes.append('won')
+            except workflow.TransitionConflict:
+                outcomes.append('conflict')
+        self.assertEqual(outcomes.count('won'), 1)
+        self.assertEqual(RequestHistory.objects.filter(request=self.obj).count(), 1)
+
+    def test_only_one_of_many_simultaneous_approvals_wins(self):
+        # Shared-cache in-memory SQLite fails concurrent writers with "table is locked" instead
+        # of waiting, hence the file-backed DATABASES['default']['TEST']['NAME']
+        self.assertFalse(connection.vendor == 'sqlite' and connection.is_in_memory_db())
+        barrier = threading.Barrier(len(self.supervisors))
+        outcomes = []
+
+        def approve(supervisor):
+            try:
+                instance = MaintenanceRequest.objects.get(pk=self.obj.pk)
+                barrier.wait(timeout=10)
+                workflow.apply_transition(instance, 'approve_production', supervisor)
+                outcomes.append('won')
+            except workflow.TransitionConflict:
+                outcomes.append('conflict')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=approve, args=(supervisor,)) for supervisor in self.supervisors]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count('won'), 1)
+        self.assertEqual(outcomes.count('conflict'), len(self.supervisors) - 1)
+        self.assertEqual(MaintenanceRequest.objects.get(pk=self.obj.pk).status, 'WAITING_MAINT')
+        self.assertEqual(RequestHistory.objects.filter(request=self.obj, action='APPROVED_PROD').count(), 1)
+
+    def test_invalid_source_status_is_rejected(self):
+        MaintenanceRequest.objects.filter(pk=self.obj.pk).update(status='DONE')
+        self.obj.refresh_from_db()
+        with self.assertRaises(workflow.TransitionError):
+            workflow.apply_transition(self.obj, 'reject_production', self.requester)
+
+
+class BulkTransitionTests(ApiTestCase):
+    def test_bulk_approval_reports_per_id_and_groups_notifications(self):
+        waiting = self.make_requests(3)
+        MaintenanceRequest.objects.filter(pk__in=[obj.pk for obj in waiting]).update(status='WAITING_MAINT', assigned_to=None)
+        done = make_request(self.user, status='DONE')
+
+        response = self.client.post('/api/requests/bulk_transition/', {
+            'ids': [obj.id for obj in waiting] + [done.id, 999999],
+            'transition': 'approve_maintenance',
+            'type': 'TECHNICAL',
+            'executor_id': self.executor.id,
+        }, format='json')
+
+        self.assertEqual(response.data['applied'], 3)
+        results = {row['id']: row for row in response.data['results']}
+        self.assertTrue(all(results[obj.id]['ok'] for obj in waiting))
+        self.assertFalse(results[done.id]['ok'])
+        self.assertEqual(results[999999]['error'], 'Demanda não encontrada')
+
+        self.assertEqual(MaintenanceRequest.objects.filter(status='IN_EXECUTION', assigned_to=self.executor).count(), 3)
+        self.assertEqual(RequestHistory.objects.filter(action='APPROVED_MAINT_TECH').count(), 3)
+        # One e-mail to the executor for the three requests
+        queued = NotificationOutbox.objects.get()
+        self.assertEqual(queued.recipient_email, 'tecnico@example.com')
+        self.assertIn('(3 demandas)', queued.subject)
+
+    def test_malformed_assignee_ids_are_rejected(self):
+        waiting = make_request(self.user, status='WAITING_MAINT')
+        manager = make_request(self.user, status='WAITING_MANAGER')
+        for path, data in [
+            (f'/api/requests/{waiting.id}/approve_maintenance/', {'type': 'TECHNICAL', 'executor_id': 'abc'}),
+            (f'/api/requests/{manager.id}/approve_manager/', {'engineer_id': 'abc'}),
+        ]:
+            response = self.client.post(path, data, format='json')
+            self.assertEqual(response.status_code, 400, path)
+        self.assertEqual(set(MaintenanceRequest.objects.values_list('status', flat=True)), {'WAITING_MAINT', 'WAITING_MANAGER'})
+
+    def test_bulk_transition_query_count_does_not_grow(self):
+        def run(count):
+            objs = self.make_requests(count)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post('/api/requests/bulk_transition/', {
+                    'ids': [obj.id for obj in objs], 'transition': 'approve_production',
+                }, format='json')
+            return len(queries)
+        run(1)  # creates the counter rows touched by the transition
+        self.assertEqual(run(2), run(20))
+
+
+@override_settings(IMAGE_PIPELINE_ASYNC=False)
+class ImagePipelineTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def phone_photo(self):
+        # 4000x3000 landscape sensor image tagged "rotate 90°" with a GPS block in EXIF
+        image = Image.new('RGB', (4000, 3000), 'red')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x8825] = {2: (22.0, 54.0, 0.0)}
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('foto.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_is_normalised_and_gets_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/requests/', {
+                'title': 'Vazamento', 'problem_description': 'Óleo no piso', 'process': 'Estamparia',
+                'equipment': 'Prensa 01', 'gut_gravity': 3, 'gut_urgency': 3, 'gut_tendency': 3,
+                'photo': self.phone_photo(),
+            }, format='multipart')
+        obj = MaintenanceRequest.objects.get(pk=response.data['id'])
+
+        with Image.open(obj.photo.path) as original:
+            self.assertEqual(original.size, (1440, 1920))  # upright and capped
+            self.assertEqual(dict(original.getexif()), {})
+        with Image.open(obj.photo_thumbnail.path) as thumbnail:
+            self.assertLessEqual(max(thumbnail.size), 320)
+        with Image.open(obj.photo_webp.path) as webp:
+            self.assertEqual(webp.format, 'WEBP')
+
+        row = self.client.get('/api/requests/').data['results'][0]
+        self.assertTrue(urlsplit(row['photo_thumbnail']).path.endswith('.jpg'))
+        self.assertTrue(urlsplit(row['photo_webp']).path.endswith('.webp'))
+
+    def test_replaced_variants_are_deleted_only_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            obj = make_request(self.user, photo=self.phone_photo())
+            images.schedule(obj)
+        obj.refresh_from_db()
+        variants = [obj.photo_thumbnail.path, obj.photo_webp.path]
+
+        with patch.object(request_stats, 'record_change', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.client.patch(f'/api/requests/{obj.id}/', {'photo': self.phone_photo()}, format='multipart')
+        obj.refresh_from_db()
+        self.assertEqual([obj.photo_thumbnail.path, obj.photo_webp.path], variants)
+        self.assertTrue(all(os.path.exists(path) for path in variants))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/requests/{obj.id}/', {'photo': self.phone_photo()}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(os.path.exists(path) for path in variants))
+        obj.refresh_from_db()
+        self.assertTrue(os.path.exists(obj.photo_thumbnail.path))
+
+
+class MediaDeliveryTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.content = bytes(range(256)) * 40
+        obj = make_request(self.user, photo=SimpleUploadedFile('foto.jpg', self.content, content_type='image/jpeg'))
+        photo_url = self.client.get(f'/api/requests/{obj.id}/').data['photo']
+        url = urlsplit(photo_url)
+        self.url = f'{url.path}?{url.query}'
+        self.anonymous = APIClient()
+
+    def test_signed_url_serves_file_with_validators(self):
+        response = self.anonymous.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        cached = self.anonymous.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        cached = self.anonymous.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_missing_or_tampered_signature_is_forbidden(self):
+        path = urlsplit(self.url).path
+        self.assertEqual(self.anonymous.get(path).status_code, 403)
+        self.assertEqual(self.anonymous.get(self.url.replace('sig=', 'sig=x')).status_code, 403)
+        self.assertEqual(self.anonymous.get(self.url.replace('foto', 'outra')).status_code, 403)
+
+    def test_range_requests(self):
+        response = self.anonymous.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        response = self.anonymous.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+
+        response = self.anonymous.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+        # A stale If-Range gets the whole file
+        response = self.anonymous.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_offloaded_delivery(self):
+        with patch('core.media.DELIVERY', 'x-accel-redirect'):
+            response = self.anonymous.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Accel-Redirect'].startswith('/protected-media/'))
+        self.assertEqual(response.content, b'')
+
+
+class RequestExportTests(ApiTestCase):
+    def bulk_requests(self, count, status='OPEN'):
+        objs = MaintenanceRequest.objects.bulk_create([
+            MaintenanceRequest(
+                title=f'Demanda {i}', problem_description='Vazamento', process='Estamparia', equipment='Prensa 01',
+                gut_gravity=3, gut_urgency=4, gut_tendency=5, requester=self.user, assigned_to=self.executor,
+                status=status,
+            )
+            for i in range(count)
+        ])
+        RequestHistory.objects.bulk_create([
+            RequestHistory(request=obj, action=action, actor=self.executor)
+            for obj in objs for action in ('CREATED', 'APPROVED_PROD')
+        ])
+
+    def test_csv_honours_filters_and_joins_history(self):
+        approved = make_request(self.user, title='Aprovada', status='WAITING_MAINT', pm04_order='4000123')
+        RequestHistory.objects.create(request=approved, action='APPROVED_PROD', actor=self.executor, comment='ok')
+        make_request(self.user, title='Aberta')
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/requests/export/', {'status': 'WAITING_MAINT'})
+            content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertIn('attachment', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(content), delimiter=';'))
+        self.assertEqual(len(rows), 2)
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual(row['Título'], 'Aprovada')
+        self.assertEqual(row['GUT'], '27')
+        self.assertEqual(row['Ordem PM04'], '4000123')
+        self.assertTrue(row['Aprovada Produção em'])
+        self.assertIn('APPROVED_PROD (tecnico): ok', row['Histórico'])
+
+    def test_xlsx_is_a_workbook(self):
+        self.bulk_requests(3)
+        response = self.client.get('/api/requests/export/', {'file_format': 'xlsx'})
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 4)
+        self.assertIn('Demanda 2', sheet)
+
+        self.assertEqual(self.client.get('/api/requests/export/', {'file_format': 'pdf'}).status_code, 400)
+
+    def test_formulas_are_neutralized(self):
+        make_request(self.user, title='=HYPERLINK("http://x.example","abrir")', equipment='@SUM(A1)', process='-2+3')
+        make_request(self.user, title='Prensa = ok', equipment='Prensa 01')
+        content = b''.join(self.client.get('/api/requests/export/').streaming_content).decode('utf-8-sig')
+        rows = {row[1]: row for row in csv.reader(StringIO(content), delimiter=';')}
+        injected = rows['\'=HYPERLINK("http://x.example","abrir")']
+        self.assertEqual((injected[4], injected[5]), ("'-2+3", "'@SUM(A1)"))
+        self.assertIn('Prensa = ok', rows)
+
+        response = self.client.get('/api/requests/export/', {'file_format': 'xlsx'})
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertIn("<t xml:space=\"preserve\">'@SUM(A1)</t>", sheet)
+
+    def test_closed_statuses_include_the_archive(self):
+        old = timezone.now() - timedelta(days=400)
+        done = [make_request(self.user, title=f'Concluída {i}', status='DONE', assigned_to=self.executor) for i in range(3)]
+        for obj in done:
+            RequestHistory.objects.create(request=obj, action='FINISHED', actor=self.executor, comment='feito')
+        MaintenanceRequest.objects.filter(pk__in=[done[0].pk, done[2].pk]).update(updated_at=old)
+        make_request(self.user, title='Aberta')
+        self.assertEqual(archive.archive_closed(), 2)
+
+        with self.assertNumQueries(5):  # live rows and history, archived ids, then rows and users per chunk
+            content = b''.join(self.client.get('/api/requests/export/', {'status': 'DONE'}).streaming_content).decode('utf-8-sig')
+        rows = list(csv.reader(StringIO(content), delimiter=';'))
+        self.assertEqual([row[0] for row in rows[1:]], [str(obj.id) for obj in done])
+        archived = dict(zip(rows[0], rows[1]))
+        self.assertEqual((archived['Título'], archived['Responsável'], archived['Status']), ('Concluída 0', 'tecnico', 'Concluído'))
+        self.assertIn('FINISHED (tecnico): feito', archived['Histórico'])
+
+        searched = b''.join(self.client.get('/api/requests/export/', {'archived': '1', 'search': 'Concluída 2'}).streaming_content)
+        self.assertEqual(len(list(csv.reader(StringIO(searched.decode('utf-8-sig')), delimiter=';'))), 2)
+
+    def peak_memory(self, params):
+        # Collect reference cycles promptly: otherwise the peak depends on how much garbage
+        # happens to be waiting for the next collection, not on what the export keeps alive
+        threshold = gc.get_threshold()
+        gc.set_threshold(50)
+        tracemalloc.start()
+        try:
+            response = self.client.get('/api/requests/export/', params)
+            size = sum(len(chunk) for chunk in response.streaming_content)
+            return tracemalloc.get_traced_memory()[1], size
+        finally:
+            tracemalloc.stop()
+            gc.set_threshold(*threshold)
+
+    @patch('core.export.CHUNK_SIZE', 100)
+    @patch('core.export.FLUSH_SIZE', 4096)
+    def test_peak_memory_does_not_grow_with_rows(self):
+        self.bulk_requests(600, status='WAITING_MAINT')
+        self.bulk_requests(2400)
+        for file_format in ('csv', 'xlsx'):
+            self.peak_memory({'file_format': file_format})  # warm up imports and caches
+            small_peak, small_size = self.peak_memory({'file_format': file_format, 'status': 'WAITING_MAINT'})
+            large_peak, large_size = self.peak_memory({'file_format': file_format})
+            self.assertGreater(large_size, small_size * 4)
+            # Keeping 2400 more requests and their history around would cost megabytes; what
+            # is left is the compressor's fixed working memory filling up on the longer stream
+            self.assertLess(large_peak - small_peak, 256 * 1024, file_format)
+
+
+class ImportCommandTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def write(self, name, content):
+        path = f'{self.tmp}/{name}'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_data', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def users_csv(self, count, start=0):
+        lines = ['username;email;first_name;last_name;role;hmc']
+        lines += [f'tec{i};tec{i}@example.com;Técnico;{i};EXECUTOR;T{i}' for i in range(start, start + count)]
+        return self.write(f'users{count}.csv', '\n'.join(lines) + '\n')
+
+    def test_users_upsert_on_hmc_and_report_rejects(self):
+        path = self.write('users.csv', (
+            'username;email;first_name;last_name;role;hmc\n'
+            'tecnico;novo@example.com;Pedro;Silva;ENGINEER_MECH;5001\n'
+            'ana;ana@example.com;Ana;Souza;EXECUTOR;7001\n'
+            'solicitante;x@example.com;X;Y;EXECUTOR;7002\n'
+            'bia;bia@example.com;Bia;Lima;CHEFE;7003\n'
+        ))
+        rejects = f'{self.tmp}/rejects.csv'
+        out, err = self.run_import('users', path, '--rejects', rejects, '--default-password', 'troque123')
+
+        self.assertIn('1 criado(s), 1 atualizado(s), 2 rejeitado(s)', out)
+        self.executor.refresh_from_db()
+        self.assertEqual((self.executor.email, self.executor.profile.role), ('novo@example.com', 'ENGINEER_MECH'))
+        self.assertTrue(User.objects.get(username='ana').check_password('troque123'))
+        self.assertEqual(UserProfile.objects.get(hmc='7001').user.username, 'ana')
+        self.assertIn('linha 4: username: solicitante já pertence a outro HMC', err)
+        self.assertIn('linha 5: role:', err)
+        with open(rejects, encoding='utf-8') as f:
+            self.assertEqual(len(list(csv.reader(f))), 3)
+
+    def test_rows_are_written_in_bulk(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.run_import('users', self.users_csv(500), '--batch-size', '1000')
+        # Two lookups and two INSERTs, which SQLite splits by its bound-parameter limit
+        self.assertLess(len(queries), 15)
+        self.run_import('users', self.users_csv(51), '--batch-size', '20')
+        self.assertEqual(UserProfile.objects.filter(role='EXECUTOR').count(), 501)
+
+    def test_requests_and_history_keep_ids_and_timestamps(self):
+        requests = self.write('requests.json', json.dumps([
+            {'id': 900, 'title': 'Vazamento antigo', 'problem_description': 'Óleo', 'process': 'Estamparia',
+             'equipment': 'Prensa 01', 'gut_gravity': 5, 'gut_urgency': 4, 'gut_tendency': 3, 'status': 'DONE',
+             'requester_hmc': '1001', 'assigned_to_hmc': '5001', 'created_at': '2023-03-01T08:00:00',
+             'finished_at': '2023-03-05'},
+            {'id': 901, 'title': 'Sem dono', 'problem_description': 'x', 'process': 'y', 'equipment': 'z',
+             'gut_gravity': 1, 'gut_urgency': 1, 'gut_tendency': 1, 'requester_hmc': '9999'},
+        ]))
+        history = self.write('history.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'request_id': 900, 'action': 'CREATED', 'actor_hmc': '1001', 'timestamp': '2023-03-01T08:00:00'},
+            {'request_id': 900, 'action': 'FINISHED', 'actor_hmc': '5001', 'timestamp': '2023-03-05T17:00:00'},
+            {'request_id': 901, 'action': 'CREATED', 'actor_hmc': '1001'},
+        ]))
+
+        _, err = self.run_import('requests', requests)
+        self.assertIn('requester_hmc: HMC 9999 não encontrado', err)
+        _, err = self.run_import('history', history)
+        self.assertIn('linha 3: request_id: demanda 901 não encontrada', err)
+
+        obj = MaintenanceRequest.objects.get(pk=900)
+        self.assertEqual(obj.created_at.year, 2023)
+        self.assertEqual(obj.assigned_to, self.executor)
+        self.assertEqual(list(obj.history.order_by('timestamp').values_list('action', flat=True)), ['CREATED', 'FINISHED'])
+        self.assertEqual(obj.history.get(action='FINISHED').timestamp.day, 5)
+        self.assertEqual(self.client.get('/api/requests/stats/').data['status']['DONE'], 1)
+
+
+class UserDirectoryTests(ApiTestCase):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        for i, role in enumerate(['ENGINEER_MECH', 'ENGINEER_ELEC', 'MANAGER_MAINT']):
+            user = User.objects.create_user(f'user{i}')
+            UserProfile.objects.create(user=user, role=role, hmc=f'80{i}')
+
+    def test_several_roles_in_one_cached_call(self):
+        url = '/api/users/?role__in=EXECUTOR,ENGINEER_MECH,ENGINEER_ELEC'
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual([row['username'] for row in response.data], ['tecnico', 'user0', 'user1'])
+        self.assertEqual(response.data[1]['role_display'], 'Engenheiro Mecânico')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).data, response.data)
+
+        # The single-role filter keeps working
+        self.assertEqual([row['username'] for row in self.client.get('/api/users/?role=EXECUTOR').data], ['tecnico'])
+
+    def test_saving_a_user_or_profile_invalidates(self):
+        url = '/api/users/?role__in=EXECUTOR'
+        self.client.get(url)
+        self.executor.first_name = 'Pedro'
+        self.executor.save()
+        self.assertEqual(self.client.get(url).data[0]['first_name'], 'Pedro')
+
+        profile = UserProfile.objects.get(hmc='802')
+        profile.role = 'EXECUTOR'
+        profile.save()
+        self.assertEqual(len(self.client.get(url).data), 2)
+
+    def test_login_does_not_invalidate(self):
+        url = '/api/users/?role__in=EXECUTOR'
+        self.client.get(url)
+        self.assertTrue(Client().login(username='tecnico', password='123'))  # saves last_login
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+
+class ChangeFeedTests(ApiTestCase):
+    async def open_stream(self, **params):
+        response = await sync_to_async(self.client.post)('/api/events/ticket/')
+        params['ticket'] = response.data['ticket']
+        response = await self.async_client.get('/api/events/', params)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        return stream
+
+    def commit(self, func, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            func(*args)
+
+    async def disconnect(self, stream):
+        # What the ASGI handler does when the client goes away: cancel the pending read
+        read = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        read.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await read
+
+    async def next_event(self, stream):
+        chunk = (await asyncio.wait_for(anext(stream), 1)).decode()
+        kind, data = chunk.strip().split('\n')
+        return kind.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    async def test_board_and_request_subscriptions(self):
+        first, second = await sync_to_async(self.make_requests)(2)
+        board = await self.open_stream()
+        page = await self.open_stream(request=second.id)
+        self.assertEqual(len(events.broker), 2)
+
+        await sync_to_async(self.commit)(workflow.apply_transition, first, 'approve_production', self.user)
+        await sync_to_async(self.commit)(workflow.apply_bulk_transition, [second.id], 'reject_production', self.user)
+
+        kind, event = await self.next_event(board)
+        self.assertEqual((kind, event['id'], event['status']), ('transition', first.id, 'WAITING_MAINT'))
+        self.assertEqual(set(event), {'event', 'id', 'status', 'status_display', 'assigned_to', 'updated_at'})
+        self.assertEqual((await self.next_event(board))[1]['id'], second.id)
+        # The request page only hears about its own request
+        kind, event = await self.next_event(page)
+        self.assertEqual((event['id'], event['status']), (second.id, 'REJECTED'))
+
+        await self.disconnect(board)
+        await self.disconnect(page)
+        self.assertEqual(len(events.broker), 0)
+
+    async def test_nothing_is_sent_for_rolled_back_changes(self):
+        obj = (await sync_to_async(self.make_requests)(1))[0]
+        board = await self.open_stream()
+
+        def conflicting():
+            stale = MaintenanceRequest.objects.get(pk=obj.pk)
+            MaintenanceRequest.objects.filter(pk=obj.pk).update(status='REJECTED')
+            with self.assertRaises(workflow.TransitionConflict):
+                workflow.apply_transition(stale, 'approve_production', self.user)
+
+        await sync_to_async(self.commit)(conflicting)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(anext(board), 0.2)
+        self.assertEqual(len(events.broker), 0)
+
+    async def test_idle_connections_do_not_hold_threads(self):
+        streams = [await self.open_stream()]
+        threads = threading.active_count()
+        streams += [await self.open_stream() for _ in range(200)]
+        self.assertEqual(len(events.broker), 201)
+        self.assertLessEqual(threading.active_count(), threads)
+        for stream in streams:
+            await self.disconnect(stream)
+
+    def test_stream_requires_a_valid_ticket_and_asgi(self):
+        self.assertEqual(APIClient().post('/api/events/ticket/').status_code, 401)
+        self.assertEqual(self.client.get('/api/events/', {'ticket': 'x'}).status_code, 501)
+
+
+class DeltaSyncTests(ApiTestCase):
+    def changes(self, since, **params):
+        return self.client.get('/api/requests/changes/', {'since': since, **params})
+
+    def test_reconnecting_client_gets_only_what_changed(self):
+        self.make_requests(20, history=1)
+        cursor = self.client.get('/api/requests/changes/').data['cursor']
+        self.assertEqual(self.changes(cursor).data, {'cursor': cursor, 'has_more': False, 'changes': []})
+
+        obj = MaintenanceRequest.objects.first()
+        workflow.apply_transition(obj, 'approve_production', self.user)
+        response = self.changes(cursor)
+        changed = [(item['model'], item['deleted']) for item in response.data['changes']]
+        self.assertEqual(changed, [('request', False), ('history', False)])
+        self.assertEqual(response.data['changes'][0]['data']['status'], 'WAITING_MAINT')
+        self.assertEqual(response.data['changes'][1]['request'], obj.id)
+
+        cursor = response.data['cursor']
+        history_ids = list(obj.history.values_list('id', flat=True))
+        self.client.delete(f'/api/requests/{obj.id}/')
+        tombstones = {(item['model'], item['id']) for item in self.changes(cursor).data['changes'] if item['deleted']}
+        self.assertEqual(tombstones, {('request', obj.id)} | {('history', pk) for pk in history_ids})
+
+    def test_pages_follow_the_sequence_and_collapse_repeated_changes(self):
+        cursor = self.client.get('/api/requests/changes/').data['cursor']
+        obj = make_request(self.user)
+        for title in ('a', 'b', 'c'):
+            obj.title = title
+            obj.save()
+        other = make_request(self.user)
+
+        response = self.changes(cursor)
+        self.assertEqual([item['id'] for item in response.data['changes']], [obj.id, other.id])
+        self.assertEqual(response.data['changes'][0]['data']['title'], 'c')
+
+        first = self.changes(cursor, limit=2)
+        self.assertTrue(first.data['has_more'])
+        rest = self.changes(first.data['cursor'])
+        self.assertFalse(rest.data['has_more'])
+        self.assertEqual(rest.data['cursor'], response.data['cursor'])
+
+    def test_bulk_writes_are_logged(self):
+        cursor = self.client.get('/api/requests/changes/').data['cursor']
+        objs = self.make_requests(3)
+        cursor = self.changes(cursor).data['cursor']
+        workflow.apply_bulk_transition([obj.id for obj in objs], 'approve_production', self.user)
+        models = [item['model'] for item in self.changes(cursor).data['changes']]
+        self.assertEqual(models, ['request'] * 3 + ['history'] * 3)
+
+    def test_nested_muted_stays_muted(self):
+        cursor = request_changes.current_cursor()
+        with request_changes.muted():
+            with request_changes.muted():
+                make_request(self.user)
+            make_request(self.user)
+        self.assertEqual(request_changes.current_cursor(), cursor)
+        make_request(self.user)
+        self.assertEqual(request_changes.current_cursor(), cursor + 1)
+
+    def test_pruned_cursor_is_gone(self):
+        make_request(self.user)
+        RequestChange.objects.update(changed_at=timezone.now() - timedelta(days=60))
+        cursor = self.client.get('/api/requests/changes/').data['cursor']
+        call_command('prune_changes', stdout=StringIO())
+        self.assertEqual(self.changes(0).status_code, 410)
+        self.assertEqual(self.changes(cursor).status_code, 200)
+        self.assertEqual(self.changes('abc').status_code, 400)
+
+
+class PriorityQueueTests(ApiTestCase):
+    def test_priority_is_stored_on_every_write(self):
+        data = {
+            'title': 'Nova', 'problem_description': 'Falha', 'process': 'Solda', 'equipment': 'Robô 3',
+            'gut_gravity': 5, 'gut_urgency': 4, 'gut_tendency': 2,
+        }
+        response = self.client.post('/api/requests/', data)
+        self.assertEqual(response.data['priority'], 40)
+        response = self.client.patch(f"/api/requests/{response.data['id']}/", {'gut_urgency': 1})
+        self.assertEqual(response.data['priority'], 10)
+
+        obj = make_request(self.user)
+        MaintenanceRequest.objects.filter(pk=obj.pk).update(gut_gravity=1)
+        self.assertEqual(MaintenanceRequest.objects.get(pk=obj.pk).priority, 9)
+        self.assertEqual(MaintenanceRequest.objects.filter(priority__gte=10).count(), 1)
+
+    def test_queue_per_status_by_priority_then_age(self):
+        low = make_request(self.user, title='Baixa', gut_gravity=1)
+        old = make_request(self.user, title='Antiga')
+        new = make_request(self.user, title='Recente')
+        top = make_request(self.user, title='Crítica', gut_gravity=5, gut_urgency=5, gut_tendency=5)
+        make_request(self.user, title='Concluída', status='DONE', gut_gravity=5)
+        waiting = make_request(self.user, status='WAITING_MAINT')
+
+        response = self.client.get('/api/requests/queue/')
+        groups = {group['status']: group['results'] for group in response.data['groups']}
+        self.assertNotIn('DONE', groups)
+        self.assertNotIn('REJECTED', groups)
+        self.assertEqual([row['id'] for row in groups['OPEN']], [top.id, old.id, new.id, low.id])
+        self.assertEqual([row['id'] for row in groups['WAITING_MAINT']], [waiting.id])
+
+        response = self.client.get('/api/requests/queue/', {'status': 'OPEN', 'page_size': 2})
+        self.assertEqual([row['id'] for row in response.data['groups'][0]['results']], [top.id, old.id])
+        self.assertEqual(self.client.get('/api/requests/queue/', {'status': 'DONE'}).status_code, 400)
+
+    def test_queue_per_assignee_merges_open_statuses(self):
+        executing = make_request(self.user, status='IN_EXECUTION', assigned_to=self.executor)
+        managed = make_request(self.user, status='WAITING_MANAGER', assigned_to=self.executor, gut_gravity=5)
+        make_request(self.user, status='DONE', assigned_to=self.executor, gut_gravity=5)
+        make_request(self.user, status='IN_EXECUTION')
+
+        self.client.force_authenticate(self.executor)
+        response = self.client.get('/api/requests/queue/', {'assigned_to': 'me'})
+        group = response.data['groups'][0]
+        self.assertEqual(group['assigned_to'], self.executor.id)
+        self.assertEqual([row['id'] for row in group['results']], [managed.id, executing.id])
+        self.assertEqual(self.client.get('/api/requests/queue/', {'assigned_to': 'x'}).status_code, 400)
+
+
+class StageAnalyticsTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now() - timedelta(days=20)
+
+    def walk(self, steps, **kwargs):
+        # steps: (history action, hours after the previous step)
+        obj = make_request(self.user, **kwargs)
+        MaintenanceRequest.objects.filter(pk=obj.pk).update(created_at=self.start)
+        moment = self.start
+        for action, hours in steps:
+            moment += timedelta(hours=hours)
+            entry = RequestHistory.objects.create(request=obj, action=action, actor=self.user)
+            RequestHistory.objects.filter(pk=entry.pk).update(timestamp=moment)
+        return obj
+
+    def stages(self, **params):
+        response = self.client.get('/api/requests/lead_times/', params)
+        self.assertEqual(response.status_code, 200)
+        return {(row['stage'], row['key']): row for row in response.data['results']}
+
+    def test_stage_durations_and_breaches(self):
+        self.walk([('APPROVED_PROD', 2), ('COMMENT', 1), ('APPROVED_MAINT_TECH', 29), ('FINISHED', 200)], equipment='Prensa 01')
+        self.walk([('APPROVED_PROD', 30), ('APPROVED_MAINT_ENG', 10), ('APPROVED_MANAGER', 5)], equipment='Robô 3')
+        self.assertEqual(analytics.refresh(), 6)
+
+        stages = self.stages()
+        self.assertEqual(stages[('OPEN', '')]['count'], 2)
+        self.assertEqual(stages[('OPEN', '')]['breaches'], 1)
+        self.assertEqual(stages[('WAITING_MAINT', '')]['count'], 2)
+        self.assertEqual(stages[('IN_EXECUTION', '')]['breaches'], 1)
+        # Percentiles come from log buckets: within ~10% of the real value
+        self.assertAlmostEqual(stages[('IN_EXECUTION', '')]['p50_seconds'], 200 * 3600, delta=20 * 3600)
+        self.assertEqual(stages[('IN_EXECUTION', '')]['avg_seconds'], 200 * 3600)
+        self.assertNotIn(('WAITING_MANAGER', ''), {key for key, row in stages.items() if row['breaches']})
+
+        by_equipment = self.stages(dimension='equipment', stage='OPEN')
+        self.assertEqual(set(by_equipment), {('OPEN', 'Prensa 01'), ('OPEN', 'Robô 3')})
+        self.assertEqual(by_equipment[('OPEN', 'Robô 3')]['breaches'], 1)
+
+        sla = self.client.get('/api/requests/sla/').data['results']
+        self.assertEqual(sla[0]['breaches'], 1)
+        self.assertEqual(sla[-1]['breaches'], 0)
+
+    def test_refresh_only_reads_new_history_and_matches_rebuild(self):
+        obj = self.walk([('APPROVED_PROD', 5)], status='WAITING_MAINT', assigned_to=self.executor)
+        analytics.refresh()
+        self.assertEqual(analytics.refresh(), 0)
+
+        workflow.apply_transition(obj, 'approve_maintenance_technical', self.user)
+        self.walk([('APPROVED_PROD', 1)])
+        self.assertEqual(analytics.refresh(), 2)
+        incremental = self.stages(dimension='assigned_to')
+        self.assertEqual(incremental[('WAITING_MAINT', str(self.executor.id))]['label'], 'tecnico')
+
+        self.assertEqual(analytics.rebuild(), 3)
+        self.assertEqual(self.stages(dimension='assigned_to'), incremental)
+
+        # Backends without window functions pair the rows in Python
+        with patch.object(connection.features, 'supports_over_clause', False):
+            analytics.rebuild()
+        self.assertEqual(self.stages(dimension='assigned_to'), incremental)
+
+    def test_pruned_change_log_triggers_a_rebuild(self):
+        self.walk([('APPROVED_PROD', 5)])
+        analytics.refresh()
+        self.walk([('APPROVED_PROD', 5)])
+        RequestChange.objects.all().delete()
+        analytics.refresh()
+        self.assertEqual(self.stages()[('OPEN', '')]['count'], 2)
+
+    def test_rebuild_keeps_the_durations_of_archived_requests(self):
+        closed = self.walk([('APPROVED_PROD', 2), ('APPROVED_MAINT_TECH', 3), ('FINISHED', 10)],
+                           status='DONE', assigned_to=self.executor)
+        self.walk([('APPROVED_PROD', 4)])
+        self.walk([('APPROVED_PROD', 6)])
+        self.assertEqual(analytics.refresh(), 5)
+        before = self.stages(dimension='assigned_to')
+        MaintenanceRequest.objects.filter(pk=closed.pk).update(updated_at=timezone.now() - timedelta(days=400))
+        self.assertEqual(archive.archive_closed(), 1)
+
+        with patch.object(analytics, 'BATCH_SIZE', 1):
+            self.assertEqual(analytics.rebuild(), 5)
+        self.assertEqual(self.stages(dimension='assigned_to'), before)
+        self.assertEqual(analytics.rebuild(), 5)
+        self.assertEqual(self.stages(dimension='assigned_to'), before)
+
+    def test_rebuild_reads_without_holding_a_transaction(self):
+        self.walk([('APPROVED_PROD', 5)])
+        self.walk([('APPROVED_PROD', 7)])
+        analytics.refresh()
+        depth = len(connection.atomic_blocks)
+        reads = []
+        stage_rows = analytics.stage_rows
+
+        def tracked(ids):
+            # Nothing written yet: the old rollups are still there
+            reads.append((len(connection.atomic_blocks) - depth, StageRollup.objects.exists()))
+            return stage_rows(ids)
+
+        with patch.object(analytics, 'BATCH_SIZE', 1), patch.object(analytics, 'stage_rows', side_effect=tracked):
+            self.assertEqual(analytics.rebuild(), 2)
+        # Each batch in a short transaction of its own
+        self.assertEqual(reads, [(1, True), (1, True)])
+        self.assertEqual(self.stages()[('OPEN', '')]['count'], 2)
+
+    def test_reads_come_from_the_rollups(self):
+        for i in range(5):
+            self.walk([('APPROVED_PROD', i + 1)], equipment=f'Prensa {i}')
+        analytics.refresh()
+        with self.assertNumQueries(1):
+            self.client.get('/api/requests/lead_times/', {'dimension': 'equipment'})
+        since = (timezone.localdate() - timedelta(days=1)).isoformat()
+        self.assertEqual(self.stages(since=since), {})
+        self.assertEqual(self.client.get('/api/requests/lead_times/', {'dimension': 'cor'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/requests/sla/', {'since': '2024-13-01'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/requests/sla/', {'stage': 'DONE'}).status_code, 400)
+
+
+class ArchiveTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.old = timezone.now() - timedelta(days=400)
+
+    def closed(self, status='DONE', **kwargs):
+        obj = make_request(self.user, status=status, assigned_to=self.executor, **kwargs)
+        RequestHistory.objects.create(request=obj, action='FINISHED', actor=self.executor, comment='feito')
+        MaintenanceRequest.objects.filter(pk=obj.pk).update(updated_at=self.old)
+        return obj
+
+    def test_moves_old_closed_requests_in_batches(self):
+        done = [self.closed() for _ in range(5)]
+        rejected = self.closed('REJECTED')
+        recent = make_request(self.user, status='DONE')
+        active = make_request(self.user)
+        MaintenanceRequest.objects.filter(pk=active.pk).update(updated_at=self.old)
+        request_stats.rebuild_counters()
+        cursor = request_changes.current_cursor()
+
+        call_command('archive_requests', '--batch-size', '2', stdout=StringIO())
+
+        archived = set(ArchivedRequest.objects.values_list('pk', flat=True))
+        self.assertEqual(archived, {obj.pk for obj in done} | {rejected.pk})
+        self.assertEqual(set(MaintenanceRequest.objects.values_list('pk', flat=True)), {recent.pk, active.pk})
+        self.assertEqual(RequestHistory.objects.count(), 0)
+        self.assertEqual(request_stats.find_drift(), {})
+        # Delta-sync clients see the moved requests go
+        entries, _, _ = request_changes.read(cursor, 100)
+        self.assertEqual({entry.object_id for entry in entries if entry.model == 'request' and entry.deleted}, archived)
+
+    def test_api_reads_the_archive(self):
+        obj = self.closed(title='Prensa arquivada', photo='requests/prensa.jpg')
+        make_request(self.user, status='DONE', title='Recente')
+        make_request(self.user, title='Aberta')
+        archive.archive_closed()
+
+        detail = self.client.get(f'/api/requests/{obj.pk}/')
+        self.assertEqual(detail.status_code, 200)
+        self.assertTrue(detail.data['archived'])
+        self.assertEqual(detail.data['title'], 'Prensa arquivada')
+        self.assertEqual(detail.data['assigned_to_name'], 'tecnico')
+        self.assertEqual(detail.data['priority'], 27)
+        self.assertEqual([(row['action'], row['actor_name']) for row in detail.data['history']], [('FINISHED', 'tecnico')])
+        self.assertIn('sig=', detail.data['photo'])
+        self.assertEqual(self.client.get(f'/api/requests/{obj.pk}/', HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304)
+        self.assertEqual(self.client.post(f'/api/requests/{obj.pk}/finish_execution/').status_code, 404)
+
+        done = self.client.get('/api/requests/', {'status': 'DONE'})
+        self.assertEqual(done.data['count'], 2)
+        self.assertEqual([row['archived'] for row in done.data['results']], [False, True])
+        self.assertEqual(self.client.get('/api/requests/').data['count'], 2)
+        everything = self.client.get('/api/requests/', {'archived': '1', 'search': 'arquivada'})
+        self.assertEqual([row['id'] for row in everything.data['results']], [obj.pk])
+        # The archive matches the same columns and words as the live search
+        described = self.client.get('/api/requests/', {'archived': '1', 'search': 'cilindro óleo'})
+        self.assertEqual(described.data['count'], 3)
+        self.assertIn(obj.pk, [row['id'] for row in described.data['results']])
+
+        etag = done['ETag']
+        self.assertEqual(self.client.get('/api/requests/', {'status': 'DONE'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        archive.restore([obj.pk])
+        self.assertEqual(self.client.get('/api/requests/', {'status': 'DONE'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_restore_puts_everything_back(self):
+        obj = self.closed(pm04_order='4000123')
+        history = list(obj.history.values_list('pk', 'timestamp'))
+        request_stats.rebuild_counters()
+        archive.archive_closed()
+        self.executor.delete()
+
+        out = StringIO()
+        call_command('archive_requests', '--restore', str(obj.pk), '999', stdout=out, stderr=StringIO())
+        self.assertIn('1 demanda', out.getvalue())
+        restored = MaintenanceRequest.objects.get(pk=obj.pk)
+        self.assertEqual((restored.pm04_order, restored.status, restored.assigned_to_id), ('4000123', 'DONE', None))
+        self.assertEqual(restored.updated_at, self.old)
+        self.assertEqual(list(restored.history.values_list('pk', 'timestamp')), history)
+        self.assertFalse(ArchivedRequest.objects.exists())
+        self.assertEqual(request_stats.find_drift(), {})
+
+    def test_board_stays_on_the_live_table(self):
+        for _ in range(3):
+            self.closed()
+        archive.archive_closed()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/requests/board/')
+        self.assertFalse(any('archivedrequest' in query['sql'] for query in queries.captured_queries))
+
+
+class PerformanceMetricsTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        patcher = patch('core.metrics.SERVER_TIMING', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def timing(self, response):
+        return {
+            part.split(';')[0].strip(): part for part in response['Server-Timing'].split(',')
+        }
+
+    def test_server_timing_counts_the_queries(self):
+        self.make_requests(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/requests/')
+        timing = self.timing(response)
+        self.assertIn(f'desc="{len(queries)} queries"', timing['db'])
+        self.assertRegex(timing['total'], r'total;dur=\d+\.\d')
+
+    def test_metrics_are_keyed_by_route_and_action(self):
+        obj = make_request(self.user)
+        self.client.get('/api/requests/')
+        self.client.get('/api/requests/')
+        self.client.post(f'/api/requests/{obj.id}/approve_production/')
+
+        with patch('core.metrics.TOKEN', 's3cret'):
+            text = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret').content.decode()
+        self.assertIn('http_request_duration_seconds_count{route="maintenancerequest-list",method="GET"} 2', text)
+        self.assertIn('http_request_queries_count{route="maintenancerequest-approve-production",method="POST"} 1', text)
+        self.assertIn('http_responses_total{route="maintenancerequest-list",method="GET",status="200"} 2', text)
+        size = re.search(r'http_response_size_bytes_sum\{route="maintenancerequest-list",method="GET"\} (\d+)', text)
+        self.assertGreater(int(size.group(1)), 0)
+
+    def test_client_chosen_methods_and_paths_do_not_add_series(self):
+        for i in range(3):
+            self.client.generic(f'BREW{i}', '/api/requests/')
+            self.client.get(f'/sondagem-{i}/')
+        with patch('core.metrics.TOKEN', 's3cret'):
+            text = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret').content.decode()
+        self.assertIn('http_request_duration_seconds_count{route="maintenancerequest-list",method="other"} 3', text)
+        self.assertIn('http_request_duration_seconds_count{route="unmatched",method="GET"} 3', text)
+        self.assertNotIn('BREW', text)
+        self.assertNotIn('sondagem', text)
+
+    def test_metrics_and_server_timing_are_not_public(self):
+        # Behind a local proxy every client is 127.0.0.1: the address grants nothing
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        with patch('core.metrics.TOKEN', 's3cret'):
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        with patch('core.metrics.SERVER_TIMING', None):
+            # Follows DEBUG, off under tests
+            self.assertNotIn('Server-Timing', self.client.get('/api/requests/'))
+
+    async def test_async_views_are_measured(self):
+        # A valid ticket of a deactivated user: one query, then 403
+        self.executor.is_active = False
+        await self.executor.asave()
+        response = await self.async_client.get('/api/events/', {'ticket': events.issue_ticket(self.executor)})
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('desc="1 queries"', self.timing(response)['db'])
+
+    def test_query_log_points_at_the_calling_code(self):
+        measure = metrics.Measure(None)
+        token = metrics.current.set(measure)
+        try:
+            with patch('core.metrics.REPEATED_QUERY_LIMIT', 3), self.assertLogs('core.metrics.queries') as logs:
+                for pk in range(3):
+                    MaintenanceRequest.objects.filter(pk=pk).exists()
+            with patch('core.metrics.SLOW_QUERY_MS', 0), self.assertLogs('core.metrics.queries') as slow:
+                User.objects.count()
+        finally:
+            metrics.current.reset(token)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('repetida 3 vezes', logs.output[0])
+        self.assertIn('core/tests.py:', logs.output[0])
+        self.assertIn('Consulta lenta', slow.output[0])
+        self.assertEqual(measure.queries, 4)
+
+
+class SyntheticDataTests(TestCase):
+    def test_generated_requests_follow_the_workflow(self):
+        synthetic.create_users(30, seed=1)
+        self.assertEqual(
+            set(UserProfile.objects.values_list('role', flat=True)), {value for value, _ in UserProfile.ROLE_CHOICES},
+        )
+        self.assertEqual(synthetic.create_requests(300, days=90, seed=1, batch_size=100), 300)
+
+        history = {}
+        for entry in RequestHistory.objects.order_by('timestamp', 'id'):
+            history.setdefault(entry.request_id, []).append(entry)
+        sources = {t.history_action: t.sources for t in workflow.TRANSITIONS.values()}
+        for obj in MaintenanceRequest.objects.all():
+            status, previous = 'OPEN', obj.created_at
+            for entry in history.get(obj.id, []):
+                self.assertIn(status, sources[entry.action])
+                self.assertGreaterEqual(entry.timestamp, previous)
+                status, previous = analytics.STAGE_ENTERED[entry.action], entry.timestamp
+            self.assertEqual(obj.status, status)
+            self.assertEqual(obj.updated_at, previous)
+            self.assertGreaterEqual(obj.created_at, timezone.now() - timedelta(days=91))
+            if obj.status == 'DONE':
+                self.assertIsNotNone(obj.assigned_to_id)
+                self.assertEqual(obj.finished_at, previous)
+
+        self.assertGreater(MaintenanceRequest.objects.filter(status='DONE').count(), 100)
+        self.assertEqual(request_stats.find_drift(), {})
+        self.assertEqual(RequestChange.objects.count(), 300 + len(sum(history.values(), [])))
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        # The harness fires the request signals as a server does; as in django.test.Client,
+        # keep them from closing the connection that holds the test's transaction
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        synthetic.create_users(14, seed=2)
+        synthetic.create_requests(120, days=30, seed=2)
+
+    def test_run_measures_every_scenario(self):
+        names = ['list', 'detail', 'users_by_role', 'approve_production', 'reject_production', 'finish_execution']
+        last = RequestHistory.objects.order_by('-id').values_list('id', flat=True).first()
+        report = benchmark.run(names, iterations=3, warmup=1)
+        self.assertEqual(list(report['scenarios']), names)
+        for name, result in report['scenarios'].items():
+            self.assertEqual((result['calls'], result['errors']), (3, 0), name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertIsNotNone(result['queries'])
+        # Each transition got a request of its own
+        written = RequestHistory.objects.filter(id__gt=last)
+        self.assertEqual(written.values('request_id').distinct().count(), 9)
+
+    def test_regressions_fail_the_run(self):
+        report = {'scenarios': {
+            'list': {'calls': 10, 'errors': 0, 'p95_ms': 30.0, 'queries': 4},
+            'detail': {'calls': 10, 'errors': 0, 'p95_ms': 11.0, 'queries': 9},
+            'board': {'calls': 10, 'errors': 2, 'p95_ms': 5.0, 'queries': 3},
+        }}
+        baseline = {'scenarios': {
+            'list': {'p95_ms': 20.0, 'queries': 4},
+            'detail': {'p95_ms': 10.0, 'queries': 4},
+            'board': {'p95_ms': 5.0, 'queries': 3},
+        }}
+        regressions = benchmark.compare(report, baseline, tolerance=0.25)
+        self.assertEqual([message.split(':')[0] for message in regressions], ['list', 'detail', 'board'])
+        self.assertIn('consultas', regressions[1])
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = f'{directory}/baseline.json'
+        call_command('benchmark', scenarios='detail', iterations=2, warmup=0, concurrency=1, save=path, stdout=StringIO())
+        with open(path) as stream:
+            saved = json.load(stream)
+        saved['scenarios']['detail']['queries'] -= 2
+        with open(path, 'w') as stream:
+            json.dump(saved, stream)
+        with self.assertRaisesMessage(CommandError, 'detail'):
+            call_command('benchmark', scenarios='detail', iterations=2, warmup=0, concurrency=1, baseline=path,
+                         stdout=StringIO(), stderr=StringIO())
+
+
+class AsgiBenchmarkTests(TransactionTestCase):
+    # Under ASGI the views run in other threads: they must see committed data. Reads only:
+    # concurrent workflow requests can fail on SQLite with "database is locked".
+    def test_run_under_asgi(self):
+        synthetic.create_users(14, seed=3)
+        synthetic.create_requests(40, days=30, seed=3)
+        names = ['list', 'detail', 'board', 'users_by_role']
+        report = benchmark.run(names, iterations=4, warmup=1, concurrency=3, server='asgi')
+        self.assertEqual(report['meta']['server'], 'asgi')
+        for name, result in report['scenarios'].items():
+            self.assertEqual((result['calls'], result['errors']), (4, 0), name)
+            self.assertGreater(result['rps'], 0)
+            self.assertIsNotNone(result['queries'])
+
+
+class CachedTokenAuthenticationTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        authentication.tokens.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_steady_state_costs_no_queries(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual((response.data['username'], response.data['role']), ('solicitante', 'REQUESTER'))
+
+    def test_profile_change_and_deactivation_take_effect_at_once(self):
+        self.client.get('/api/users/me/')
+        self.user.profile.role = 'APPROVER_PROD'
+        self.user.profile.save()
+        self.assertEqual(self.client.get('/api/users/me/').data['role'], 'APPROVER_PROD')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_rotation_revokes(self):
+        self.client.get('/api/users/me/')
+        # As `drf_create_token -r` does it
+        self.token.delete()
+        rotated = Token.objects.create(user=self.user)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {rotated.key}')
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def test_shared_cache_serves_other_processes(self):
+        with patch('core.authentication.SHARED', True):
+            self.client.get('/api/users/me/')
+            # Another worker: empty LRU, same shared cache
+            authentication.tokens.clear()
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+            self.user.profile.save()
+            authentication.tokens.clear()
+            with self.assertNumQueries(1):
+                self.client.get('/api/users/me/')
+
+    def test_shared_write_racing_a_revocation_is_not_served(self):
+        with patch('core.authentication.SHARED', True):
+            # Another worker read the token before the user was deactivated...
+            version = authentication._shared_version()
+            entry = authentication._entry(Token.objects.select_related('user__profile').get(key=self.token.key))
+            self.user.is_active = False
+            self.user.save()
+            # ...and stores it afterwards
+            cache.set(authentication._shared_key(self.token.key), (version, entry), authentication.SHARED_SECONDS)
+            authentication.tokens.clear()
+            self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+        self.assertNotIn(self.user.password, entry[1])
+
+    def test_shared_read_racing_an_invalidation_is_not_kept_locally(self):
+        get_many = cache.get_many
+
+        def revoked_meanwhile(keys):
+            found = get_many(keys)
+            authentication.invalidate(self.token.key)
+            return found
+
+        with patch('core.authentication.SHARED', True):
+            self.client.get('/api/users/me/')
+            authentication.tokens.clear()
+            with patch.object(authentication.cache, 'get_many', side_effect=revoked_meanwhile):
+                self.client.get('/api/users/me/')
+        self.assertIsNone(authentication.tokens.get(self.token.key))
+
+    def test_lru_is_bounded_and_skips_raced_lookups(self):
+        cache = authentication.LRU(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+        generation = cache.generation
+        cache.delete('x')
+        cache.set('d', 4, generation)
+        self.assertIsNone(cache.get('d'))
+
+
+@override_settings(ROOT_URLCONF='maintenance_system.urls_asgi')
+class AsyncReadTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        authentication.tokens.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.obj = self.make_requests(3, history=2)[0]
+
+    async def get(self, path, **headers):
+        return await self.async_client.get(path, headers={**self.headers, **headers})
+
+    async def test_reads_match_the_sync_views(self):
+        paths = [
+            '/api/requests/', '/api/requests/?page=2&page_size=2', '/api/requests/?search=Demanda',
+            f'/api/requests/{self.obj.id}/', '/api/requests/board/?page_size=2',
+            '/api/users/', '/api/users/?role=EXECUTOR', f'/api/users/{self.executor.id}/', '/api/users/me/',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                expected = await sync_to_async(self.client.get)(path)
+                response = await self.get(path)
+                self.assertEqual(response.status_code, 200)
+                # Served by the async view: DRF's sync dispatch would add Allow
+                self.assertNotIn('Allow', response)
+                self.assertEqual(response.json(), expected.json())
+                self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+    async def test_conditional_get(self):
+        response = await self.get(f'/api/requests/{self.obj.id}/')
+        again = await self.get(f'/api/requests/{self.obj.id}/', if_none_match=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        listed = await self.get('/api/requests/')
+        self.assertEqual((await self.get('/api/requests/', if_none_match=listed['ETag'])).status_code, 304)
+
+    async def test_everything_else_falls_back_to_the_sync_views(self):
+        # Writes, unknown tokens, cursor pages, missing rows and the browsable API
+        response = await self.async_client.post(
+            f'/api/requests/{self.obj.id}/approve_production/', headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'WAITING_MAINT')
+        self.assertEqual((await self.async_client.get('/api/requests/', headers={'Authorization': 'Token nope'})).status_code, 401)
+        self.assertIn('Allow', await self.get('/api/requests/?pagination=cursor'))
+        self.assertEqual((await self.get('/api/requests/999999/')).status_code, 404)
+        self.assertEqual((await self.get('/api/requests/?page=99')).status_code, 404)
+        self.assertIn('text/html', (await self.get('/api/requests/', accept='text/html'))['Content-Type'])
+
+
+class RequestHistoryTests(ApiTestCase):
+    def test_detail_embeds_only_the_latest_entries(self):
+        few, many = self.make_requests(1, history=2) + self.make_requests(1, history=25)
+        response = self.client.get(f'/api/requests/{few.id}/')
+        self.assertEqual([entry['comment'] for entry in response.data['history']], ['0', '1'])
+        self.assertFalse(response.data['history_truncated'])
+        response = self.client.get(f'/api/requests/{many.id}/')
+        self.assertEqual([entry['comment'] for entry in response.data['history']], [str(i) for i in range(5, 25)])
+        self.assertTrue(response.data['history_truncated'])
+
+    def test_history_is_paged_newest_first(self):
+        obj = self.make_requests(1, history=7)[0]
+        url, comments = f'/api/requests/{obj.id}/history/?page_size=3', []
+        while url:
+            with self.assertNumQueries(2):  # request exists, page + actors
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            comments += [entry['comment'] for entry in response.data['results']]
+            self.assertEqual(response.data['results'][0]['actor_name'], 'tecnico')
+            url = response.data['next']
+        self.assertEqual(comments, [str(i) for i in reversed(range(7))])
+        self.assertEqual(self.client.get('/api/requests/999/history/').status_code, 404)
+
+    def test_archived_request_history(self):
+        obj = make_request(self.user, status='DONE', assigned_to=self.executor)
+        RequestHistory.objects.create(request=obj, action='FINISHED', actor=self.executor, comment='feito')
+        MaintenanceRequest.objects.filter(pk=obj.pk).update(updated_at=timezone.now() - timedelta(days=400))
+        archive.archive_closed()
+        response = self.client.get(f'/api/requests/{obj.id}/history/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual([(entry['comment'], entry['actor_name']) for entry in response.data['results']], [('feito', 'tecnico')])
+        self.assertFalse(self.client.get(f'/api/requests/{obj.id}/').data['history_truncated'])
+
+    def test_batch_writes_history_in_one_insert(self):
+        first, second, third = self.make_requests(3)
+        cursor = request_changes.current_cursor()
+        with CaptureQueriesContext(connection) as queries:
+            with request_history.batch():
+                workflow.apply_transition(first, 'approve_production', self.user)
+                workflow.apply_transition(second, 'approve_production', self.user)
+                self.assertFalse(RequestHistory.objects.exists())
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "core_requesthistory"')]
+        self.assertEqual(len(inserts), 1)
+        written = list(RequestHistory.objects.order_by('id').values_list('request_id', 'action'))
+        self.assertEqual(written, [(first.pk, 'APPROVED_PROD'), (second.pk, 'APPROVED_PROD')])
+        entries, _, _ = request_changes.read(cursor, 100)
+        self.assertEqual(len([entry for entry in entries if entry.model == 'history']), 2)
+
+        # A failure inside the batch rolls back the transitions with their history
+        with self.assertRaises(RuntimeError):
+            with request_history.batch():
+                workflow.apply_transition(third, 'approve_production', self.user)
+                raise RuntimeError
+        third.refresh_from_db()
+        self.assertEqual(third.status, 'OPEN')
+        self.assertFalse(RequestHistory.objects.filter(request=third).exists())
@@ -1,14 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
-from .views import MaintenanceRequestViewSet, EmailConfigurationViewSet, UserViewSet
+from .async_views import with_async_reads
+from .views import MaintenanceRequestViewSet, EmailConfigurationViewSet, UserViewSet, events_stream, events_ticket
 
 router = DefaultRouter()
 router.register(r'requests', MaintenanceRequestViewSet)
 router.register(r'email-config', EmailConfigurationViewSet)
 router.register(r'users', UserViewSet)
 
-urlpatterns = [
-    path('', include(router.urls)),
+routes = [
     path('api-token-auth/', obtain_auth_token),
+    path('events/', events_stream),
+    path('events/ticket/', events_ticket),
 ]
+
+urlpatterns = [path('', include(router.urls)), *routes]
+
+# The same API for the ASGI app (maintenance_system.asgi): GETs of the read-heavy routes
+# are served by async views (core.async_views)
+asgi_urlpatterns = [path('', include(with_async_reads(router.urls))), *routes]
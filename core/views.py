@@ -1,196 +1,599 @@
+import heapq
+from itertools import islice
+
 from rest_framework import viewsets, status, permissions
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib.auth.models import User
-from .models import MaintenanceRequest, EmailConfiguration, RequestHistory
-from .serializers import MaintenanceRequestSerializer, EmailConfigurationSerializer, UserSerializer, RequestHistorySerializer
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.db.models import BooleanField, Prefetch, Count, F, Max, OuterRef, Subquery, Value, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, urlencode
+from .models import ArchivedRequest, MaintenanceRequest, EmailConfiguration, RequestHistory
+from . import analytics, archive, directory, events, images, media, notifications, workflow, changes as request_changes, export as request_export, stats as request_stats
+from .search import search_requests
+from .pagination import HistoryCursorPagination, RequestPageNumberPagination, RequestCursorPagination
+from .serializers import HISTORY_EMBED_LIMIT, ArchivedRequestSerializer, MaintenanceRequestSerializer, MaintenanceRequestListSerializer, EmailConfigurationSerializer, UserSerializer, RequestHistorySerializer
 
 class MaintenanceRequestViewSet(viewsets.ModelViewSet):
     queryset = MaintenanceRequest.objects.all().order_by('-created_at')
     serializer_class = MaintenanceRequestSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = RequestPageNumberPagination
+    BULK_TRANSITION_MAX = 500
+    CHANGES_LIMIT = 500
+
+    @property
+    def paginator(self):
+        # ?pagination=cursor (or following a cursor link) switches to keyset pagination;
+        # page-number clients keep the usual {count, next, previous, results} payload
+        if not hasattr(self, '_paginator'):
+            if RequestCursorPagination.is_requested(self.request):
+                self._paginator = RequestCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return MaintenanceRequestListSerializer
+        return MaintenanceRequestSerializer
 
     def get_queryset(self):
-        queryset = MaintenanceRequest.objects.all().order_by('-created_at')
-        
+        queryset = MaintenanceRequest.objects.select_related('requester', 'assigned_to').order_by('-created_at')
+
+        # Only the detail view embeds history, just its latest entries (one windowed query for
+        # the prefetch); join the actor so names don't cost a query each
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(Prefetch(
+                'history',
+                queryset=RequestHistory.objects.select_related('actor').order_by('-timestamp', '-id')[:HISTORY_EMBED_LIMIT + 1],
+                to_attr='latest_history',
+            ))
+
+        ranked = self.action == 'list' and not RequestCursorPagination.is_requested(self.request)
+        return self.filter_requests(queryset, ranked=ranked)
+
+    def filter_requests(self, queryset, ranked=False):
         # Status Filter
         status_param = self.request.query_params.get('status', None)
         if status_param:
             queryset = queryset.filter(status=status_param)
             
-        # Search Filter (Title or ID)
+        # Search Filter (ID, or full-text over title, problem, equipment and process)
         search_term = self.request.query_params.get('search', None)
         if search_term:
             if search_term.isdigit():
                 queryset = queryset.filter(id=search_term)
             else:
-                queryset = queryset.filter(title__icontains=search_term)
+                queryset = search_requests(queryset, search_term, ranked=ranked)
                 
         return queryset
 
+    # Conditional GET: validators come from one aggregate query and a match answers 304
+    # before anything is serialized. Signed media URLs in the payload rotate with
+    # media.url_window(), so it is part of every ETag.
+
+    def list(self, request, *args, **kwargs):
+        validators = self.filter_requests(MaintenanceRequest.objects.order_by()).aggregate(**self.LIST_VALIDATORS)
+        render = super().list
+        archived = None
+        if self.includes_archive():
+            archived = self.filter_archived(ArchivedRequest.objects.order_by()).aggregate(**self.ARCHIVE_VALIDATORS)
+            render = self.list_with_archive
+        return self._conditional(request, self.list_etag(validators, archived), None, render, *args, **kwargs)
+
+    # No Last-Modified on lists: deleting a request lowers the count without moving
+    # MAX(updated_at), which an If-Modified-Since check alone would miss
+    LIST_VALIDATORS = {'count': Count('id'), 'last_updated': Max('updated_at')}
+    ARCHIVE_VALIDATORS = {'count': Count('id'), 'last_archived': Max('archived_at')}
+
+    def list_etag(self, validators, archived=None):
+        last_updated = validators['last_updated'].timestamp() if validators['last_updated'] else 0
+        etag = f'list-{validators["count"]}-{last_updated}'
+        if archived is not None:
+            last_archived = archived['last_archived'].timestamp() if archived['last_archived'] else 0
+            etag = f'{etag}-archive-{archived["count"]}-{last_archived}'
+        return f'W/"{etag}-{media.url_window()}"'
+
+    def includes_archive(self):
+        # Closed requests may have been archived (core.archive): asking for a closed status,
+        # or ?archived=1, lists both tables. Keyset pages cover the live table only.
+        params = self.request.query_params
+        if RequestCursorPagination.is_requested(self.request):
+            return False
+        return params.get('archived') in ('1', 'true') or params.get('status') in MaintenanceRequest.CLOSED_STATUSES
+
+    def filter_archived(self, queryset):
+        params = self.request.query_params
+        return archive.filter_archived(queryset, params.get('status'), params.get('search'))
+
+    def list_with_archive(self, request, *args, **kwargs):
+        # Pages over (created_at, id) of both tables, then loads just the rows of the page
+        live = self.filter_requests(MaintenanceRequest.objects.order_by()).annotate(
+            archived=Value(False, output_field=BooleanField()),
+        ).values_list('created_at', 'id', 'archived')
+        archived = self.filter_archived(ArchivedRequest.objects.order_by()).annotate(
+            archived=Value(True, output_field=BooleanField()),
+        ).values_list('created_at', 'id', 'archived')
+        page = self.paginate_queryset(live.union(archived, all=True).order_by('-created_at', 'id'))
+
+        found = {
+            False: MaintenanceRequest.objects.select_related('requester', 'assigned_to').in_bulk(
+                [pk for _, pk, is_archived in page if not is_archived]
+            ),
+            True: archive.load([pk for _, pk, is_archived in page if is_archived]),
+        }
+        # A row moved between the two queries is skipped rather than shown twice
+        objs = [found[bool(is_archived)].get(pk) for _, pk, is_archived in page]
+        serializer = MaintenanceRequestListSerializer(
+            [obj for obj in objs if obj is not None], many=True, context=self.get_serializer_context(),
+        )
+        return self.get_paginated_response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        # History rows are part of the payload: the newest history id covers appends that did
+        # not touch updated_at (e.g. imported history)
+        if not str(kwargs['pk']).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        row = self.detail_validators(kwargs['pk']).first()
+        if row is None:
+            return self.retrieve_archived(request, *args, **kwargs)
+        etag, last_modified = self.detail_etag(kwargs['pk'], *row)
+        return self._conditional(request, etag, last_modified, super().retrieve, *args, **kwargs)
+
+    def detail_validators(self, pk):
+        latest_history = RequestHistory.objects.filter(request=OuterRef('pk')).order_by('-id').values('id')[:1]
+        return MaintenanceRequest.objects.filter(pk=pk).values_list('updated_at', Subquery(latest_history))
+
+    def detail_etag(self, pk, updated_at, history_id):
+        etag = f'W/"request-{pk}-{updated_at.timestamp()}-{history_id}-{media.url_window()}"'
+        return etag, int(updated_at.timestamp())
+
+    def retrieve_archived(self, request, *args, **kwargs):
+        # Archived requests are read-only: only a restore (manage.py archive_requests --restore) changes them
+        archived_at = ArchivedRequest.objects.filter(pk=kwargs['pk']).values_list('archived_at', flat=True).first()
+        if archived_at is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        def render(request, *args, **kwargs):
+            obj = archive.load([int(kwargs['pk'])], with_history=True)[int(kwargs['pk'])]
+            return Response(ArchivedRequestSerializer(obj, context=self.get_serializer_context()).data)
+
+        etag = f'W/"archived-{kwargs["pk"]}-{archived_at.timestamp()}-{media.url_window()}"'
+        return self._conditional(request, etag, int(archived_at.timestamp()), render, *args, **kwargs)
+
+    def _conditional(self, request, etag, last_modified, render, *args, **kwargs):
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = render(request, *args, **kwargs)
+        return self.add_validators(response, etag, last_modified)
+
+    def add_validators(self, response, etag, last_modified):
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            # Cache, but always revalidate: a 304 is the cheap path
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def board(self, request):
+        # Every status column with its exact count and first cards, in two queries:
+        # one GROUP BY for the counts, one windowed query for the top of each column.
+        paginator = RequestCursorPagination()
+        limit = paginator.get_page_size(request)
+        counts, ranked = self.board_queries(limit)
+        return Response(self.board_payload(paginator, limit, dict(counts), list(ranked)))
+
+    def board_queries(self, limit):
+        queryset = self.get_queryset()
+        counts = queryset.order_by().values_list('status').annotate(total=Count('id'))
+        ranked = queryset.annotate(
+            column_rank=Window(
+                RowNumber(),
+                partition_by=F('status'),
+                order_by=[F('created_at').desc(), F('id').asc()],
+            )
+        ).filter(column_rank__lte=limit + 1).order_by('status', 'column_rank')
+        return counts, ranked
+
+    def board_payload(self, paginator, limit, counts, ranked):
+        cards = {}
+        for obj in ranked:
+            cards.setdefault(obj.status, []).append(obj)
+
+        request = self.request
+        search = request.query_params.get('search')
+        columns = []
+        for value, label in MaintenanceRequest.STATUS_CHOICES:
+            rows = cards.get(value, [])
+            page, following = rows[:limit], (rows[limit] if len(rows) > limit else None)
+            params = {'status': value, 'pagination': 'cursor', 'page_size': limit}
+            if search:
+                params['search'] = search
+            base_url = request.build_absolute_uri(f"{reverse('maintenancerequest-list')}?{urlencode(params)}")
+            columns.append({
+                'status': value,
+                'status_display': label,
+                'count': counts.get(value, 0),
+                'next': paginator.get_next_link_for(base_url, page, following),
+                'results': MaintenanceRequestListSerializer(page, many=True, context=self.get_serializer_context()).data,
+            })
+
+        return {'count': sum(counts.values()), 'columns': columns}
+
+    @action(detail=False, methods=['get'])
+    def queue(self, request):
+        # Top open requests by GUT priority, then age (oldest first), per status column or,
+        # with ?assigned_to=<id|me>, for one assignee. Every group is a LIMIT over the
+        # (status, -priority, created_at) or (assigned_to, status, -priority, created_at)
+        # index, so no row outside the page is read.
+        limit = RequestCursorPagination().get_page_size(request)
+        open_statuses = [
+            (value, label) for value, label in MaintenanceRequest.STATUS_CHOICES
+            if value not in MaintenanceRequest.CLOSED_STATUSES
+        ]
+        status_param = request.query_params.get('status')
+        if status_param:
+            open_statuses = [(value, label) for value, label in open_statuses if value == status_param]
+            if not open_statuses:
+                return Response({'error': 'Status inválido para a fila'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = MaintenanceRequest.objects.select_related('requester', 'assigned_to').order_by(
+            '-priority', 'created_at', 'id',
+        )
+        context = self.get_serializer_context()
+        assignee = request.query_params.get('assigned_to')
+        if assignee is None:
+            groups = [
+                {
+                    'status': value,
+                    'status_display': label,
+                    'results': MaintenanceRequestListSerializer(
+                        queryset.filter(status=value)[:limit], many=True, context=context,
+                    ).data,
+                }
+                for value, label in open_statuses
+            ]
+            return Response({'groups': groups})
+
+        if assignee == 'me':
+            assignee = str(request.user.pk)
+        if not assignee.isdigit():
+            return Response({'error': 'Responsável inválido'}, status=status.HTTP_400_BAD_REQUEST)
+        # One range scan per open status, merged: each is already in queue order
+        rows = heapq.merge(
+            *[queryset.filter(assigned_to=assignee, status=value)[:limit] for value, _ in open_statuses],
+            key=lambda obj: (-obj.priority, obj.created_at, obj.id),
+        )
+        page = list(islice(rows, limit))
+        return Response({'groups': [{
+            'assigned_to': int(assignee),
+            'results': MaintenanceRequestListSerializer(page, many=True, context=context).data,
+        }]})
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        # Served from the RequestCounter table, not from a scan of the requests
+        return Response(request_stats.read_stats())
+
+    @action(detail=False, methods=['get'])
+    def lead_times(self, request):
+        # Time spent per workflow stage (avg, p50, p90, SLA breaches), read from the daily
+        # rollups kept by `manage.py rollup_stages`. ?dimension=equipment|process|assigned_to,
+        # ?since= / ?until= (YYYY-MM-DD, day the stage ended), ?stage=
+        params = self.analytics_params(request)
+        if isinstance(params, Response):
+            return params
+        return Response({**params, 'results': analytics.summarize(**params)})
+
+    @action(detail=False, methods=['get'])
+    def sla(self, request):
+        # Same filters as lead_times, worst breach counts first
+        params = self.analytics_params(request)
+        if isinstance(params, Response):
+            return params
+        results = [
+            {name: row[name] for name in ('stage', 'stage_display', 'key', 'label', 'count', 'sla_seconds', 'breaches', 'breach_rate')}
+            for row in analytics.summarize(**params)
+        ]
+        results.sort(key=lambda row: -row['breaches'])
+        return Response({**params, 'results': results})
+
+    def analytics_params(self, request):
+        params = {
+            'dimension': request.query_params.get('dimension', 'total'),
+            'since': request.query_params.get('since'),
+            'until': request.query_params.get('until'),
+            'stage': request.query_params.get('stage'),
+        }
+        if params['dimension'] not in analytics.DIMENSIONS:
+            return Response({'error': 'Dimensão inválida'}, status=status.HTTP_400_BAD_REQUEST)
+        if params['stage'] and params['stage'] not in analytics.STAGES:
+            return Response({'error': 'Etapa inválida'}, status=status.HTTP_400_BAD_REQUEST)
+        for name in ('since', 'until'):
+            if params[name]:
+                try:
+                    params[name] = parse_date(params[name])
+                except ValueError:
+                    params[name] = None
+                if params[name] is None:
+                    return Response({'error': f'Data inválida em {name} (use AAAA-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        return params
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        # Delta sync: ?since=<cursor> returns what changed after it, oldest first, each object
+        # once with its current data (or deleted: true). Without ?since= only the current
+        # cursor is returned: take it, load the list, then poll with it.
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'cursor': request_changes.current_cursor(), 'has_more': False, 'changes': []})
+        if not since.isdigit():
+            return Response({'error': 'Cursor inválido'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = request.query_params.get('limit', '')
+        limit = min(int(limit), self.CHANGES_LIMIT) if limit.isdigit() and int(limit) > 0 else self.CHANGES_LIMIT
+        try:
+            entries, cursor, has_more = request_changes.read(int(since), limit)
+        except request_changes.CursorExpired:
+            return Response({'error': 'Cursor expirado. Recarregue a lista completa.'}, status=status.HTTP_410_GONE)
+
+        request_ids = [entry.object_id for entry in entries if entry.model == 'request' and not entry.deleted]
+        history_ids = [entry.object_id for entry in entries if entry.model == 'history' and not entry.deleted]
+        found = {
+            'request': MaintenanceRequest.objects.select_related('requester', 'assigned_to').in_bulk(request_ids),
+            'history': RequestHistory.objects.select_related('actor').in_bulk(history_ids),
+        }
+        context = self.get_serializer_context()
+        results = []
+        for entry in entries:
+            obj = None if entry.deleted else found[entry.model].get(entry.object_id)
+            item = {'seq': entry.seq, 'model': entry.model, 'id': entry.object_id, 'deleted': obj is None}
+            if entry.model == 'request' and obj is not None:
+                item['data'] = MaintenanceRequestListSerializer(obj, context=context).data
+            elif obj is not None:
+                item['request'] = obj.request_id
+                item['data'] = RequestHistorySerializer(obj, context=context).data
+            results.append(item)
+        return Response({'cursor': cursor, 'has_more': has_more, 'changes': results})
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        # The whole history, newest first, in keyset pages (?cursor=, ?page_size=)
+        if not str(pk).isdigit():
+            raise Http404
+        context = self.get_serializer_context()
+        if not MaintenanceRequest.objects.filter(pk=pk).exists():
+            # An archived request keeps its history in one row: a single page
+            obj = archive.load([int(pk)], with_history=True).get(int(pk))
+            if obj is None:
+                raise Http404
+            entries = RequestHistorySerializer(obj.archived_history[::-1], many=True, context=context).data
+            return Response({'next': None, 'previous': None, 'results': entries})
+        paginator = HistoryCursorPagination()
+        page = paginator.paginate_queryset(
+            RequestHistory.objects.filter(request_id=pk).select_related('actor'), request, view=self,
+        )
+        return paginator.get_paginated_response(RequestHistorySerializer(page, many=True, context=context).data)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # Same filters as the list (?status=, ?search=), archive included as in the list,
+        # streamed as CSV or ?file_format=xlsx
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in request_export.STREAMS:
+            return Response({'error': 'Formato inválido. Use csv ou xlsx.'}, status=status.HTTP_400_BAD_REQUEST)
+        archived = self.filter_archived(ArchivedRequest.objects.all()) if self.includes_archive() else None
+        return request_export.streaming_response(self.get_queryset(), file_format, archived)
+
+    @transaction.atomic
     def perform_create(self, serializer):
         # When created, status is OPEN. Notify Production Approver.
         instance = serializer.save(requester=self.request.user)
-        self._send_notification('APPROVER_PROD', instance, 'Nova Pendência Criada')
+        request_stats.record_created(instance)
+        images.schedule(instance)
+        events.publish_on_commit('created', [instance])
+        notifications.notify_role('APPROVER_PROD', instance, 'Nova Pendência Criada')
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        before = request_stats.snapshot(serializer.instance)
+        replaced = [field for field in images.IMAGE_FIELDS if field in serializer.validated_data]
+        images.reset_variants(serializer.instance, replaced)
+        instance = serializer.save()
+        if {'gut_gravity', 'gut_urgency', 'gut_tendency'} & serializer.validated_data.keys():
+            # The database recomputed it; the instance still holds the old product
+            instance.refresh_from_db(fields=['priority'])
+        request_stats.record_change(before, instance)
+        if replaced:
+            images.schedule(instance)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        request_stats.record_deleted(instance)
+        events.publish_on_commit('deleted', [instance])
+        instance.delete()
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def approve_production(self, request, pk=None):
         instance = self.get_object()
-        if instance.status != 'OPEN':
-             return Response({'error': 'Status inválido para aprovação de produção'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        instance.status = 'WAITING_MAINT'
-        instance.save()
-        
-        self._log_history(instance, 'APPROVED_PROD', request.user, request.data.get('comment', ''))
-        self._send_notification('APPROVER_MAINT', instance, 'Pendência Aprovada pela Produção')
-        
+        error = self._apply_transition(instance, 'approve_production', request.data.get('comment', ''))
+        if error:
+            return error
+
         return Response(self.get_serializer(instance).data)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def reject_production(self, request, pk=None):
         instance = self.get_object()
-        instance.status = 'REJECTED'
-        instance.save()
-        
-        self._log_history(instance, 'REJECTED_PROD', request.user, request.data.get('comment', ''))
+        error = self._apply_transition(instance, 'reject_production', request.data.get('comment', ''))
+        if error:
+            return error
         # Notify requester (could be implemented if we stored requester email)
-        
+
         return Response(self.get_serializer(instance).data)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def approve_maintenance(self, request, pk=None):
         instance = self.get_object()
-        if instance.status != 'WAITING_MAINT':
-             return Response({'error': 'Status inválido para aprovação de manutenção'}, status=status.HTTP_400_BAD_REQUEST)
-        
+        try:
+            workflow.check_transition(instance, 'approve_maintenance_technical')
+        except workflow.TransitionError as exc:
+            return Response({'error': str(exc)}, status=exc.status_code)
+
         request_type = request.data.get('type')
         if not request_type:
             return Response({'error': 'É necessário definir o tipo da demanda (Técnica ou Engenharia)'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        instance.type = request_type
 
         if request_type == 'TECHNICAL':
             executor_id = request.data.get('executor_id')
             if not executor_id:
                 return Response({'error': 'É necessário selecionar um executante para demandas técnicas'}, status=status.HTTP_400_BAD_REQUEST)
-            
+
             try:
                 executor = User.objects.get(id=executor_id)
-                instance.assigned_to = executor
-                instance.status = 'IN_EXECUTION'
-                instance.save()
-                
-                self._log_history(instance, 'APPROVED_MAINT_TECH', request.user, f"Atribuído a {executor.username}")
-                # Notify Executor
-                self._send_notification_to_user(executor, instance, 'Nova Demanda Técnica Atribuída')
-            except User.DoesNotExist:
+            except (User.DoesNotExist, ValueError, TypeError):
                 return Response({'error': 'Executante não encontrado'}, status=status.HTTP_400_BAD_REQUEST)
 
+            error = self._apply_transition(
+                instance, 'approve_maintenance_technical', f"Atribuído a {executor.username}",
+                type=request_type, assigned_to=executor,
+            )
+            if error:
+                return error
+
         elif request_type == 'ENGINEERING':
-            instance.status = 'WAITING_MANAGER'
-            instance.save()
-            
-            self._log_history(instance, 'APPROVED_MAINT_ENG', request.user, 'Encaminhado para Gerência')
-            self._send_notification('MANAGER_MAINT', instance, 'Nova Demanda de Engenharia para Aprovação')
-        
+            error = self._apply_transition(
+                instance, 'approve_maintenance_engineering', 'Encaminhado para Gerência', type=request_type,
+            )
+            if error:
+                return error
+
         else:
             return Response({'error': 'Tipo de demanda inválido'}, status=status.HTTP_400_BAD_REQUEST)
-        
+
         return Response(self.get_serializer(instance).data)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def approve_manager(self, request, pk=None):
         instance = self.get_object()
-        if instance.status != 'WAITING_MANAGER':
-             return Response({'error': 'Status inválido para aprovação da gerência'}, status=status.HTTP_400_BAD_REQUEST)
-        
+        try:
+            workflow.check_transition(instance, 'approve_manager')
+        except workflow.TransitionError as exc:
+            return Response({'error': str(exc)}, status=exc.status_code)
+
         engineer_id = request.data.get('engineer_id')
         if not engineer_id:
             return Response({'error': 'É necessário selecionar um engenheiro responsável'}, status=status.HTTP_400_BAD_REQUEST)
-        
+
         try:
             engineer = User.objects.get(id=engineer_id)
-            instance.assigned_to = engineer
-            instance.status = 'IN_EXECUTION'
-            instance.save()
-            
-            self._log_history(instance, 'APPROVED_MANAGER', request.user, f"Atribuído a {engineer.username}")
-            # Notify Engineer
-            self._send_notification_to_user(engineer, instance, 'Nova Demanda de Engenharia Atribuída')
-        except User.DoesNotExist:
+        except (User.DoesNotExist, ValueError, TypeError):
             return Response({'error': 'Engenheiro não encontrado'}, status=status.HTTP_400_BAD_REQUEST)
-        
+
+        error = self._apply_transition(instance, 'approve_manager', f"Atribuído a {engineer.username}", assigned_to=engineer)
+        if error:
+            return error
+
         return Response(self.get_serializer(instance).data)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def reject_maintenance(self, request, pk=None):
         instance = self.get_object()
-        instance.status = 'REJECTED' # Or return to OPEN/WAITING_PROD based on business rule
-        instance.save()
-        
-        self._log_history(instance, 'REJECTED_MAINT', request.user, request.data.get('comment', ''))
-        
+        error = self._apply_transition(instance, 'reject_maintenance', request.data.get('comment', ''))
+        if error:
+            return error
+
         return Response(self.get_serializer(instance).data)
 
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def finish_execution(self, request, pk=None):
         instance = self.get_object()
-        if instance.status != 'IN_EXECUTION':
-             return Response({'error': 'Status inválido para finalizar execução'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        instance.status = 'DONE'
-        instance.execution_description = request.data.get('execution_description', '')
-        instance.pm04_order = request.data.get('pm04_order', '')
-        instance.technician_name = request.data.get('technician_name', '')
-        instance.observation = request.data.get('observation', '') # Capture final observation
-        from django.utils import timezone
-        instance.finished_at = timezone.now()
-        instance.save()
-        
-        self._log_history(instance, 'FINISHED', request.user, request.data.get('comment', ''))
-        
+        error = self._apply_transition(
+            instance, 'finish_execution', request.data.get('comment', ''),
+            execution_description=request.data.get('execution_description', ''),
+            pm04_order=request.data.get('pm04_order', ''),
+            technician_name=request.data.get('technician_name', ''),
+            observation=request.data.get('observation', ''),  # Capture final observation
+            finished_at=timezone.now(),
+        )
+        if error:
+            return error
+
         return Response(self.get_serializer(instance).data)
 
-    def _log_history(self, request_obj, action, user, comment):
-        RequestHistory.objects.create(
-            request=request_obj,
-            action=action,
-            actor=user,
-            comment=comment
-        )
+    @action(detail=False, methods=['post'])
+    @transaction.atomic
+    def bulk_transition(self, request):
+        # Apply one workflow action to many requests: {"ids": [...], "transition": "approve_production",
+        # "comment": ..., plus "type"/"executor_id"/"engineer_id" where the action needs them}
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids or not all(str(pk).isdigit() for pk in ids):
+            return Response({'error': 'Informe a lista de demandas (ids)'}, status=status.HTTP_400_BAD_REQUEST)
+        ids = list(dict.fromkeys(int(pk) for pk in ids))
+        if len(ids) > self.BULK_TRANSITION_MAX:
+            return Response({'error': f'No máximo {self.BULK_TRANSITION_MAX} demandas por vez'}, status=status.HTTP_400_BAD_REQUEST)
 
-    def _send_notification(self, role_key, request_obj, subject):
-        try:
-            config = EmailConfiguration.objects.get(key=role_key)
-            recipient = config.email
-            message = f"Demanda #{request_obj.id} - {request_obj.title}\nStatus: {request_obj.get_status_display()}"
-            send_mail(
-                subject,
-                message,
-                'system@maintenance.com',
-                [recipient],
-                fail_silently=True,
-            )
-            print(f"Email enviado para {recipient}: {subject}")
-        except EmailConfiguration.DoesNotExist:
-            print(f"Configuração de email não encontrada para {role_key}")
-
-    def _send_notification_to_user(self, user, request_obj, subject):
-        if user.email:
-            message = f"Olá {user.first_name},\n\nA demanda #{request_obj.id} - '{request_obj.title}' foi atribuída a você.\n\nStatus: {request_obj.get_status_display()}\n\nAcesse o sistema para mais detalhes."
-            send_mail(
-                subject,
-                message,
-                'system@maintenance.com',
-                [user.email],
-                fail_silently=True,
-            )
-            print(f"Email enviado para {user.email}: {subject}")
+        action_name = request.data.get('transition')
+        comment = request.data.get('comment', '')
+        fields = {}
+        if action_name in ('approve_production', 'reject_production', 'reject_maintenance'):
+            name = action_name
+        elif action_name == 'approve_maintenance':
+            request_type = request.data.get('type')
+            if request_type == 'TECHNICAL':
+                try:
+                    executor = User.objects.get(id=request.data.get('executor_id'))
+                except (User.DoesNotExist, ValueError, TypeError):
+                    return Response({'error': 'Executante não encontrado'}, status=status.HTTP_400_BAD_REQUEST)
+                name, comment = 'approve_maintenance_technical', f"Atribuído a {executor.username}"
+                fields = {'type': request_type, 'assigned_to': executor}
+            elif request_type == 'ENGINEERING':
+                name, comment = 'approve_maintenance_engineering', 'Encaminhado para Gerência'
+                fields = {'type': request_type}
+            else:
+                return Response({'error': 'Tipo de demanda inválido'}, status=status.HTTP_400_BAD_REQUEST)
+        elif action_name == 'approve_manager':
+            try:
+                engineer = User.objects.get(id=request.data.get('engineer_id'))
+            except (User.DoesNotExist, ValueError, TypeError):
+                return Response({'error': 'Engenheiro não encontrado'}, status=status.HTTP_400_BAD_REQUEST)
+            name, comment = 'approve_manager', f"Atribuído a {engineer.username}"
+            fields = {'assigned_to': engineer}
         else:
-            print(f"Usuário {user.username} não possui email cadastrado.")
+            return Response({'error': 'Ação inválida'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results, applied = workflow.apply_bulk_transition(ids, name, request.user, comment, **fields)
+        notifications.notify_transition(workflow.TRANSITIONS[name], applied)
+
+        return Response({
+            'applied': len(applied),
+            'results': [{'id': pk, 'ok': results[pk] is None, 'error': results[pk]} for pk in ids],
+        })
+
+    def _apply_transition(self, instance, name, comment, **fields):
+        # Returns an error Response, or None once the transition is committed
+        try:
+            workflow.apply_transition(instance, name, self.request.user, comment, **fields)
+        except workflow.TransitionError as exc:
+            return Response({'error': str(exc)}, status=exc.status_code)
+        notifications.notify_transition(workflow.TRANSITIONS[name], [instance])
+        return None
 
 class EmailConfigurationViewSet(viewsets.ModelViewSet):
     queryset = EmailConfiguration.objects.all()
@@ -204,13 +607,48 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
     def get_queryset(self):
-        queryset = User.objects.all()
-        role = self.request.query_params.get('role', None)
-        if role is not None:
-            queryset = queryset.filter(profile__role=role)
-        return queryset
+        return directory.query(self.get_roles())
+
+    def get_roles(self):
+        # ?role=EXECUTOR, ?role=A&role=B or ?role__in=A,B
+        params = self.request.query_params
+        roles = params.getlist('role')
+        for value in params.getlist('role__in'):
+            roles += [role.strip() for role in value.split(',') if role.strip()]
+        return roles
+
+    def list(self, request, *args, **kwargs):
+        # Served from the user directory cache; no query in the common case
+        return Response(directory.get_users(self.get_roles()))
 
     @action(detail=False, methods=['get'])
     def me(self, request):
         serializer = self.get_serializer(request.user)
         return Response(serializer.data)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def events_ticket(request):
+    return Response({'ticket': events.issue_ticket(request.user)})
+
+
+async def events_stream(request):
+    # Server-sent events: ?ticket= from events/ticket/, optionally ?request=<id> for one
+    # request page; without it every change (the board). Each connection is an asyncio
+    # queue, so idle clients cost no thread. Needs the ASGI server (maintenance_system.asgi).
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Eventos em tempo real exigem o servidor ASGI.'}, status=501)
+    user_id = events.check_ticket(request.GET.get('ticket', ''))
+    if user_id is None or not await User.objects.filter(pk=user_id, is_active=True).aexists():
+        return JsonResponse({'error': 'Ticket inválido ou expirado.'}, status=403)
+    request_id = request.GET.get('request')
+    if request_id is not None and not request_id.isdigit():
+        return JsonResponse({'error': 'Parâmetro request inválido.'}, status=400)
+
+    events.start_listener()
+    subscription = events.broker.subscribe(int(request_id) if request_id else None)
+    response = StreamingHttpResponse(events.stream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,140 @@
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import events, changes as request_changes, history as request_history, stats as request_stats
+from .models import MaintenanceRequest, RequestHistory
+
+
+class TransitionError(Exception):
+    status_code = 400
+
+
+class TransitionConflict(TransitionError):
+    # Someone else moved the request between our read and our UPDATE
+    status_code = 409
+
+
+CONFLICT_MESSAGE = 'A demanda foi alterada por outro usuário. Recarregue e tente novamente.'
+
+
+class Transition:
+    def __init__(self, name, sources, target, history_action, invalid_message,
+                 notify_role=None, notify_assignee=False, notify_subject=''):
+        self.name = name
+        self.sources = sources
+        self.target = target
+        self.history_action = history_action
+        self.invalid_message = invalid_message
+        # Who is e-mailed once the transition commits (see notifications.notify_transition)
+        self.notify_role = notify_role
+        self.notify_assignee = notify_assignee
+        self.notify_subject = notify_subject
+
+
+# The whole workflow graph:
+#   OPEN -> WAITING_MAINT -> (TECHNICAL) IN_EXECUTION -> DONE
+#                         -> (ENGINEERING) WAITING_MANAGER -> IN_EXECUTION
+#   OPEN / WAITING_PROD -> REJECTED, WAITING_MAINT / WAITING_MANAGER -> REJECTED
+TRANSITIONS = {t.name: t for t in [
+    Transition('approve_production', ['OPEN'], 'WAITING_MAINT', 'APPROVED_PROD',
+               'Status inválido para aprovação de produção',
+               notify_role='APPROVER_MAINT', notify_subject='Pendência Aprovada pela Produção'),
+    Transition('reject_production', ['OPEN', 'WAITING_PROD'], 'REJECTED', 'REJECTED_PROD',
+               'Status inválido para rejeição da produção'),
+    Transition('approve_maintenance_technical', ['WAITING_MAINT'], 'IN_EXECUTION', 'APPROVED_MAINT_TECH',
+               'Status inválido para aprovação de manutenção',
+               notify_assignee=True, notify_subject='Nova Demanda Técnica Atribuída'),
+    Transition('approve_maintenance_engineering', ['WAITING_MAINT'], 'WAITING_MANAGER', 'APPROVED_MAINT_ENG',
+               'Status inválido para aprovação de manutenção',
+               notify_role='MANAGER_MAINT', notify_subject='Nova Demanda de Engenharia para Aprovação'),
+    Transition('approve_manager', ['WAITING_MANAGER'], 'IN_EXECUTION', 'APPROVED_MANAGER',
+               'Status inválido para aprovação da gerência',
+               notify_assignee=True, notify_subject='Nova Demanda de Engenharia Atribuída'),
+    Transition('reject_maintenance', ['WAITING_MAINT', 'WAITING_MANAGER'], 'REJECTED', 'REJECTED_MAINT',
+               'Status inválido para rejeição da manutenção'),
+    Transition('finish_execution', ['IN_EXECUTION'], 'DONE', 'FINISHED',
+               'Status inválido para finalizar execução'),
+]}
+
+
+def check_transition(instance, name):
+    transition = TRANSITIONS[name]
+    if instance.status not in transition.sources:
+        raise TransitionError(transition.invalid_message)
+    return transition
+
+
+def apply_transition(instance, name, actor, comment='', **fields):
+    # Compare-and-swap: UPDATE ... SET <changed fields> WHERE id = %s AND status = <status we read>.
+    # Of N concurrent callers that read the same status only one matches; the others get
+    # TransitionConflict. The history row and counters are written in the same transaction;
+    # inside request_history.batch() the row joins the batch's INSERT.
+    transition = check_transition(instance, name)
+    before = request_stats.snapshot(instance)
+    changes = dict(fields, status=transition.target, updated_at=timezone.now())
+
+    with transaction.atomic():
+        updated = MaintenanceRequest.objects.filter(pk=instance.pk, status=instance.status).update(**changes)
+        if not updated:
+            raise TransitionConflict(CONFLICT_MESSAGE)
+        for field, value in changes.items():
+            setattr(instance, field, value)
+        request_changes.record('request', [instance.pk])
+        request_history.append(instance, transition.history_action, actor, comment)
+        request_stats.record_change(before, instance)
+        events.publish_on_commit('transition', [instance])
+    return instance
+
+
+def apply_bulk_transition(ids, name, actor, comment='', **fields):
+    # The same transition on many requests: one SELECT to validate them all, one conditional
+    # UPDATE per source status, one bulk INSERT of history. Returns ({id: error or None}, applied).
+    transition = TRANSITIONS[name]
+    found = MaintenanceRequest.objects.in_bulk(ids)
+    results = {}
+    by_source = {}
+    for pk in ids:
+        instance = found.get(pk)
+        if instance is None:
+            results[pk] = 'Demanda não encontrada'
+        elif instance.status not in transition.sources:
+            results[pk] = transition.invalid_message
+        else:
+            by_source.setdefault(instance.status, []).append(instance)
+
+    applied = []
+    deltas = Counter()
+    stamp = timezone.now()
+    changes = dict(fields, status=transition.target, updated_at=stamp)
+    with transaction.atomic():
+        for source, instances in by_source.items():
+            pks = [instance.pk for instance in instances]
+            updated = MaintenanceRequest.objects.filter(pk__in=pks, status=source).update(**changes)
+            if updated == len(pks):
+                won = set(pks)
+            else:
+                # Some rows were moved concurrently; ours are the ones carrying our stamp
+                won = set(MaintenanceRequest.objects.filter(
+                    pk__in=pks, status=transition.target, updated_at=stamp,
+                ).values_list('pk', flat=True))
+            for instance in instances:
+                if instance.pk not in won:
+                    results[instance.pk] = CONFLICT_MESSAGE
+                    continue
+                deltas.subtract(request_stats.snapshot(instance))
+                for field, value in changes.items():
+                    setattr(instance, field, value)
+                deltas.update(request_stats.snapshot(instance))
+                results[instance.pk] = None
+                applied.append(instance)
+
+        request_changes.record('request', [instance.pk for instance in applied])
+        request_history.write(
+            RequestHistory(request=instance, action=transition.history_action, actor=actor, comment=comment)
+            for instance in applied
+        )
+        request_stats.apply_deltas(deltas)
+        events.publish_on_commit('transition', applied)
+    return results, applied
@@ -19,4 +19,78 @@ api.interceptors.request.use(
     (error) => Promise.reject(error)
 );
 
+// Live change events (server-sent, served by the ASGI app). params: {} for every request
+// or { request: id } for one. onEvent receives { event, id, status, status_display,
+// assigned_to, updated_at }, or { event: 'resync' } when events may have been missed.
+// Under WSGI (runserver, Gunicorn) there is no stream: onEvent gets a resync every
+// POLL_INTERVAL instead, and the page reloads (a 304 when nothing changed).
+const POLL_INTERVAL = 30000;
+const RETRY_BASE = 3000;
+const RETRY_MAX = 300000;
+
+// Probed once per page load: events/ answers 501 under WSGI, 403 (no ticket) under ASGI
+let streamAvailable = null;
+const eventsAvailable = () => {
+    if (!streamAvailable) {
+        streamAvailable = api.get('events/').then(() => true, (error) => error.response?.status !== 501);
+    }
+    return streamAvailable;
+};
+
+export const subscribeToChanges = (params, onEvent) => {
+    let source = null;
+    let timer = null;
+    let closed = false;
+    let connected = false;
+    let failures = 0;
+
+    const retry = () => {
+        if (closed) return;
+        // Exponential backoff, capped: a down server is not hammered by every open page
+        const delay = Math.min(RETRY_BASE * 2 ** failures, RETRY_MAX);
+        failures += 1;
+        timer = setTimeout(connect, delay);
+    };
+
+    const connect = async () => {
+        try {
+            // EventSource cannot send the token header: trade it for a short-lived ticket
+            const { data } = await api.post('events/ticket/');
+            if (closed) return;
+            const query = new URLSearchParams({ ...params, ticket: data.ticket });
+            source = new EventSource(`${api.defaults.baseURL}events/?${query}`);
+            source.onopen = () => {
+                if (connected) onEvent({ event: 'resync' });
+                connected = true;
+                failures = 0;
+            };
+            ['created', 'transition', 'deleted', 'resync'].forEach((type) => {
+                source.addEventListener(type, (e) => onEvent({ ...JSON.parse(e.data), event: type }));
+            });
+            source.onerror = () => {
+                // The ticket is single-use in practice (it expires): reconnect with a new one
+                source.close();
+                retry();
+            };
+        } catch (error) {
+            retry();
+        }
+    };
+
+    eventsAvailable().then((available) => {
+        if (closed) return;
+        if (available) {
+            connect();
+        } else {
+            timer = setInterval(() => onEvent({ event: 'resync' }), POLL_INTERVAL);
+        }
+    });
+    return () => {
+        closed = true;
+        clearTimeout(timer);
+        clearInterval(timer);
+        if (source) source.close();
+    };
+};
+
 export default api;
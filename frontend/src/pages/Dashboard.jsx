@@ -1,5 +1,5 @@
-import React, { useEffect, useState, useCallback } from 'react';
-import api from '../api';
+import React, { useEffect, useState, useCallback, useRef } from 'react';
+import api, { subscribeToChanges } from '../api';
 import { Link, useNavigate } from 'react-router-dom';
 import { Plus, Search, LogOut, Moon, Sun, ChevronLeft, ChevronRight, Eye, LayoutDashboard, FileText, AlertCircle, Wrench, CheckCircle2, List, Kanban } from 'lucide-react';
 import { useTheme } from '../ThemeContext';
@@ -71,6 +71,23 @@ const Dashboard = () => {
         fetchRequests(currentPage, searchTerm);
     }, [viewMode, currentPage]);
 
+    // Live updates: status changes are patched in place, anything else reloads the page
+    const refreshRef = useRef();
+    refreshRef.current = () => fetchRequests(currentPage, searchTerm);
+    useEffect(() => subscribeToChanges({}, (event) => {
+        if (event.event === 'transition') {
+            setRequests((current) => current.map((req) => (req.id === event.id ? {
+                ...req,
+                status: event.status,
+                status_display: event.status_display,
+                assigned_to: event.assigned_to,
+                updated_at: event.updated_at,
+            } : req)));
+        } else {
+            refreshRef.current();
+        }
+    }), []);
+
     const handleLogout = () => {
         localStorage.removeItem('token');
         navigate('/');
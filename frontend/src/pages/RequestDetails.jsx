@@ -1,5 +1,5 @@
 import React, { useEffect, useState } from 'react';
-import api from '../api';
+import api, { subscribeToChanges } from '../api';
 import { useParams, useNavigate } from 'react-router-dom';
 import { ArrowLeft, Check, X, Play, CheckCircle, ShieldCheck, Wrench, FileCheck, User, Calendar, AlertCircle, XCircle, Clock, FileText, Camera } from 'lucide-react';
 
@@ -41,12 +41,9 @@ const RequestDetails = () => {
 
         const fetchUsers = async () => {
             try {
-                const execResponse = await api.get('users/?role=EXECUTOR');
-                setExecutors(execResponse.data);
-
-                const mechResponse = await api.get('users/?role=ENGINEER_MECH');
-                const elecResponse = await api.get('users/?role=ENGINEER_ELEC');
-                setEngineers([...mechResponse.data, ...elecResponse.data]);
+                const response = await api.get('users/?role__in=EXECUTOR,ENGINEER_MECH,ENGINEER_ELEC');
+                setExecutors(response.data.filter(user => user.role === 'EXECUTOR'));
+                setEngineers(response.data.filter(user => user.role !== 'EXECUTOR'));
             } catch (error) {
                 console.error('Erro ao buscar usuários', error);
             }
@@ -56,6 +53,16 @@ const RequestDetails = () => {
         fetchUsers();
     }, [id]);
 
+    // Someone else acted on this request: reload it (a 304 when nothing changed)
+    useEffect(() => subscribeToChanges({ request: id }, async () => {
+        try {
+            const response = await api.get(`requests/${id}/`);
+            setRequest(response.data);
+        } catch (error) {
+            console.error('Erro ao atualizar a demanda', error);
+        }
+    }), [id]);
+
     const handleAction = async (actionType) => {
         try {
             let payload = { comment };
@@ -197,10 +204,11 @@ const RequestDetails = () => {
                                 <div>
                                     <span className="text-slate-500 block text-xs uppercase font-bold mb-1">Foto</span>
                                     <img
-                                        src={request.photo}
+                                        src={request.photo_thumbnail || request.photo}
                                         alt="Evidência"
+                                        loading="lazy"
                                         className="rounded-lg h-24 w-full object-cover cursor-pointer hover:opacity-80 transition-opacity"
-                                        onClick={() => setSelectedImage(request.photo)}
+                                        onClick={() => setSelectedImage(request.photo_webp || request.photo)}
                                     />
                                 </div>
                             )}
@@ -9,8 +9,22 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'maintenance_system.settings')
 
-application = get_asgi_application()
+
+class AsyncReadsHandler(ASGIHandler):
+    # URLs come from maintenance_system.urls_asgi: the read-heavy GETs of the API run on
+    # async views (core.async_views), everything else as under WSGI
+    urlconf = 'maintenance_system.urls_asgi'
+
+    async def get_response_async(self, request):
+        request.urlconf = self.urlconf
+        return await super().get_response_async(request)
+
+
+# What get_asgi_application() does, with the handler above
+django.setup(set_prefix=False)
+application = AsyncReadsHandler()
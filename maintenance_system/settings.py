@@ -45,7 +45,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -56,6 +56,8 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack (see core.metrics)
+    'core.metrics.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -84,6 +86,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'maintenance_system.wsgi.application'
+ASGI_APPLICATION = 'maintenance_system.asgi.application'
 
 
 # Database
@@ -93,6 +96,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file, not the in-memory default, so tests can run writers on concurrent connections
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -137,15 +142,76 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploaded photos are re-encoded (upright, no EXIF, capped size) with a thumbnail and a
+# WebP variant by core.images, in a background thread after the upload commits
+IMAGE_PIPELINE_ASYNC = True
+IMAGE_MAX_SIZE = (1920, 1920)
+IMAGE_THUMBNAIL_SIZE = (320, 320)
+
+# Uploads are served by core.media.serve_media behind signed URLs. With 'x-accel-redirect'
+# (nginx, internal location at MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or
+# 'x-sendfile' (Apache/lighttpd) Django only checks access and the web server sends the file.
+MEDIA_DELIVERY = 'django'
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_SECONDS = 24 * 3600
+
 # CORS Settings
 CORS_ALLOW_ALL_ORIGINS = True # For development only
 # CORS_ALLOWED_ORIGINS = [
 #     "http://localhost:5173",
 # ]
 
+# Cache (user directory). LocMemCache is per process: with several Gunicorn workers use a
+# shared backend (e.g. django.core.cache.backends.redis.RedisCache) so a user edit
+# invalidates every worker at once instead of after USER_DIRECTORY_CACHE_SECONDS.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+USER_DIRECTORY_CACHE_SECONDS = 300
+
+# API tokens are resolved to the user and profile from a per-process LRU (core.authentication).
+# Logout, token rotation, deactivation and profile edits drop the entry in this process
+# and, with TOKEN_CACHE_SHARED (a shared cache as above), everywhere; other workers' LRU
+# copies live at most TOKEN_CACHE_SECONDS, so keep it short when it must be tight.
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_SECONDS = 60
+TOKEN_CACHE_SHARED = False
+
 # Email Backend (Console for Dev)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Notifications are queued in core.NotificationOutbox and delivered by
+# `python manage.py send_notifications --loop`
+NOTIFICATION_FROM_EMAIL = 'system@maintenance.com'
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_RETRY_BASE_SECONDS = 60
+
+# Per-route timings as Prometheus text at /metrics/, for scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>" (without a token only with DEBUG), and in a
+# Server-Timing header when PERF_SERVER_TIMING is on (None: with DEBUG). Both expose
+# routes and timings: keep them off public traffic. Opt-in query log (logger core.metrics.queries):
+# statements slower than PERF_SLOW_QUERY_MS, or run PERF_REPEATED_QUERY_LIMIT times in
+# one request, logged with the project code that ran them.
+METRICS_TOKEN = None
+PERF_SERVER_TIMING = None
+PERF_SLOW_QUERY_MS = None
+PERF_REPEATED_QUERY_LIMIT = None
+
+# Closed requests untouched for this many days are moved to core.ArchivedRequest by
+# `python manage.py archive_requests` (the API still serves them, read-only)
+ARCHIVE_AFTER_DAYS = 365
+
+# Request detail embeds only the latest entries of its history (history_truncated tells
+# there are older ones); the whole history is paged at requests/{id}/history/
+HISTORY_EMBED_LIMIT = 20
+
+# Stage lead times (requests/lead_times/, requests/sla/) are read from daily rollups kept
+# by `python manage.py rollup_stages --loop`. SLA per stage, in hours (see core.analytics);
+# after changing it run `rollup_stages --rebuild` to recount past breaches.
+# STAGE_SLA_HOURS = {'OPEN': 24, 'WAITING_PROD': 24, 'WAITING_MAINT': 48, 'WAITING_MANAGER': 72, 'IN_EXECUTION': 168}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,13 @@
+"""
+URL configuration of the ASGI app (maintenance_system.asgi): the project's URLs, with the
+API resolved through core.urls.asgi_urlpatterns first.
+"""
+from django.urls import include, path
+
+from core.urls import asgi_urlpatterns
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('api/', include(asgi_urlpatterns)),
+    *wsgi_urlpatterns,
+]